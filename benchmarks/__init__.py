@@ -0,0 +1,5 @@
+"""
+Microbenchmarks of the supervisor's hot paths.
+
+Run with `python -m benchmarks --help` for options.
+"""
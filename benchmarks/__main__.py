@@ -0,0 +1,45 @@
+"""
+Run the microbenchmarks and optionally save the results as a JSON baseline or
+compare them to a previously saved one.
+"""
+
+import argparse
+import os
+import sys
+import tempfile
+
+# The supervisor keeps its configuration and files in the instance directory,
+# so point it to a throwaway one before importing any benchmarks.
+os.environ.setdefault("INSTANCE_PATH", tempfile.mkdtemp(prefix="wasmiot-bench-"))
+os.environ.setdefault("FLASK_APP", "benchmarks")
+
+from benchmarks import harness  # pylint: disable=wrong-import-position
+from benchmarks import bench_wasm, bench_deployment, bench_startup  # pylint: disable=wrong-import-position,unused-import
+
+
+def main() -> int:
+    """Parse arguments and run the benchmarks."""
+    parser = argparse.ArgumentParser(prog="python -m benchmarks", description=__doc__)
+    parser.add_argument("-k", "--filter", default="", help="Run only benchmarks whose full name contains this")
+    parser.add_argument("--max-time", type=float, default=harness.DEFAULT_MAX_TIME,
+                        help="Seconds to spend measuring each benchmark")
+    parser.add_argument("--save", metavar="PATH", help="Save the results as JSON baseline to PATH")
+    parser.add_argument("--compare", metavar="PATH", help="Compare the results to JSON baseline at PATH")
+    parser.add_argument("--threshold", type=float, default=10.0,
+                        help="Percentage of slowdown in mean time considered a regression")
+    args = parser.parse_args()
+
+    results = harness.run(args.filter, args.max_time)
+    if args.save:
+        harness.save(results, args.save)
+        print(f"\nSaved results to {args.save}")
+    if args.compare:
+        regressions = harness.compare(results, args.compare, args.threshold)
+        if regressions:
+            print(f"\n{len(regressions)} benchmark(s) regressed over {args.threshold}%")
+            return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
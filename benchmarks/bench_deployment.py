@@ -0,0 +1,123 @@
+"""
+Benchmarks of interpreting deployment manifests and preparing the files and
+calls of a deployment's functions.
+"""
+
+import copy
+import os
+from pathlib import Path
+import tempfile
+
+from benchmarks.harness import Benchmark, register
+from host_app.flask_app import app as flask_app
+from host_app.utils.deployment import CallData, Deployment
+from host_app.utils.endpoint import Endpoint
+from host_app.wasm_utils.wasm_api import ModuleConfig
+
+
+def endpoint(path: str, parameters: int = 2, media_type: str = "application/json") -> dict:
+    """Return an endpoint description like the ones in deployment manifests."""
+    return {
+        "url": "http://localhost:5000/",
+        "path": path,
+        "method": "get",
+        "request": {
+            "parameters": [{"name": f"param{i}", "in": "query", "required": True} for i in range(parameters)],
+        },
+        "response": {
+            "media_type": media_type,
+            "schema": {"type": "integer"},
+        },
+    }
+
+
+def manifest(module_count: int, function_count: int) -> dict:
+    """Return a synthetic deployment manifest with the given amount of modules and functions."""
+    endpoints, mounts, instructions = {}, {}, {}
+    for module_index in range(module_count):
+        module_name = f"module{module_index}"
+        endpoints[module_name], mounts[module_name], instructions[module_name] = {}, {}, {}
+        for function_index in range(function_count):
+            function_name = f"function{function_index}"
+            this = endpoint(f"/{module_name}/{function_name}")
+            endpoints[module_name][function_name] = this
+            mounts[module_name][function_name] = {
+                "deployment": [{"path": "model.bin", "media_type": "application/octet-stream", "stage": "deployment"}],
+                "execution": [{"path": "input.bin", "media_type": "application/octet-stream", "stage": "execution"}],
+                "output": [{"path": "output.bin", "media_type": "application/octet-stream", "stage": "output"}],
+            }
+            instructions[module_name][function_name] = {
+                "from": this,
+                "to": endpoint(f"/next/{function_name}"),
+            }
+    return {
+        "modules": [
+            ModuleConfig(id=name, name=name, path=name, data_files={"model.bin": Path(name, "model.bin")})
+            for name in endpoints
+        ],
+        "endpoints": endpoints,
+        "instructions": {"modules": instructions},
+        "mounts": mounts,
+    }
+
+
+def deployment_from(data: dict) -> Deployment:
+    """Create a deployment without runtimes from a synthetic manifest."""
+    return Deployment(
+        "bench",
+        runtimes={},
+        _modules=data["modules"],
+        endpoints=data["endpoints"],
+        _instructions=data["instructions"],
+        _mounts=data["mounts"],
+    )
+
+
+@register("deployment", modules=[1, 10, 50], functions=[20])
+def deployment_post_init(benchmark: Benchmark, modules: int, functions: int):
+    """Interpret the endpoints, mounts and instructions of a manifest."""
+    data = manifest(modules, functions)
+
+    def setup():
+        # Interpreting mutates the manifest, so each round needs a fresh copy.
+        return (copy.deepcopy(data),), {}
+
+    benchmark.pedantic(deployment_from, setup=setup, rounds=20)
+
+
+@register("deployment", size=[64 * 1024, 1024 * 1024, 16 * 1024 * 1024])
+def connect_request_files_to_mounts(benchmark: Benchmark, size: int):
+    """Move a received input file and deployment files to the module's mounts."""
+    params_folder = Path(tempfile.mkdtemp(prefix="wasmiot-bench-"))
+    flask_app.INSTANCE_PARAMS_FOLDER = params_folder
+
+    deployment = deployment_from(manifest(1, 1))
+    module = deployment.modules["module0"]
+    mount_dir = params_folder / module.name
+    mount_dir.mkdir(parents=True)
+    model_path = mount_dir / "model.bin"
+    model_path.write_bytes(os.urandom(1024))
+    module.data_files = {"model.bin": model_path}
+
+    input_path = params_folder / "input.bin"
+    input_path.write_bytes(os.urandom(size))
+
+    benchmark.extra_info["bytes"] = size
+    benchmark(
+        deployment._connect_request_files_to_mounts,  # pylint: disable=protected-access
+        module.name,
+        "function0",
+        {"input.bin": str(input_path)},
+    )
+
+
+@register("call_data", args=["str", "list", "none"])
+def call_data_from_endpoint(benchmark: Benchmark, args: str):
+    """Fill in the URL of the next call in a chain."""
+    target = Endpoint(**endpoint("/next/function", parameters=4))
+    call_args = {
+        "str": "42",
+        "list": ["1", "2", "3", "4"],
+        "none": None,
+    }[args]
+    benchmark(CallData.from_endpoint, target, call_args, ["output.bin"])
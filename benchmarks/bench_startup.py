@@ -0,0 +1,51 @@
+"""
+Benchmarks of starting the supervisor: the time and memory it takes to import
+its modules in a fresh interpreter.
+"""
+
+import json
+import subprocess
+import sys
+
+from benchmarks.harness import Benchmark, register
+
+
+HEAVY_MODULES = ["cv2", "numpy", "adafruit_dht", "board", "wasm3", "wasmtime", "zeroconf", "sentry_sdk"]
+"""Dependencies that should only be imported when they are needed."""
+
+IMPORT_SCRIPT = """
+import json, resource, sys
+from time import perf_counter
+start = perf_counter()
+import {module}
+seconds = perf_counter() - start
+print(json.dumps({{
+    "seconds": seconds,
+    "max_rss_bytes": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024,
+    "imported": [name for name in {heavy_modules!r} if name in sys.modules],
+}}))
+"""
+
+
+def import_in_subprocess(module: str) -> dict:
+    """Import the module in a new interpreter and return what it took."""
+    script = IMPORT_SCRIPT.format(module=module, heavy_modules=HEAVY_MODULES)
+    completed = subprocess.run(
+        [sys.executable, "-c", script], capture_output=True, text=True, check=True, timeout=120
+    )
+    # The supervisor may print while being imported, so the result is the last line.
+    return json.loads(completed.stdout.strip().splitlines()[-1])
+
+
+@register("startup", module=["host_app.flask_app.app", "host_app.wasm_utils.wasmtime"])
+def import_module(benchmark: Benchmark, module: str):
+    """Start an interpreter and import a module of the supervisor."""
+    reports = []
+
+    def target():
+        reports.append(import_in_subprocess(module))
+
+    benchmark.pedantic(target, rounds=5)
+    benchmark.extra_info["import_seconds"] = min(report["seconds"] for report in reports)
+    benchmark.extra_info["max_rss_bytes"] = max(report["max_rss_bytes"] for report in reports)
+    benchmark.extra_info["heavy_modules_imported"] = reports[-1]["imported"]
@@ -0,0 +1,85 @@
+"""
+Benchmarks of loading Wasm modules, calling their functions and moving data in
+and out of their linear memory.
+"""
+
+import os
+import shutil
+from pathlib import Path
+import tempfile
+
+from benchmarks.harness import Benchmark, register
+from host_app.wasm_utils.wasm_api import ModuleConfig
+from host_app.wasm_utils.wasm3 import Wasm3Runtime
+from host_app.wasm_utils import module_cache
+from host_app.wasm_utils.wasmtime import WasmtimeModule, WasmtimeRuntime
+
+
+FIXTURES = Path(__file__).parent / "fixtures"
+TINY_MODULE = FIXTURES / "tiny.wasm"
+
+PAYLOAD_SIZES = [64, 4 * 1024, 64 * 1024, 1024 * 1024]
+"""Sizes (in bytes) of data moved to and from Wasm memory."""
+
+PAYLOAD_ADDRESS = 1024
+
+
+def tiny_module_config() -> ModuleConfig:
+    """Copy the tiny module into a temporary directory and return its config."""
+    directory = tempfile.mkdtemp(prefix="wasmiot-bench-")
+    path = os.path.join(directory, "tiny")
+    shutil.copyfile(TINY_MODULE, path)
+    return ModuleConfig(id="tiny", name="tiny", path=path, data_files={})
+
+
+def load_tiny_module(runtime_name: str):
+    """Return the tiny module loaded into a new runtime of the given type."""
+    runtime = WasmtimeRuntime() if runtime_name == "wasmtime" else Wasm3Runtime()
+    module = runtime.load_module(tiny_module_config())
+    # Make sure the memory is large enough for the largest payload.
+    pages_needed = (PAYLOAD_ADDRESS + max(PAYLOAD_SIZES)) // (64 * 1024) + 1
+    if isinstance(module, WasmtimeModule):
+        memory = module.get_memory()
+        memory.grow(runtime.store, pages_needed)
+    else:
+        module.run_function("grow", [pages_needed])
+    return runtime, module
+
+
+@register("load_module", source=["compile", "deserialize"])
+def wasmtime_load_module(benchmark: Benchmark, source: str):
+    """Compile a module from source or deserialize a previously compiled one."""
+    cache = module_cache.configure(Path(tempfile.mkdtemp(prefix="wasmiot-bench-cache-")))
+    runtime = WasmtimeRuntime()
+    module = WasmtimeModule(tiny_module_config(), runtime)
+
+    def setup():
+        if source == "compile":
+            cache.discard(cache.path_for(module.path))
+
+    benchmark.pedantic(module._load_module, setup=setup, rounds=20)  # pylint: disable=protected-access
+
+
+@register("run_function", runtime=["wasmtime", "wasm3"], function=["noop", "add"])
+def run_function(benchmark: Benchmark, runtime: str, function: str):
+    """Overhead of calling an exported function through WasmModule.run_function."""
+    _, module = load_tiny_module(runtime)
+    params = [] if function == "noop" else [1, 2]
+    benchmark(module.run_function, function, params)
+
+
+@register("memory", runtime=["wasmtime", "wasm3"], size=PAYLOAD_SIZES)
+def read_from_memory(benchmark: Benchmark, runtime: str, size: int):
+    """Throughput of reading a block from Wasm memory."""
+    wasm_runtime, module = load_tiny_module(runtime)
+    benchmark.extra_info["bytes"] = size
+    benchmark(wasm_runtime.read_from_memory, PAYLOAD_ADDRESS, size, module.name)
+
+
+@register("memory", runtime=["wasmtime", "wasm3"], size=PAYLOAD_SIZES)
+def write_to_memory(benchmark: Benchmark, runtime: str, size: int):
+    """Throughput of writing a block into Wasm memory."""
+    wasm_runtime, module = load_tiny_module(runtime)
+    data = os.urandom(size)
+    benchmark.extra_info["bytes"] = size
+    benchmark(wasm_runtime.write_to_memory, PAYLOAD_ADDRESS, data, module.name)
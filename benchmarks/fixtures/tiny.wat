@@ -0,0 +1,23 @@
+;; Tiny module for benchmarking the supervisor's call and memory paths.
+;; Rebuild tiny.wasm after changes with:
+;;   python -c "import wasmtime; open('tiny.wasm', 'wb').write(wasmtime.wat2wasm(open('tiny.wat').read()))"
+(module
+  (memory (export "memory") 1)
+  (global $heap (mut i32) (i32.const 1024))
+  (func (export "noop"))
+  (func (export "add") (param i32 i32) (result i32)
+    local.get 0
+    local.get 1
+    i32.add)
+  (func (export "grow") (param $pages i32) (result i32)
+    local.get $pages
+    memory.grow)
+  (func (export "alloc") (param $n i32) (result i32)
+    (local $p i32)
+    global.get $heap
+    local.set $p
+    global.get $heap
+    local.get $n
+    i32.add
+    global.set $heap
+    local.get $p))
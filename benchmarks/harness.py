@@ -0,0 +1,253 @@
+"""
+Minimal benchmark harness in the style of pytest-benchmark.
+
+Benchmarks are registered with the `register` decorator and receive a
+`Benchmark` object that is called with the function to measure. The results
+are stored as JSON so that they can be compared between versions.
+"""
+
+from __future__ import annotations
+from contextlib import redirect_stdout
+from dataclasses import dataclass, field
+from datetime import datetime, timezone
+import itertools
+import json
+import os
+import platform
+import statistics
+import subprocess
+from time import perf_counter
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+
+MIN_ROUND_TIME = 0.0001
+"""Minimum time (in seconds) of a single round; fast functions are called repeatedly during a round."""
+
+DEFAULT_MAX_TIME = 1.0
+"""Time (in seconds) to spend on measuring a single benchmark."""
+
+DEFAULT_MIN_ROUNDS = 5
+DEFAULT_MAX_ROUNDS = 10_000
+
+
+@dataclass
+class BenchmarkResult:
+    """Measurement of one benchmark with its parameters."""
+    group: str
+    name: str
+    params: Dict[str, Any]
+    times: List[float]
+    iterations: int
+    extra_info: Dict[str, Any] = field(default_factory=dict)
+
+    @property
+    def fullname(self) -> str:
+        """Get the name identifying the benchmark and its parameters."""
+        if not self.params:
+            return f"{self.group}::{self.name}"
+        params = "-".join(str(value) for value in self.params.values())
+        return f"{self.group}::{self.name}[{params}]"
+
+    def stats(self) -> Dict[str, float]:
+        """Return statistics of the time (in seconds) taken by one call."""
+        mean = statistics.fmean(self.times)
+        return {
+            "min": min(self.times),
+            "max": max(self.times),
+            "mean": mean,
+            "stddev": statistics.stdev(self.times) if len(self.times) > 1 else 0.0,
+            "median": statistics.median(self.times),
+            "rounds": len(self.times),
+            "iterations": self.iterations,
+            "ops": 1 / mean if mean else 0.0,
+        }
+
+    def as_dict(self) -> Dict[str, Any]:
+        """Return the result in a JSON-serializable form."""
+        return {
+            "group": self.group,
+            "name": self.name,
+            "fullname": self.fullname,
+            "params": self.params,
+            "stats": self.stats(),
+            "extra_info": self.extra_info,
+        }
+
+
+class Benchmark:
+    """Callable given to benchmark functions for measuring a target function."""
+    def __init__(self, max_time: float = DEFAULT_MAX_TIME) -> None:
+        self._max_time = max_time
+        self.times: List[float] = []
+        self.iterations: int = 1
+        self.extra_info: Dict[str, Any] = {}
+
+    def __call__(self, target: Callable[..., Any], *args: Any, **kwargs: Any) -> Any:
+        """
+        Measure calling the target with given arguments repeatedly. Return the
+        result of the last call.
+        """
+        # Warm up and calibrate how many calls fit into a single round.
+        start = perf_counter()
+        result = target(*args, **kwargs)
+        duration = perf_counter() - start
+        self.iterations = max(1, int(MIN_ROUND_TIME / duration) if duration > 0 else 1)
+
+        rounds = int(self._max_time / max(duration * self.iterations, MIN_ROUND_TIME))
+        rounds = min(max(rounds, DEFAULT_MIN_ROUNDS), DEFAULT_MAX_ROUNDS)
+        loop = range(self.iterations)
+        for _ in range(rounds):
+            start = perf_counter()
+            for _ in loop:
+                result = target(*args, **kwargs)
+            self.times.append((perf_counter() - start) / self.iterations)
+        return result
+
+    def pedantic(
+        self,
+        target: Callable[..., Any],
+        setup: Optional[Callable[[], Tuple[tuple, dict] | None]] = None,
+        rounds: int = DEFAULT_MIN_ROUNDS
+    ) -> Any:
+        """
+        Measure calling the target once per round, calling the (untimed) setup
+        before each round. Setup can return the args and kwargs for the target.
+        """
+        result = None
+        for _ in range(rounds):
+            args, kwargs = (), {}
+            if setup is not None:
+                args, kwargs = setup() or ((), {})
+            start = perf_counter()
+            result = target(*args, **kwargs)
+            self.times.append(perf_counter() - start)
+        return result
+
+
+BenchmarkFunction = Callable[..., None]
+
+@dataclass
+class RegisteredBenchmark:
+    """Benchmark function along with the group and parameters to run it with."""
+    group: str
+    function: BenchmarkFunction
+    params: Dict[str, List[Any]]
+
+    def variants(self) -> List[Dict[str, Any]]:
+        """Return all combinations of the parameters."""
+        names = list(self.params)
+        return [dict(zip(names, values)) for values in itertools.product(*self.params.values())]
+
+
+BENCHMARKS: List[RegisteredBenchmark] = []
+"""All the registered benchmarks in registration order."""
+
+
+def register(group: str, **params: List[Any]) -> Callable[[BenchmarkFunction], BenchmarkFunction]:
+    """
+    Register a benchmark function. The function is run once for each
+    combination of the given parameter values.
+    """
+    def decorator(function: BenchmarkFunction) -> BenchmarkFunction:
+        BENCHMARKS.append(RegisteredBenchmark(group, function, params))
+        return function
+    return decorator
+
+
+def run(name_filter: str = "", max_time: float = DEFAULT_MAX_TIME) -> List[BenchmarkResult]:
+    """Run the registered benchmarks whose full name contains the filter."""
+    results = []
+    for registered in BENCHMARKS:
+        for params in registered.variants():
+            result = BenchmarkResult(registered.group, registered.function.__name__, params, [], 1)
+            if name_filter not in result.fullname:
+                continue
+            benchmark = Benchmark(max_time)
+            # Silence the printing of the measured code paths.
+            with open(os.devnull, "w", encoding="utf-8") as devnull, redirect_stdout(devnull):
+                registered.function(benchmark, **params)
+            result.times = benchmark.times
+            result.iterations = benchmark.iterations
+            result.extra_info = benchmark.extra_info
+            results.append(result)
+            print(format_result(result), flush=True)
+    return results
+
+
+def format_result(result: BenchmarkResult) -> str:
+    """Return a one line summary of a benchmark result."""
+    stats = result.stats()
+    line = (
+        f"{result.fullname:<70} mean {stats['mean'] * 1e6:12.2f} us"
+        f"  median {stats['median'] * 1e6:12.2f} us  rounds {stats['rounds']:6d}"
+    )
+    if "bytes" in result.extra_info:
+        line += f"  {result.extra_info['bytes'] / stats['mean'] / 2**20:10.1f} MiB/s"
+    if "max_rss_bytes" in result.extra_info:
+        line += f"  RSS {result.extra_info['max_rss_bytes'] / 2**20:8.1f} MiB"
+    return line
+
+
+def _commit_info() -> Dict[str, Any]:
+    """Return information about the current git commit if available."""
+    try:
+        commit = subprocess.run(
+            ["git", "rev-parse", "HEAD"], capture_output=True, text=True, check=True, timeout=5
+        ).stdout.strip()
+        dirty = bool(subprocess.run(
+            ["git", "status", "--porcelain"], capture_output=True, text=True, check=True, timeout=5
+        ).stdout.strip())
+        return {"id": commit, "dirty": dirty}
+    except (OSError, subprocess.SubprocessError):
+        return {}
+
+
+def save(results: List[BenchmarkResult], path: str) -> None:
+    """Save the results as JSON to path."""
+    from host_app import __version__  # pylint: disable=import-outside-toplevel
+
+    data = {
+        "version": __version__,
+        "datetime": datetime.now(timezone.utc).isoformat(),
+        "machine_info": {
+            "node": platform.node(),
+            "machine": platform.machine(),
+            "system": platform.system(),
+            "release": platform.release(),
+            "python_version": platform.python_version(),
+            "cpu_count": os.cpu_count(),
+        },
+        "commit_info": _commit_info(),
+        "benchmarks": [result.as_dict() for result in results],
+    }
+    with open(path, "w", encoding="utf-8") as file:
+        json.dump(data, file, indent=2)
+
+
+def compare(results: List[BenchmarkResult], baseline_path: str, threshold: float) -> List[str]:
+    """
+    Compare mean times of the results to a saved baseline and print the
+    differences. Return the full names of benchmarks that got slower by more
+    than threshold percent.
+    """
+    with open(baseline_path, "r", encoding="utf-8") as file:
+        baseline = {item["fullname"]: item for item in json.load(file)["benchmarks"]}
+
+    regressions = []
+    print(f"\nComparison to {baseline_path} (mean time, threshold {threshold}%):")
+    for result in results:
+        previous = baseline.get(result.fullname)
+        if previous is None:
+            print(f"{result.fullname:<70} (not in baseline)")
+            continue
+        before = previous["stats"]["mean"]
+        after = result.stats()["mean"]
+        change = (after - before) / before * 100 if before else 0.0
+        regressed = change > threshold
+        if regressed:
+            regressions.append(result.fullname)
+        print(
+            f"{result.fullname:<70} {before * 1e6:12.2f} us -> {after * 1e6:12.2f} us"
+            f"  {change:+7.1f}%{'  REGRESSION' if regressed else ''}"
+        )
+    return regressions
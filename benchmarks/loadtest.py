@@ -0,0 +1,354 @@
+"""
+End-to-end load test of a supervisor.
+
+Starts the supervisor with `create_app` against a temporary instance directory
+and a local stub server standing in for the orchestrator (serving the module
+binary and data files and receiving logs) and for the downstream endpoints of
+chained calls. Then drives the deployment's functions with increasing
+concurrency and reports the throughput/latency curve. Everything runs on the
+loopback interface, so no network access is needed.
+
+Run with `python -m benchmarks.loadtest --help` for options.
+"""
+
+import argparse
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import json
+import os
+from pathlib import Path
+import random
+import shutil
+import socket
+import statistics
+import sys
+import tempfile
+import threading
+from time import perf_counter, sleep
+from typing import Any, Dict, List, Optional
+
+FIXTURES = Path(__file__).parent / "fixtures"
+TEMPCONFIGS = Path(__file__).parent.parent / "tempconfigs"
+
+DEPLOYMENT_ID = "loadtest"
+GET_MODULE = "calc"
+"""Module whose function is called with GET and query parameters only."""
+POST_MODULE = "upload"
+"""Module whose function is called with POST and an uploaded input file."""
+FUNCTION = "add"
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    """
+    Stand-in for the orchestrator and for downstream supervisors: serves files
+    registered to the server, accepts logs and registrations and answers
+    chained calls with a result URL.
+    """
+    server: "StubServer"
+
+    def log_message(self, format, *args):  # pylint: disable=redefined-builtin
+        pass
+
+    def _reply(self, status: int, body: bytes, content_type: str = "application/json"):
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):  # pylint: disable=invalid-name
+        """Serve a registered file."""
+        data = self.server.files.get(self.path)
+        if data is None:
+            self._reply(404, b'{"status": "error"}')
+        else:
+            self._reply(200, data, "application/octet-stream")
+
+    def do_POST(self):  # pylint: disable=invalid-name
+        """Accept logs, registrations and chained calls."""
+        length = int(self.headers.get("Content-Length", 0))
+        self.rfile.read(length)
+        if self.path.startswith("/sink/"):
+            with self.server.lock:
+                self.server.sink_calls += 1
+                count = self.server.sink_calls
+            body = {"resultUrl": f"http://{self.headers['Host']}/sink-results/{count}"}
+            self._reply(200, json.dumps(body).encode())
+        else:
+            self._reply(200, b'{"status": "success"}')
+
+
+class StubServer(ThreadingHTTPServer):
+    """HTTP server for the stub handler with the files it serves."""
+    daemon_threads = True
+
+    def __init__(self, files: Dict[str, bytes]):
+        super().__init__(("127.0.0.1", 0), StubHandler)
+        self.files = files
+        self.sink_calls = 0
+        self.lock = threading.Lock()
+
+    @property
+    def url(self) -> str:
+        """Get the base URL of the server."""
+        return f"http://127.0.0.1:{self.server_port}"
+
+
+def endpoint(url: str, path: str, method: str, parameters: List[str]) -> dict:
+    """Return an endpoint description like the ones in deployment manifests."""
+    return {
+        "url": url,
+        "path": path,
+        "method": method,
+        "request": {"parameters": [{"name": name, "in": "query", "required": True} for name in parameters]},
+        "response": {"media_type": "application/json", "schema": {"type": "integer"}},
+    }
+
+
+def deployment_manifest(supervisor_url: str, stub_url: str, chain: bool) -> dict:
+    """
+    Return the synthetic deployment: the tiny module deployed twice, once for
+    GET requests and once for POST requests with an input file.
+    """
+    modules, endpoints, instructions, mounts = [], {}, {}, {}
+    for module_name, method in ((GET_MODULE, "get"), (POST_MODULE, "post")):
+        modules.append({
+            "id": module_name,
+            "name": module_name,
+            "urls": {
+                "binary": f"{stub_url}/files/tiny.wasm",
+                "other": {"model.bin": f"{stub_url}/files/model.bin"},
+            },
+        })
+        this = endpoint(supervisor_url, f"/{DEPLOYMENT_ID}/modules/{module_name}/{FUNCTION}", method, ["a", "b"])
+        endpoints[module_name] = {FUNCTION: this}
+        instructions[module_name] = {FUNCTION: {
+            "from": this,
+            "to": endpoint(stub_url, f"/sink/{module_name}", "post", ["value"]) if chain else None,
+        }}
+        execution_mounts = (
+            [{"path": "input.bin", "media_type": "application/octet-stream", "stage": "execution"}]
+            if method == "post" else []
+        )
+        mounts[module_name] = {FUNCTION: {
+            "deployment": [{"path": "model.bin", "media_type": "application/octet-stream", "stage": "deployment"}],
+            "execution": execution_mounts,
+            "output": [],
+        }}
+    return {
+        "deploymentId": DEPLOYMENT_ID,
+        "modules": modules,
+        "endpoints": endpoints,
+        "instructions": {"modules": instructions},
+        "mounts": mounts,
+    }
+
+
+def free_port() -> int:
+    """Return a currently free TCP port on the loopback interface."""
+    with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def start_supervisor(instance_dir: Path, stub_url: str):
+    """Create the supervisor application and serve it in a background thread."""
+    port = free_port()
+    # These have to be set before importing and creating the application.
+    os.environ["INSTANCE_PATH"] = str(instance_dir)
+    os.environ.setdefault("FLASK_APP", "loadtest-supervisor")
+    os.environ["FLASK_DEBUG"] = "0"
+    os.environ["FLASK_PORT"] = str(port)
+    os.environ["SERVER_NAME"] = "127.0.0.1"
+    os.environ["WASMIOT_LOGGING_ENDPOINT"] = f"{stub_url}/device/logs"
+
+    configs = instance_dir / "instance" / "configs"
+    configs.mkdir(parents=True)
+    for config in TEMPCONFIGS.glob("*.json"):
+        shutil.copy(config, configs)
+
+    # pylint: disable=import-outside-toplevel
+    from werkzeug.serving import make_server
+    from host_app.flask_app.app import create_app
+
+    app = create_app(instance_path=str(instance_dir / "instance"))
+    server = make_server("127.0.0.1", port, app, threaded=True)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f"http://127.0.0.1:{port}"
+
+
+@dataclass
+class LevelResult:
+    """Results of driving the supervisor at one concurrency level."""
+    concurrency: int
+    latencies: List[float] = field(default_factory=list)
+    errors: int = 0
+    elapsed: float = 0.0
+
+    def summary(self) -> Dict[str, Any]:
+        """Return throughput and latency percentiles (in milliseconds)."""
+        latencies = sorted(self.latencies)
+        def percentile(fraction: float) -> float:
+            if not latencies:
+                return 0.0
+            return latencies[min(len(latencies) - 1, int(fraction * len(latencies)))] * 1000
+        return {
+            "concurrency": self.concurrency,
+            "requests": len(self.latencies) + self.errors,
+            "errors": self.errors,
+            "throughput": len(self.latencies) / self.elapsed if self.elapsed else 0.0,
+            "mean_ms": statistics.fmean(latencies) * 1000 if latencies else 0.0,
+            "p50_ms": percentile(0.50),
+            "p90_ms": percentile(0.90),
+            "p99_ms": percentile(0.99),
+            "max_ms": latencies[-1] * 1000 if latencies else 0.0,
+        }
+
+
+def one_request(session_local: threading.local, supervisor_url: str, post: bool,
+                payload: Optional[bytes], wait_results: bool) -> bool:
+    """Make one call to the deployment and return True if it succeeded."""
+    import requests  # pylint: disable=import-outside-toplevel
+
+    if not hasattr(session_local, "session"):
+        session_local.session = requests.Session()
+    session = session_local.session
+
+    module_name = POST_MODULE if post else GET_MODULE
+    url = f"{supervisor_url}/{DEPLOYMENT_ID}/modules/{module_name}/{FUNCTION}?a=1&b=2"
+    if post:
+        response = session.post(url, files={"input.bin": ("input.bin", payload)}, timeout=60)
+    else:
+        response = session.get(url, timeout=60)
+    if not response.ok:
+        return False
+    if not (post and wait_results):
+        return True
+
+    # Follow the result URL until the queued work has been done.
+    result_url = response.json()["resultUrl"]
+    while True:
+        result = session.get(result_url, timeout=60)
+        if result.status_code != 404:
+            return result.ok
+        sleep(0.001)
+
+
+def drive(supervisor_url: str, concurrency: int, requests_per_level: int, post_ratio: float,
+          payloads: List[bytes], wait_results: bool) -> LevelResult:
+    """Make the requests using the given number of concurrent clients."""
+    result = LevelResult(concurrency)
+    session_local = threading.local()
+    lock = threading.Lock()
+    rng = random.Random(concurrency)
+    plan = [
+        (rng.random() < post_ratio, rng.choice(payloads) if payloads else b"")
+        for _ in range(requests_per_level)
+    ]
+
+    def task(post: bool, payload: bytes):
+        start = perf_counter()
+        try:
+            ok = one_request(session_local, supervisor_url, post, payload, wait_results)
+        except Exception:  # pylint: disable=broad-except
+            ok = False
+        latency = perf_counter() - start
+        with lock:
+            if ok:
+                result.latencies.append(latency)
+            else:
+                result.errors += 1
+
+    start = perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        for post, payload in plan:
+            executor.submit(task, post, payload)
+    result.elapsed = perf_counter() - start
+    return result
+
+
+def main() -> int:
+    """Parse arguments, start the servers and run the load test."""
+    parser = argparse.ArgumentParser(prog="python -m benchmarks.loadtest", description=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--concurrency", default="1,2,4,8,16",
+                        help="Comma-separated numbers of concurrent clients to test")
+    parser.add_argument("--requests", type=int, default=200, help="Number of requests per concurrency level")
+    parser.add_argument("--post-ratio", type=float, default=0.5,
+                        help="Fraction of requests made with POST and an uploaded file (the rest use GET)")
+    parser.add_argument("--payload-sizes", default="1024,65536",
+                        help="Comma-separated sizes in bytes of the files uploaded with POST")
+    parser.add_argument("--model-size", type=int, default=1024 * 1024,
+                        help="Size in bytes of the data file fetched at deployment")
+    parser.add_argument("--chain", action="store_true",
+                        help="Forward each result to the local sink as a chained call")
+    parser.add_argument("--wait-results", action="store_true",
+                        help="Measure POST requests until their queued work is done")
+    parser.add_argument("--json", metavar="PATH", help="Save the results as JSON to PATH")
+    parser.add_argument("--verbose", action="store_true", help="Show the output and logs of the supervisor")
+    args = parser.parse_args()
+
+    # Keep the report readable by hiding what the supervisor prints and logs.
+    report = sys.stdout
+    if not args.verbose:
+        sys.stdout = sys.stderr = open(os.devnull, "w", encoding="utf-8")  # pylint: disable=consider-using-with
+
+    instance_dir = Path(tempfile.mkdtemp(prefix="wasmiot-loadtest-"))
+    stub = StubServer({
+        "/files/tiny.wasm": (FIXTURES / "tiny.wasm").read_bytes(),
+        "/files/model.bin": os.urandom(args.model_size),
+    })
+    threading.Thread(target=stub.serve_forever, daemon=True).start()
+
+    supervisor, supervisor_url = start_supervisor(instance_dir, stub.url)
+    import requests  # pylint: disable=import-outside-toplevel
+    response = requests.post(
+        f"{supervisor_url}/deploy",
+        json=deployment_manifest(supervisor_url, stub.url, args.chain),
+        timeout=60,
+    )
+    if not response.ok:
+        print(f"Deployment failed: {response.status_code} {response.text}", file=report)
+        return 1
+    # The deployment is set up in the background, so wait for it to be ready.
+    status = response.json()
+    while status["state"] not in ("ready", "failed"):
+        sleep(0.05)
+        status = requests.get(response.headers["Location"], timeout=10).json()
+    if status["state"] == "failed":
+        print(f"Deployment failed: {status['error']}", file=report)
+        return 1
+
+    payloads = [os.urandom(int(size)) for size in args.payload_sizes.split(",") if size]
+    levels = [int(level) for level in args.concurrency.split(",") if level]
+
+    print(f"{'clients':>8} {'requests':>9} {'errors':>7} {'req/s':>9} {'mean ms':>9} "
+          f"{'p50 ms':>9} {'p90 ms':>9} {'p99 ms':>9} {'max ms':>9}", file=report, flush=True)
+    summaries = []
+    for level in levels:
+        summary = drive(supervisor_url, level, args.requests, args.post_ratio, payloads,
+                        args.wait_results).summary()
+        summaries.append(summary)
+        print(f"{summary['concurrency']:>8} {summary['requests']:>9} {summary['errors']:>7} "
+              f"{summary['throughput']:>9.1f} {summary['mean_ms']:>9.2f} {summary['p50_ms']:>9.2f} "
+              f"{summary['p90_ms']:>9.2f} {summary['p99_ms']:>9.2f} {summary['max_ms']:>9.2f}", file=report, flush=True)
+    if args.chain:
+        print(f"Chained calls received by the sink: {stub.sink_calls}", file=report)
+
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as file:
+            json.dump({"arguments": vars(args), "levels": summaries}, file, indent=2)
+
+    supervisor.shutdown()
+    stub.shutdown()
+    shutil.rmtree(instance_dir, ignore_errors=True)
+    return 0
+
+
+if __name__ == "__main__":
+    # Exit without waiting for the supervisor's background threads (e.g. the
+    # mDNS registration) that are not daemonic.
+    exit_code = main()
+    sys.stdout.flush()
+    os._exit(exit_code)  # pylint: disable=protected-access
@@ -2,36 +2,54 @@
 This is a module :)
 """
 
+from concurrent.futures import ProcessPoolExecutor
+import copy
 from datetime import datetime
 from dataclasses import dataclass, field
+import errno
+import hashlib
 import itertools
 import logging
+import math
+import mimetypes
+import multiprocessing
 import os
+import platform
 import socket
 from pathlib import Path
 import queue
+import shutil
 import threading
-from typing import Any, Dict, Generator, Tuple
+from time import monotonic, perf_counter
+from typing import Any, Dict, Generator, Iterable, Tuple
 from urllib.parse import urlparse
 
 import atexit
-from flask import Flask, Blueprint, jsonify, current_app, request, send_file
+from flask import Flask, Blueprint, Response, jsonify, current_app, request, send_file
 import psutil
 from werkzeug.serving import get_sockaddr, select_address_family
 from werkzeug.serving import is_running_from_reloader
 
 import requests
 
-from host_app.wasm_utils.wasm_api import ModuleConfig
-from host_app.wasm_utils.wasmtime import WasmtimeRuntime
+from host_app.wasm_utils.wasm_api import ModuleConfig, ResourceLimits, WasmResourceLimitExceeded, WasmRuntime
+from host_app.wasm_utils.compiler import compile_to_file
+from host_app.wasm_utils import instance_manager, invocation, module_cache, tiered, wasm
 
+from host_app.utils import camera, compression, deployment_store, isolation, metrics, rpc, scratch, sensors
 from host_app.utils.configuration import get_device_description, get_wot_td
+from host_app.utils.files import write_atomically
 from host_app.utils.routes import endpoint_failed
-from host_app.utils.deployment import Deployment, CallData
+from host_app.utils.deployment import Deployment, DeploymentState, DeploymentStatus, CallData
+from host_app.utils.deployment_store import DeploymentRecord
 from host_app.utils.logger import get_logger
 
 _MODULE_DIRECTORY = 'wasm-modules'
+_MODULE_CACHE_DIRECTORY = 'compiled-modules'
 _PARAMS_FOLDER = 'wasm-params'
+_DEPLOYMENTS_DIRECTORY = 'deployments'
+_SCRATCH_DIRECTORY = 'scratch'
+_SHARED_MEMORY_DIRECTORY = Path('/dev/shm')
 INSTANCE_PARAMS_FOLDER = None
 
 OUTPUT_LENGTH_BYTES = 32 // 8
@@ -71,6 +89,15 @@ Mapping of deployment-IDs to instructions for forwarding function results to
 other devices and calling their functions
 """
 
+deployment_statuses: Dict[str, DeploymentStatus] = {}
+"""
+Mapping of deployment-IDs to the progress of setting up the latest version of
+each deployment
+"""
+
+deployments_lock = threading.Lock()
+"""Lock for installing and removing deployments along with their statuses"""
+
 
 def request_counter() -> Generator[int, None, None]:
     """Returns a unique number for each request"""
@@ -109,6 +136,16 @@ class RequestEntry():
     work_queued_at: datetime
     result: Any = None
     success: bool = False
+    timestamps: Dict[str, float] = field(default_factory=dict)
+    '''Monotonic time (in seconds) at which each stage of handling this request started'''
+    durations: Dict[str, float] = field(default_factory=dict)
+    '''Time (in seconds) spent in each finished stage of handling this request'''
+    workdir: str | None = None
+    '''Scratch directory of the invocation if it handles files'''
+    result_files: Dict[str, str] = field(default_factory=dict)
+    '''URL paths of the output files published by this request by their names'''
+    timeout: float | None = None
+    '''Time (in seconds) that the invocation may take once started, None for no limit'''
 
     def __post_init__(self):
         # TODO: Hash the ID (and include args and time as well) because in this
@@ -118,12 +155,25 @@ class RequestEntry():
         if request_id not in request_id_counters:
             request_id_counters[request_id] = request_counter()
         self.request_id = f'{request_id}:{next(request_id_counters[request_id])}'
+        self.mark("queue")
+
+    def mark(self, stage: str):
+        '''
+        Record the start of a stage in handling this request. This also ends
+        the previous stage and records its duration.
+        '''
+        now = monotonic()
+        previous_stage = next(reversed(self.timestamps), None)
+        if previous_stage is not None:
+            self.durations[previous_stage] = now - self.timestamps[previous_stage]
+        self.timestamps[stage] = now
 
 request_history = []
 '''Log of all the requests handled by this supervisor'''
 
 wasm_queue = queue.Queue()
 '''Queue of work for asynchronous WebAssembly execution'''
+metrics.wasm_queue_depth.set_function(wasm_queue.qsize)
 
 def module_mount_path(module_name: str, filename: str | None = None) -> Path:
     """
@@ -141,71 +191,158 @@ def do_wasm_work(entry: RequestEntry):
     not required.
     '''
 
-    deployment = deployments[entry.deployment_id]
-
-    logger.debug("Preparing Wasm module %r", entry.module_name)
-    module, wasm_args = deployment.prepare_for_running(
-        entry.module_name,
-        entry.function_name,
-        entry.request_args,
-        entry.request_files
-    )
-
-    logger.debug("Running Wasm function %r", entry.function_name)
-    raw_output = module.run_function(entry.function_name, wasm_args)
-    logger.debug("... Result: %r", raw_output, extra={"raw_output": raw_output})
-
-    # Do the next call, passing chain along and return immediately (i.e. the
-    # answer to current request should not be such, that it significantly blocks
-    # the whole chain).
-    this_result, next_call = deployment.interpret_call_from(
-        module.name, entry.function_name, raw_output
-    )
+    entry.mark("prepare")
+    space = scratch.get_scratch()
+    try:
+        deployment = deployments[entry.deployment_id]
+        # Keep the deployment from being torn down while it is being used.
+        with deployment.in_use():
+            # Invocations that handle files get a directory of their own.
+            if entry.workdir is None and deployment.uses_files(entry.module_name, entry.function_name):
+                entry.workdir = str(space.create(entry.module_name))
+            workdir = Path(entry.workdir) if entry.workdir is not None else None
+
+            logger.debug("Preparing Wasm module %r", entry.module_name)
+            module, wasm_args = deployment.prepare_for_running(
+                entry.module_name,
+                entry.function_name,
+                entry.request_args,
+                entry.request_files,
+                on_stage=entry.mark,
+                workdir=workdir,
+            )
 
-    # Log the result of the execution of this one module function.
-    # Execution result is the primitive output of the function, if any
-    # Result URL is the URL where the a result file can be fetched from (if any)
-    if this_result[0] is not None:
-        get_logger(request).debug("Execution result: %s", this_result[0], extra={"request": entry})
-    if this_result[1] is not None:
-        ip, port = get_listening_address(current_app)
-        get_logger(request).debug("Result url: http://%s:%s/module_results/%s/%s", ip, port, entry.module_name, this_result[1][0], extra={"request": entry})
-
-    if not isinstance(next_call, CallData):
-        # No sub-calls needed.
-        return this_result
-
-    headers = next_call.headers
-    # NOTE: IIUC this matches how 'requests' documentation instructs to do for
-    # multi-file uploads, so I'm guessing it closes the opened files once done.
-    files = { name: open(module_mount_path(module.name, name), "rb") for name in next_call.files }
-
-    get_logger(request).debug("Making sub-call from %r to %r", entry.module_name, next_call.url, extra={
-        "request": entry,
-        "next_call": next_call
-    })
+            logger.debug("Running Wasm function %r", entry.function_name)
+            entry.mark("execute")
+            with instance_manager.get_manager().using(module), \
+                    deployment.isolated(module, workdir) as workspace:
+                with invocation.invocation(
+                    workspace.module,
+                    request_id=entry.request_id,
+                    deadline=monotonic() + entry.timeout if entry.timeout is not None else None,
+                    data_dirs=workspace.data_dirs,
+                ):
+                    raw_output = workspace.module.run_function(entry.function_name, wasm_args)
+                logger.debug("... Result: %r", raw_output, extra={"raw_output": raw_output})
+
+                # Do the next call, passing chain along and return immediately (i.e. the
+                # answer to current request should not be such, that it significantly blocks
+                # the whole chain).
+                entry.mark("interpret")
+                this_result, next_call = deployment.interpret_call_from(
+                    module.name, entry.function_name, raw_output
+                )
+
+                # Move the output files out of the instance's directory, so
+                # that later invocations do not replace them.
+                output_paths: Dict[str, Path] = {}
+                for name in this_result[1] or []:
+                    if workspace.directory is None:
+                        output_paths[name] = module_mount_path(module.name, name)
+                        continue
+                    output_paths[name] = space.publish(workspace.directory, name, module.name, workdir.name)
+                    entry.result_files[name] = f'/module_results/{module.name}/{workdir.name}/{name}'
+
+            # Log the result of the execution of this one module function.
+            # Execution result is the primitive output of the function, if any
+            # Result URL is the URL where the a result file can be fetched from (if any)
+            if this_result[0] is not None:
+                get_logger(request).debug("Execution result: %s", this_result[0], extra={"request": entry})
+            if this_result[1] is not None:
+                ip, port = get_listening_address(current_app)
+                result_path = entry.result_files.get(
+                    this_result[1][0], f'/module_results/{entry.module_name}/{this_result[1][0]}'
+                )
+                get_logger(request).debug("Result url: http://%s:%s%s", ip, port, result_path, extra={"request": entry})
+
+            if not isinstance(next_call, CallData):
+                # No sub-calls needed.
+                return this_result
+
+            headers = next_call.headers
+            # NOTE: IIUC this matches how 'requests' documentation instructs to do for
+            # multi-file uploads, so I'm guessing it closes the opened files once done.
+            accepted = compression.accepted_by(next_call.url)
+            files = {
+                name: subcall_file(
+                    output_paths.get(name) or module_mount_path(module.name, name),
+                    deployment.output_media_type(module.name, entry.function_name, name),
+                    accepted,
+                )
+                for name in next_call.files or []
+            }
+
+            get_logger(request).debug("Making sub-call from %r to %r", entry.module_name, next_call.url, extra={
+                "request": entry,
+                "next_call": next_call
+            })
+
+            entry.mark("forward")
+            start = perf_counter()
+            sub_response = getattr(requests, next_call.method)(
+                next_call.url,
+                timeout=30,
+                files=files,
+                headers=headers,
+            )
+            metrics.outbound_request_seconds.observe(perf_counter() - start, kind="subcall")
+            compression.learn_accepted(next_call.url, sub_response.headers.get('Accept-Encoding'))
 
-    sub_response = getattr(requests, next_call.method)(
-        next_call.url,
-        timeout=30,
-        files=files,
-        headers=headers,
-    )
+            return sub_response.json()["resultUrl"]
+    finally:
+        if entry.workdir is not None:
+            space.remove(Path(entry.workdir))
 
-    return sub_response.json()["resultUrl"]
+def subcall_file(path: Path, media_type: str | None, accepted: list[str]) -> tuple:
+    """
+    Return a file to send in a sub-call in the form that 'requests' takes for
+    multipart uploads, compressed if the receiving host accepts it and it is
+    worth it.
+    """
+    media_type = media_type or mimetypes.guess_type(path.name)[0] or 'application/octet-stream'
+    policy = compression.get_policy()
+    encoding = None
+    # Compressed copies are only made of published output files, which are
+    # removed along with them.
+    if policy.enabled and path.is_relative_to(scratch.get_scratch().directory):
+        encoding = compression.choose_encoding(accepted, media_type, path.stat().st_size, policy.min_bytes)
+    variant = compression.compressed_variant(path, encoding) if encoding is not None else None
+    sent = variant or path
+    metrics.subcall_file_bytes.inc(sent.stat().st_size, encoding=encoding if variant is not None else 'identity')
+    if variant is None:
+        return (path.name, open(path, 'rb'), media_type)
+    return (path.name, open(variant, 'rb'), media_type, {'Content-Encoding': encoding})
 
 def make_history(entry: RequestEntry):
     '''Add entry to request history after executing its work'''
     try:
         entry.result = do_wasm_work(entry)
         entry.success = True
+    except WasmResourceLimitExceeded as err:
+        logger.warning("Resource limit exceeded running WebAssembly function %r: %s", entry.function_name, err, extra={
+            "request": entry,
+        })
+        entry.result = str(err)
+        entry.success = False
     except Exception as err:
         logger.error("Error running WebAssembly function %r", entry.function_name, exc_info=True, extra={
             "request": entry,
         })
         entry.result = str(err)
         entry.success = False
+    entry.mark("finished")
 
+    labels = {
+        "deployment": entry.deployment_id,
+        "module": entry.module_name,
+        "function": entry.function_name,
+    }
+    metrics.invocations.inc(success=str(entry.success).lower(), **labels)
+    for stage, duration in entry.durations.items():
+        metrics.invocation_stage_seconds.observe(duration, stage=stage, **labels)
+    logger.debug("Request %r handled in %r", entry.request_id, entry.durations, extra={
+        "request": entry,
+    })
     request_history.append(entry)
 
     return entry
@@ -226,6 +363,17 @@ def is_valid_url(url: str):
         return False
 
 
+def default_scratch_folder(app: Flask) -> Path:
+    '''
+    Return the default directory of the scratch space: a directory named
+    after the supervisor in the RAM-backed /dev/shm if the system has it, so
+    that the files of invocations are not written to storage (e.g., an SD
+    card), and the instance directory otherwise.
+    '''
+    if _SHARED_MEMORY_DIRECTORY.is_dir() and os.access(_SHARED_MEMORY_DIRECTORY, os.W_OK):
+        return _SHARED_MEMORY_DIRECTORY / Path(app.name).name
+    return Path(app.instance_path, _SCRATCH_DIRECTORY)
+
 def create_app(*args, **kwargs) -> Flask:
     '''
     Create a new Flask application.
@@ -238,12 +386,52 @@ def create_app(*args, **kwargs) -> Flask:
     app = Flask(os.environ.get("FLASK_APP", __name__), *args, **kwargs)
 
     # Create instance directory if it does not exist.
-    Path(app.instance_path).mkdir(exist_ok=True)
+    Path(app.instance_path).mkdir(parents=True, exist_ok=True)
+
+    # Derive the default limits of Wasm linear memory from the amount of RAM
+    # on the device, so that a single deployment can not exhaust it.
+    total_memory = psutil.virtual_memory().total
 
     app.config.update({
         'secret_key': 'dev',
         'MODULE_FOLDER': Path(app.instance_path, _MODULE_DIRECTORY),
+        'MODULE_CACHE_FOLDER': Path(app.instance_path, _MODULE_CACHE_DIRECTORY),
+        'MODULE_CACHE_MAX_BYTES': 256 * 1024 * 1024,
         'PARAMS_FOLDER': Path(app.instance_path, _PARAMS_FOLDER),
+        'DEPLOYMENTS_FOLDER': Path(app.instance_path, _DEPLOYMENTS_DIRECTORY),
+        'DEPLOYMENT_MEMORY_LIMIT': total_memory // 2,
+        'MODULE_MEMORY_LIMIT': total_memory // 4,
+        'MODULE_TABLE_ELEMENTS_LIMIT': None,
+        'WASM_RUNTIME': wasm.DEFAULT_RUNTIME,
+        'WASM3_STACK_SIZE': None,
+        'TIER_UP_CALLS': 10,
+        'TIER_UP_SECONDS': 1.0,
+        'TIER_WINDOW': 60.0,
+        'TIER_DOWN_IDLE': 600.0,
+        'COMPILE_WORKERS': 1,
+        'DEPLOYMENT_READY_TIMEOUT': 10,
+        'INSTANCE_MEMORY_BUDGET': None,
+        'MEMORY_HIGH_WATERMARK': 0.9,
+        'INSTANCE_MIN_IDLE': 5,
+        'CAMERA_MAX_FRAME_AGE': 0.5,
+        'CAMERA_IDLE_TIMEOUT': 30,
+        'CAMERA_DEBUG_IMAGE': None,
+        'DHT_SENSOR': 'none' if platform.system() == 'Windows' else 'dht22',
+        'DHT_SAMPLE_INTERVAL': 2.0,
+        'DHT_SAMPLE_TTL': 10.0,
+        'INVOCATION_TIMEOUT': 300.0,
+        'RPC_TIMEOUT': 120.0,
+        'RPC_WORKERS': 4,
+        'RPC_MAX_PENDING': 64,
+        'SCRATCH_FOLDER': default_scratch_folder(app),
+        'SCRATCH_KEEP_RESULTS': scratch.KEEP_RESULTS,
+        'SCRATCH_RESULTS_MAX_BYTES': None,
+        'ISOLATED_INSTANCES': isolation.POOL_SIZE,
+        'RESULT_MAX_AGE': 24 * 60 * 60,
+        'RESULT_COMPRESSION': True,
+        'COMPRESSION_MIN_BYTES': compression.MIN_BYTES,
+        'SUBCALL_COMPRESSION': True,
+        'MAX_DECOMPRESSED_BYTES': 256 * 1024 * 1024,
     })
 
     # Set this in order to later access module params folder that Flask set up
@@ -257,6 +445,53 @@ def create_app(*args, **kwargs) -> Flask:
     # Load config from environment variables
     app.config.from_prefixed_env("WASMIOT")
 
+    module_cache.configure(
+        Path(app.config['MODULE_CACHE_FOLDER']),
+        app.config['MODULE_CACHE_MAX_BYTES'],
+    )
+    deployment_store.configure(Path(app.config['DEPLOYMENTS_FOLDER']))
+    scratch.configure(
+        Path(app.config['SCRATCH_FOLDER']),
+        app.config['SCRATCH_KEEP_RESULTS'],
+        app.config['SCRATCH_RESULTS_MAX_BYTES'],
+    )
+    isolation.configure(app.config['ISOLATED_INSTANCES'])
+    compression.configure(compression.TransferPolicy(
+        app.config['SUBCALL_COMPRESSION'],
+        app.config['COMPRESSION_MIN_BYTES'],
+    ))
+    # Unload idle module instances when memory runs low; they are loaded again
+    # on their next use.
+    instance_manager.get_manager().set_limits(
+        app.config['INSTANCE_MEMORY_BUDGET'],
+        app.config['MEMORY_HIGH_WATERMARK'],
+        app.config['INSTANCE_MIN_IDLE'],
+    )
+    camera.get_camera().configure(
+        app.config['CAMERA_MAX_FRAME_AGE'],
+        app.config['CAMERA_IDLE_TIMEOUT'],
+        app.config['CAMERA_DEBUG_IMAGE'],
+    )
+    sensors.configure(
+        app.config['DHT_SENSOR'],
+        app.config['DHT_SAMPLE_INTERVAL'],
+        app.config['DHT_SAMPLE_TTL'],
+    )
+    tiered.configure(tiered.TieringPolicy(
+        promote_calls=app.config['TIER_UP_CALLS'],
+        promote_seconds=app.config['TIER_UP_SECONDS'],
+        window=app.config['TIER_WINDOW'],
+        demote_after=app.config['TIER_DOWN_IDLE'],
+    ))
+    rpc.get_dispatcher().configure(
+        app.config['RPC_TIMEOUT'],
+        app.config['RPC_WORKERS'],
+        app.config['RPC_MAX_PENDING'],
+    )
+    # Compiled modules used to be saved next to the modules themselves.
+    for legacy_serialized in Path(app.config['MODULE_FOLDER']).glob('*.SERIALIZED.wasm'):
+        legacy_serialized.unlink()
+
     # add sentry logging
     app.config.setdefault('SENTRY_DSN', os.environ.get('SENTRY_DSN'))
 
@@ -272,6 +507,9 @@ def create_app(*args, **kwargs) -> Flask:
     # Start thread that handles the Wasm work queue.
     init_wasm_worker()
 
+    # Bring back the deployments that were installed before a restart.
+    restore_deployments(app)
+
     return app
 
 
@@ -377,12 +615,21 @@ def thingi_health():
     get_logger(request).info("Health check done")
     response = jsonify({
          "cpuUsage": cpu_usage,
-         "memoryUsage": memory_usage
+         "memoryUsage": memory_usage,
+         "wasmMemory": {
+             deployment_id: deployment.memory_usage()
+             for deployment_id, deployment in deployments.items()
+         },
     })
     # Use a custom header to indicate if the thing is registered with an orchestrator URL
     response.headers["Custom-Orchestrator-Set"] = str(orchestrator_url is not None).lower()
     return response
 
+@bp.route('/metrics')
+def metrics_endpoint():
+    '''Return the metrics of this supervisor in Prometheus text format'''
+    return Response(metrics.REGISTRY.render(), content_type=metrics.CONTENT_TYPE)
+
 @bp.route('/register', methods=['POST'])
 def register_orchestrator():
     """Registers the URL of the orchestrator"""
@@ -408,12 +655,67 @@ def register_orchestrator():
 
     return jsonify({"status": "success"})
 
+def module_result_path(module_name: str, filename: str) -> Path:
+    """
+    Return the path of the latest result file of a module with the given name.
+    """
+    published = scratch.get_scratch().latest(module_name, filename)
+    return published if published is not None else module_mount_path(module_name, filename)
+
+def send_result_file(path: Path, immutable: bool = False) -> Response:
+    """
+    Send a result file with a strong entity tag of its contents, so that
+    clients can revalidate their copies with If-None-Match and fetch parts of
+    it with Range, compressed if the client accepts it and it is worth it.
+
+    :param immutable: True if the URL always refers to the same contents, so
+    that clients can keep their copies without revalidating them.
+    """
+    space = scratch.get_scratch()
+    media_type = mimetypes.guess_type(path.name)[0] or 'application/octet-stream'
+    etag = space.etag(path)
+    encoding = None
+    if current_app.config['RESULT_COMPRESSION'] and path.is_relative_to(space.directory):
+        encoding = compression.choose_encoding(
+            [value for value, _ in request.accept_encodings],
+            media_type,
+            path.stat().st_size,
+            current_app.config['COMPRESSION_MIN_BYTES'],
+        )
+    variant = compression.compressed_variant(path, encoding) if encoding is not None else None
+
+    response = send_file(
+        variant or path,
+        mimetype=media_type,
+        etag=f'{etag}-{encoding}' if variant is not None else etag,
+        conditional=True,
+        max_age=current_app.config['RESULT_MAX_AGE'] if immutable else None,
+    )
+    if variant is not None:
+        response.content_encoding = encoding
+    response.vary.add('Accept-Encoding')
+    if immutable:
+        response.cache_control.immutable = True
+    else:
+        response.cache_control.no_cache = True
+    return response
+
 @bp.route('/module_results/<module_name>/<filename>')
 def get_module_result(module_name: str, filename: str):
     """
-    Return the result file of a module execution.
+    Return the latest result file of a module execution.
+    """
+    return send_result_file(module_result_path(module_name, filename))
+
+@bp.route('/module_results/<module_name>/<result_id>/<filename>')
+def get_invocation_result(module_name: str, result_id: str, filename: str):
+    """
+    Return a result file of a specific module execution.
     """
-    return send_file(Path(INSTANCE_PARAMS_FOLDER, module_name, filename))
+    path = scratch.get_scratch().result(result_id, filename)
+    if path is None:
+        return endpoint_failed(request, f'result {result_id}/{filename} of module {module_name} not found', 404)
+    return send_result_file(path, immutable=True)
 
 def results_route(request_id=None, full=False):
     '''
@@ -450,27 +752,68 @@ def run_module_function(deployment_id, module_name, function_name, filename=None
 
     if filename:
         # If a filename is passed, this route works merely for file serving.
-        return send_file(module_mount_path(module_name, filename))
+        return send_result_file(module_result_path(module_name, filename))
 
     if deployment_id not in deployments:
-        return endpoint_failed(request, 'deployment does not exist', 404)
+        # Wait for a deployment that is still being set up.
+        status = deployment_statuses.get(deployment_id)
+        if status is None:
+            return endpoint_failed(request, 'deployment does not exist', 404)
+        timeout = current_app.config['DEPLOYMENT_READY_TIMEOUT']
+        if not status.wait(timeout):
+            response = endpoint_failed(request, f'deployment is not ready yet ({status.state.value})', 503)
+            response.headers['Retry-After'] = str(max(1, math.ceil(timeout)))
+            return response
+        if status.state == DeploymentState.FAILED:
+            return endpoint_failed(request, f'deployment failed: {status.error}', 500)
+        if deployment_id not in deployments:
+            return endpoint_failed(request, 'deployment does not exist', 404)
 
     if module_name not in deployments[deployment_id].modules:
         return endpoint_failed(request, f"module {module_name} not found for this deployment")
 
-    # Write input data to filesystem.
+    # Write input data to the invocation's own directory, so that concurrent
+    # requests do not overwrite each other's files.
     input_file_paths: Dict[str, str] = {}
+    # The scratch space may be in RAM, so files that do not fit are refused
+    # before they are written instead of filling it.
+    if request.files and (request.content_length or 0) > scratch.get_scratch().free_bytes():
+        return endpoint_failed(request, 'not enough space for the input files', 507)
+    workdir = scratch.get_scratch().create(module_name) if request.files else None
     for param_name, input_data_file in request.files.items():
-        input_file_path = os.path.join(
-            current_app.config['PARAMS_FOLDER'],
-            (
-                input_data_file.name
-                if input_data_file is not None and input_data_file.name is not None
-                else ""
-            )
-        )
-        input_data_file.save(input_file_path)
-        input_file_paths[param_name] = str(Path(input_file_path))
+        try:
+            input_file_path = scratch.get_scratch().path_in(workdir, param_name)
+        except ValueError as error:
+            scratch.get_scratch().remove(workdir)
+            return endpoint_failed(request, str(error), 400)
+        # Files sent compressed by other supervisors are decompressed on the way.
+        encoding = input_data_file.headers.get('Content-Encoding')
+        free_bytes = scratch.get_scratch().free_bytes()
+        max_bytes = current_app.config['MAX_DECOMPRESSED_BYTES']
+        try:
+            if encoding:
+                compression.decompress_to(
+                    input_data_file.stream, encoding, input_file_path,
+                    min(max_bytes, free_bytes) if max_bytes is not None else free_bytes,
+                )
+            else:
+                input_data_file.save(input_file_path)
+        except OSError as error:
+            scratch.get_scratch().remove(workdir)
+            if error.errno != errno.ENOSPC:
+                raise
+            return endpoint_failed(request, f'file {param_name}: not enough space', 507)
+        except ValueError as error:
+            scratch.get_scratch().remove(workdir)
+            status_code = 400
+            if isinstance(error, compression.UnsupportedEncoding):
+                status_code = 415
+            elif isinstance(error, compression.DecompressedTooLarge):
+                status_code = 413 if max_bytes is not None and max_bytes <= free_bytes else 507
+            response = endpoint_failed(request, f'file {param_name}: {error}', status_code)
+            response.headers['Accept-Encoding'] = compression.accept_encoding_header()
+            return response
+        input_file_paths[param_name] = str(input_file_path)
 
     entry = RequestEntry(
         deployment_id,
@@ -479,7 +822,9 @@ def run_module_function(deployment_id, module_name, function_name, filename=None
         request.method,
         request.args,
         input_file_paths,
-        datetime.now()
+        datetime.now(),
+        workdir=str(workdir) if workdir is not None else None,
+        timeout=current_app.config['INVOCATION_TIMEOUT'],
     )
 
     get_logger(request).info("Module run", extra={"request": entry})
@@ -492,24 +837,138 @@ def run_module_function(deployment_id, module_name, function_name, filename=None
         wasm_queue.put(entry)
 
     # Return a link to this request's result (which could link further until
-    # some useful value is found).
-    return jsonify({ 'resultUrl': results_route(entry.request_id, full=True) })
+    # some useful value is found). The accepted encodings let the caller
+    # compress the files it sends next.
+    response = jsonify({ 'resultUrl': results_route(entry.request_id, full=True) })
+    response.headers['Accept-Encoding'] = compression.accept_encoding_header()
+    return response
+
+def deployment_status_url(deployment_id: str) -> str:
+    '''Return the URL where the status of a deployment can be read from.'''
+    return f'{request.root_url}deploy/{deployment_id}'
+
+@bp.route('/deploy/<deployment_id>', methods=['GET'])
+def deployment_status(deployment_id):
+    '''
+    Return the progress of setting up the given deployment.
+    '''
+    status = deployment_statuses.get(deployment_id)
+    if status is None:
+        return endpoint_failed(request, 'deployment does not exist', 404)
+    return jsonify(status.as_dict())
 
 @bp.route('/deploy/<deployment_id>', methods=['DELETE'])
 def deployment_delete(deployment_id):
     '''
-    Forget the given deployment.
+    Forget the given deployment and release its resources: the Wasm instances
+    once ongoing invocations have finished, the files of modules that no
+    other deployment uses and the deployment's request history.
     '''
-    if deployment_id in deployments:
-        del deployments[deployment_id]
-        return jsonify({'status': 'success'})
-    return endpoint_failed(request, 'deployment does not exist', 404)
+    with deployments_lock:
+        status = deployment_statuses.pop(deployment_id, None)
+        deployment = deployments.pop(deployment_id, None)
+    if deployment is None and status is None:
+        return endpoint_failed(request, 'deployment does not exist', 404)
+    deployment_store.get_store().remove(deployment_id)
+
+    memory_bytes, disk_bytes = 0, 0
+    if deployment is not None:
+        module_configs = list(deployment.modules.values())
+        # Files are removed only after the instances using them are released.
+        disk_bytes = sum(path_size(path) for path in unreferenced_module_paths(module_configs))
+        memory_bytes = deployment.retire(
+            on_closed=lambda: remove_paths(unreferenced_module_paths(module_configs))
+        )
+
+    history_entries = len(request_history)
+    request_history[:] = [entry for entry in request_history if entry.deployment_id != deployment_id]
+    history_entries -= len(request_history)
+    for request_id in [key for key in request_id_counters if key.startswith(f'{deployment_id}:')]:
+        del request_id_counters[request_id]
+
+    get_logger(request).info(
+        "Deployment %r deleted, reclaimed %d bytes of memory, %d bytes of disk and %d history entries",
+        deployment_id, memory_bytes, disk_bytes, history_entries
+    )
+    return jsonify({
+        'status': 'success',
+        'reclaimed': {
+            'memoryBytes': memory_bytes,
+            'diskBytes': disk_bytes,
+            'historyEntries': history_entries,
+        },
+    })
+
+def unreferenced_module_paths(module_configs: Iterable[ModuleConfig]) -> list[Path]:
+    '''
+    Return the binaries, compiled artifacts and mount directories of the
+    modules that no deployment refers to anymore. Binaries are shared between
+    deployments by their contents and mount directories by module name. The
+    binaries of deployments still being set up are not known yet, so modules
+    of the same name keep theirs until then.
+    '''
+    with deployments_lock:
+        referenced_paths = {
+            Path(config.path) for deployment in deployments.values() for config in deployment.modules.values()
+        }
+        referenced_names = {name for deployment in deployments.values() for name in deployment.modules}
+        referenced_names.update(name for status in deployment_statuses.values() for name in status.modules)
+        settling_names = {
+            name for status in deployment_statuses.values()
+            if status.state not in (DeploymentState.READY, DeploymentState.FAILED)
+            for name in status.modules
+        }
+
+    cache = module_cache.get_cache()
+    referenced_artifacts = {cache.path_for(str(path)) for path in referenced_paths if path.is_file()}
+
+    paths = []
+    for config in module_configs:
+        module_path = Path(config.path)
+        if (
+            config.name not in settling_names
+            and module_path not in referenced_paths
+            and module_path not in paths
+            and module_path.is_file()
+        ):
+            artifact = cache.path_for(str(module_path))
+            if artifact is not None and artifact not in referenced_artifacts and artifact.exists():
+                paths.append(artifact)
+            paths.append(module_path)
+        mount_path = module_mount_path(config.name)
+        if config.name not in referenced_names and mount_path not in paths and mount_path.is_dir():
+            paths.append(mount_path)
+    return paths
+
+def path_size(path: Path) -> int:
+    '''Return the size in bytes of a file or the files in a directory.'''
+    if path.is_dir():
+        return sum(child.stat().st_size for child in path.rglob('*') if child.is_file())
+    return path.stat().st_size if path.exists() else 0
+
+def remove_paths(paths: Iterable[Path]) -> int:
+    '''Remove the files and directories and return the number of bytes freed.'''
+    removed = 0
+    for path in paths:
+        size = path_size(path)
+        try:
+            if path.is_dir():
+                shutil.rmtree(path)
+            else:
+                path.unlink()
+            removed += size
+        except FileNotFoundError:
+            continue
+    logger.debug("Removed %d bytes of unused module files", removed)
+    return removed
 
 @bp.route('/deploy', methods=['POST'])
 def deployment_create():
     '''
     Request content-type needs to be 'application/json'
-    - POST: Parses the deployment from request and enacts it.
+    - POST: Parses the deployment from request and starts setting it up in the
+      background. Responds immediately with the status of the deployment, that
+      can be followed at the URL in the 'Location' header.
     '''
     data = request.get_json(silent=True)
     if not data:
@@ -521,38 +980,364 @@ def deployment_create():
         get_logger(request).error('No modules listed')
         return jsonify({'message': 'No modules listed'})
 
-    try:
-        module_configs = fetch_modules(modules)
-    except FetchFailures as err:
-        logger.error("Failed fetching modules", exc_info=True)
-        return endpoint_failed(
-            request,
-            msg=f'{len(err.errors)} fetch failures',
-            status_code=500,
-            errors=err.errors
-        )
+    # A possible previous version of the deployment keeps serving requests
+    # until the new one is ready.
+    status = DeploymentStatus(data["deploymentId"], modules=[m["name"] for m in modules])
+    with deployments_lock:
+        deployment_statuses[status.id] = status
+
+    app = current_app._get_current_object()  # pylint: disable=protected-access
+    threading.Thread(
+        target=setup_deployment,
+        args=(app, data, status),
+        name=f"deploy-{status.id}",
+        daemon=True,
+    ).start()
+
+    get_logger(request).info('Deployment accepted')
+    status_url = deployment_status_url(status.id)
+    # The orchestrator reads 'status' from the response as before.
+    response = jsonify({'status': 'success', **status.as_dict(), 'statusUrl': status_url})
+    response.status_code = 202
+    response.headers['Location'] = status_url
+    return response
+
+def setup_deployment(
+    app: Flask,
+    data: dict[str, Any],
+    status: DeploymentStatus,
+    module_configs: list[ModuleConfig] | None = None
+):
+    '''
+    Fetch, compile, instantiate and optionally warm up the modules of a
+    deployment, then install the deployment for serving requests. Progress
+    is reported through the status.
+
+    Fetching is skipped if the module configs are given, e.g., when
+    restoring a saved deployment whose modules are already on disk.
+    '''
+    # The deployment modifies the data when interpreting it, so save the
+    # original for restoring the deployment later.
+    manifest = copy.deepcopy(data)
+    with app.app_context():
+        try:
+            if module_configs is None:
+                status.set_state(DeploymentState.FETCHING)
+                module_configs = fetch_modules(data['modules'])
+
+            # Modules that have not changed since the current version of the
+            # deployment keep their runtimes with the already warm instances.
+            runtime_names = module_runtime_names(data, module_configs)
+            limits = module_resource_limits(data, module_configs, runtime_names)
+            modules_runtimes = reusable_runtimes(
+                deployments.get(status.id), module_configs, limits, runtime_names
+            )
+            status.reused_modules = list(modules_runtimes)
+            new_module_configs = [m for m in module_configs if m.name not in modules_runtimes]
+
+            status.set_state(DeploymentState.COMPILING)
+            # Wasm3 interprets modules and tiered modules are compiled in the
+            # background, so only the Wasmtime ones are compiled here.
+            compile_modules([m for m in new_module_configs if runtime_names[m.name] == "wasmtime"])
+
+            status.set_state(DeploymentState.INSTANTIATING)
+            # Initialize __separate__ execution environments for each module for this
+            # deployment, adding filepath roots for the modules' directories that they
+            # are able to use. This way when file-access is granted via runtime, modules
+            # will only access their own directories.
+            for module_config in new_module_configs:
+                runtime = wasm.new_runtime(
+                    runtime_names[module_config.name],
+                    [str(module_mount_path(module_config.name))],
+                    limits=limits[module_config.name],
+                    wasm3_stack_size=current_app.config['WASM3_STACK_SIZE'],
+                )
+                if runtime.get_or_load_module(module_config) is None:
+                    raise RuntimeError(f'Wasm module {module_config.name!r} could not be loaded')
+                modules_runtimes[module_config.name] = runtime
+            check_endpoint_functions(data["endpoints"], modules_runtimes)
+
+            deployment = Deployment(
+                data["deploymentId"],
+                runtimes=modules_runtimes,
+                _modules=module_configs,
+                endpoints=data["endpoints"],
+                _instructions=data["instructions"],
+                _mounts=data["mounts"],
+            )
+
+            warmups = {
+                m["name"]: m["warmup"] for m in data['modules']
+                if m.get("warmup") and m["name"] not in status.reused_modules
+            }
+            if warmups:
+                status.set_state(DeploymentState.WARMING_UP)
+                warm_up(deployment, warmups)
+        except FetchFailures as err:
+            logger.error("Failed fetching modules", exc_info=True)
+            failed_urls = ", ".join(f"{res.url} ({res.status_code})" for res in err.errors)
+            settle_deployment(status, None, f'{len(err.errors)} fetch failures: {failed_urls}')
+        except Exception as err:  # pylint: disable=broad-except
+            logger.error("Failed setting up deployment %r", status.id, exc_info=True)
+            settle_deployment(status, None, str(err))
+        else:
+            settle_deployment(status, deployment, record=DeploymentRecord(manifest, module_configs))
+
+def restore_deployments(app: Flask):
+    '''
+    Set up the deployments saved before the supervisor was last stopped. The
+    modules are instantiated in the background from the compiled module
+    cache, while calls to the deployments wait for them to be ready like for
+    any new deployment.
+    '''
+    store = deployment_store.get_store()
+    records = []
+    for record in store.load_all():
+        missing = record.missing_files()
+        if missing:
+            logger.warning(
+                "Not restoring deployment %r as its files are missing: %s",
+                record.id, ", ".join(map(str, missing))
+            )
+            store.remove(record.id)
+            continue
+        status = DeploymentStatus(record.id, modules=[m.name for m in record.modules])
+        with deployments_lock:
+            deployment_statuses[status.id] = status
+        records.append((record, status))
+
+    if not records:
+        return
+
+    def restore():
+        for record, status in records:
+            setup_deployment(app, record.manifest, status, module_configs=record.modules)
+
+    logger.info("Restoring %d saved deployments", len(records))
+    threading.Thread(target=restore, name="restore-deployments", daemon=True).start()
+
+def reusable_runtimes(
+    previous: Deployment | None,
+    module_configs: list[ModuleConfig],
+    limits: dict[str, ResourceLimits],
+    runtime_names: dict[str, str]
+) -> dict[str, WasmRuntime]:
+    '''
+    Return the runtimes of the previous version of a deployment that can be
+    used as is for the given modules. A runtime is reused when its module's
+    binary, data files, resource limits and type of runtime are unchanged.
+    '''
+    if previous is None:
+        return {}
+    runtimes = {}
+    for module_config in module_configs:
+        previous_config = previous.modules.get(module_config.name)
+        runtime = previous.runtimes.get(module_config.name)
+        if (
+            previous_config is not None and runtime is not None
+            and module_config.digest is not None
+            and previous_config.digest == module_config.digest
+            and runtime.limits == limits[module_config.name]
+            and runtime.name == runtime_names[module_config.name]
+            and module_config.name in runtime.modules
+        ):
+            runtimes[module_config.name] = runtime
+    return runtimes
+
+def settle_deployment(
+    status: DeploymentStatus,
+    deployment: Deployment | None,
+    error: str | None = None,
+    record: DeploymentRecord | None = None
+):
+    '''
+    Install a successfully set up deployment for serving, unless a newer
+    version has been received or the deployment deleted meanwhile, and mark
+    the status as ready or failed. The runtimes that are no longer used by
+    the installed version are released. The installed deployment is saved
+    for restoring it on the next start.
+    '''
+    with deployments_lock:
+        is_current = deployment_statuses.get(status.id) is status
+        previous = deployments.get(status.id)
+        if deployment is not None and is_current:
+            deployments[status.id] = deployment
+            # Save while holding the lock so that an older version can not
+            # overwrite a newer one.
+            if record is not None:
+                try:
+                    deployment_store.get_store().save(record)
+                except OSError:
+                    logger.warning("Could not save deployment %r", status.id, exc_info=True)
+
+    if deployment is None:
+        status.set_state(DeploymentState.FAILED, error)
+    elif not is_current:
+        status.set_state(DeploymentState.FAILED, 'deployment was replaced or deleted before it was ready')
+        # Release the new runtimes but not the ones shared with the live version.
+        deployment.retire(keep=previous.runtimes.values() if previous is not None else ())
+    else:
+        status.set_state(DeploymentState.READY)
+        if previous is not None:
+            # Release the old version once its ongoing invocations have
+            # finished, along with the files of modules it no longer has.
+            dropped_modules = [
+                config for config in previous.modules.values()
+                if config.name not in deployment.modules or config.path != deployment.modules[config.name].path
+            ]
+            previous.retire(
+                keep=deployment.runtimes.values(),
+                on_closed=lambda: remove_paths(unreferenced_module_paths(dropped_modules)),
+            )
+    logger.info("Deployment %r %s in %r", status.id, status.state.value, status.durations())
+
+    for stage, duration in status.durations().items():
+        metrics.deployment_stage_seconds.observe(duration, stage=stage)
+
+def compile_modules(module_configs: list[ModuleConfig]):
+    '''
+    Compile the modules ahead of time in worker processes, so that compiling
+    does not hold up the rest of the supervisor and instantiating modules only
+    requires deserializing them.
+
+    The worker processes only live for the duration of compiling, so that
+    they do not hold on to memory between deployments.
+    '''
+    cache = module_cache.get_cache()
+    if cache.directory is None:
+        return
+    # Modules compiled earlier (e.g., before a restart or by a previous
+    # version of the deployment) are already found in the cache.
+    uncompiled = [m for m in module_configs if not cache.contains(m.path)]
+    if not uncompiled:
+        return
+
+    workers = max(1, min(current_app.config['COMPILE_WORKERS'], len(uncompiled)))
+    # Spawn instead of forking, as forking a process with threads is unsafe.
+    with ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context('spawn')) as pool:
+        futures = {
+            m.name: pool.submit(compile_to_file, m.path, str(cache.path_for(m.path)))
+            for m in uncompiled
+        }
+        for module_name, future in futures.items():
+            try:
+                size = future.result()
+                logger.debug("Compiled module %r (%d bytes)", module_name, size)
+            except Exception:  # pylint: disable=broad-except
+                # The module is then compiled when loading it, which also
+                # reports the possible errors of an invalid module.
+                logger.warning("Ahead-of-time compilation of module %r failed", module_name, exc_info=True)
+    cache.evict()
+
+def warm_up(deployment: Deployment, warmups: dict[str, str | dict[str, Any]]):
+    '''
+    Call the warm-up function of each module once before serving requests.
+    The warm-up is described in the module's 'warmup' entry of the deployment
+    data either as the function name or as an object with 'function' and
+    optional 'args'.
+    '''
+    for module_name, warmup in warmups.items():
+        if isinstance(warmup, str):
+            warmup = {"function": warmup}
+        module = deployment.runtimes[module_name].modules[module_name]
+        if warmup["function"] not in module.signatures:
+            raise RuntimeError(f'Warm-up function {warmup["function"]!r} not found in module {module_name!r}')
+        logger.debug("Warming up module %r with function %r", module_name, warmup["function"])
+        with instance_manager.get_manager().using(module):
+            module.run_function(warmup["function"], warmup.get("args", []))
+
+def check_endpoint_functions(endpoints: dict[str, dict[str, Any]], runtimes: dict[str, WasmRuntime]):
+    '''
+    Check that the modules export the functions that the deployment exposes
+    as endpoints. Raise RuntimeError listing the missing ones.
+    '''
+    missing = []
+    for module_name, functions in endpoints.items():
+        runtime = runtimes.get(module_name)
+        if runtime is None:
+            continue
+        for function_name in functions:
+            found = runtime.find_function(function_name)
+            if found is None or found[0].name != module_name:
+                missing.append(f"{module_name}.{function_name}")
+    if missing:
+        raise RuntimeError(f'Functions not exported by the modules: {", ".join(missing)}')
+
+def module_resource_limits(
+    data: dict[str, Any],
+    module_configs: list[ModuleConfig],
+    runtime_names: dict[str, str]
+) -> dict[str, ResourceLimits]:
+    """
+    Return the resource limits for each module of a deployment.
+
+    The memory limit of a deployment is divided evenly between its modules,
+    and each module is further capped by its own limit. The limits can be set
+    in the deployment data with 'memoryLimit' (in bytes) for the whole
+    deployment and for each module, using the application config as default.
 
-    # Initialize __separate__ execution environments for each module for this
-    # deployment, adding filepath roots for the modules' directories that they
-    # are able to use. This way when file-access is granted via runtime, modules
-    # will only access their own directories.
-    modules_runtimes = {
-        m.name: WasmtimeRuntime([str(module_mount_path(m.name))])
-        for m in module_configs
+    Modules that may run with Wasmtime keep pooled instances for functions
+    that take or output files (see `isolation`), so their limit is divided
+    evenly between the module's own instance and the pooled ones.
+    """
+    deployment_limit = data.get("memoryLimit", current_app.config["DEPLOYMENT_MEMORY_LIMIT"])
+    module_limits = {
+        m["name"]: m.get("memoryLimit", current_app.config["MODULE_MEMORY_LIMIT"])
+        for m in data["modules"]
     }
 
-    deployments[data["deploymentId"]] = Deployment(
-        data["deploymentId"],
-        runtimes=modules_runtimes,
-        _modules=module_configs,
-        endpoints=data["endpoints"],
-        _instructions=data["instructions"],
-        _mounts=data["mounts"],
+    limits = {}
+    for module_config in module_configs:
+        memory_limits = [
+            limit for limit in (
+                module_limits.get(module_config.name),
+                deployment_limit // len(module_configs) if deployment_limit else None,
+            )
+            if limit
+        ]
+        memory_bytes = min(memory_limits) if memory_limits else None
+        if (
+            memory_bytes is not None
+            and runtime_names[module_config.name] != "wasm3"
+            and module_uses_files(data, module_config.name)
+        ):
+            memory_bytes //= 1 + isolation.get_pool_size()
+        limits[module_config.name] = ResourceLimits(
+            memory_bytes=memory_bytes,
+            table_elements=current_app.config["MODULE_TABLE_ELEMENTS_LIMIT"],
+        )
+    return limits
+
+def module_uses_files(data: dict[str, Any], module_name: str) -> bool:
+    """
+    Return True if any function of the module takes files from requests or
+    outputs files according to the mounts in the deployment data.
+    """
+    return any(
+        stage_mounts.get("execution") or stage_mounts.get("output")
+        for stage_mounts in data.get("mounts", {}).get(module_name, {}).values()
     )
 
-    # If the fetching did not fail (that is, crash), return success.
-    get_logger(request).info('Deployment created')
-    return jsonify({'status': 'success'})
+def module_runtime_names(data: dict[str, Any], module_configs: list[ModuleConfig]) -> dict[str, str]:
+    """
+    Return the name of the runtime to run each module of a deployment with.
+    The runtime can be selected in the deployment data with 'runtime' for the
+    whole deployment and for each module, using the application config as
+    default. Raise ValueError for an unknown runtime.
+    """
+    deployment_runtime = data.get("runtime", current_app.config["WASM_RUNTIME"])
+    module_runtimes = {m["name"]: m.get("runtime", deployment_runtime) for m in data["modules"]}
+
+    names = {}
+    for module_config in module_configs:
+        name = module_runtimes.get(module_config.name, deployment_runtime)
+        if name not in wasm.RUNTIMES:
+            raise ValueError(
+                f"Unknown runtime {name!r} for module {module_config.name!r}, "
+                f"expected one of {', '.join(wasm.RUNTIMES)}"
+            )
+        names[module_config.name] = name
+    return names
 
 def fetch_modules(modules) -> list[ModuleConfig]:
     """
@@ -563,13 +1348,16 @@ def fetch_modules(modules) -> list[ModuleConfig]:
     configs = []
     for module in modules:
         # Make all the requests at once.
+        start = perf_counter()
         res_bin = requests.get(module["urls"]["binary"], timeout=5)
+        metrics.outbound_request_seconds.observe(perf_counter() - start, kind="fetch")
         # Map the names of data files to their responses. The names are used to
         # save the files on disk for the module to use.
-        res_others = {
-            name: requests.get(url, timeout=5)
-            for name, url in module.get("urls", {}).get("other", {}).items()
-        }
+        res_others = {}
+        for name, url in module.get("urls", {}).get("other", {}).items():
+            start = perf_counter()
+            res_others[name] = requests.get(url, timeout=5)
+            metrics.outbound_request_seconds.observe(perf_counter() - start, kind="fetch")
 
         # Check that each request succeeded before continuing on.
         # Gather errors together.
@@ -581,13 +1369,22 @@ def fetch_modules(modules) -> list[ModuleConfig]:
         if errors:
             raise FetchFailures(errors)
 
-        # "Request for module by name"
-        module_path = os.path.join(current_app.config["MODULE_FOLDER"], module["name"])
+        # Identify the contents for noticing which modules change on redeploy.
+        digest = hashlib.sha256(res_bin.content)
+        for name in sorted(res_others):
+            digest.update(name.encode("utf-8"))
+            digest.update(res_others[name].content)
+
+        # Name the binary after its contents, so that modules of the same name
+        # in other deployments or versions do not replace it while instances
+        # may still be loaded from it.
+        module_path = os.path.join(current_app.config["MODULE_FOLDER"], hashlib.sha256(res_bin.content).hexdigest())
         # Confirm that the module directory exists and create it if not TODO:
         # This would be better performed at startup.
         os.makedirs(current_app.config["MODULE_FOLDER"], exist_ok=True)
-        with open(module_path, 'wb') as filepath:
-            filepath.write(res_bin.content)
+        # Write the file atomically, as another deployment may be loading the
+        # same binary meanwhile.
+        write_atomically(module_path, res_bin.content)
 
         # Add other listed files related to the module.
         data_files = {}
@@ -595,8 +1392,7 @@ def fetch_modules(modules) -> list[ModuleConfig]:
             other_path = module_mount_path(module["name"], key)
 
             other_path.parent.mkdir(exist_ok=True, parents=True)
-            with open(other_path, 'wb') as filepath:
-                filepath.write(res_other.content)
+            write_atomically(str(other_path), res_other.content)
 
             # Map the mount name to whatever path the actual file is at.
             data_files[key] = other_path
@@ -617,6 +1413,7 @@ def fetch_modules(modules) -> list[ModuleConfig]:
             name=module["name"],
             path=module_path,
             data_files=data_files,
+            digest=digest.hexdigest(),
         )
         # combining options a) and b) from above:
         new_module_config.set_model_from_data_files()
@@ -0,0 +1,230 @@
+"""
+Camera access for the host functions that capture images.
+
+Opening a camera and waiting for it to adjust its exposure takes much longer
+than reading a frame, so the camera service keeps the device open and grabs
+frames continuously on a background thread. Callers get the latest frame
+immediately. The device is released after it has not been asked for frames
+for a while, and opened again on the next request.
+"""
+
+from __future__ import annotations
+import threading
+from time import monotonic, sleep
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+from host_app.utils import metrics
+
+DEVICE_COUNT = 10
+"""Number of camera device indices probed when looking for a camera"""
+
+WARMUP_FRAMES = 5
+"""Number of frames discarded after opening a camera, as they are often underexposed"""
+
+JPEG_QUALITIES = (90, 80, 70, 60, 50, 40, 30, 20)
+"""JPEG qualities tried, best first, when fitting an image into a byte budget"""
+
+SCALE_STEP = 0.75
+"""Factor by which the resolution is reduced when no quality fits the budget"""
+
+MIN_SCALE = 0.1
+"""Smallest fraction of the original resolution used for fitting an image"""
+
+
+class CameraService:
+    """
+    Keeps a camera open and the latest frame from it at hand.
+
+    :param max_age: Maximum age (in seconds) of a frame given to callers.
+    :param idle_timeout: Time (in seconds) without requests for frames after
+    which the camera is released.
+    :param devices: Device indices to probe for a camera.
+    """
+    def __init__(
+        self,
+        max_age: float = 0.5,
+        idle_timeout: float = 30.0,
+        devices: Iterable[int] = range(DEVICE_COUNT)
+    ) -> None:
+        self._max_age = max_age
+        self._idle_timeout = idle_timeout
+        self._devices = list(devices)
+        self._device_index: Optional[int] = None
+        """Index of the device that worked last, tried first when opening"""
+        self._frame: Any = None
+        self._frame_time = 0.0
+        self._last_request = 0.0
+        self._error: Optional[str] = None
+        self._thread: Optional[threading.Thread] = None
+        self._condition = threading.Condition()
+        self.debug_image_path: Optional[str] = None
+        """Path where captured images are saved for debugging, None for not saving them"""
+
+    @property
+    def device_index(self) -> Optional[int]:
+        """Get the index of the camera device in use or last used."""
+        return self._device_index
+
+    def _open(self) -> Any:
+        """Open the first working camera, trying the previously working one first."""
+        import cv2  # pylint: disable=import-outside-toplevel
+
+        devices = list(self._devices)
+        if self._device_index in devices:
+            devices.remove(self._device_index)
+            devices.insert(0, self._device_index)
+        for device in devices:
+            try:
+                capture = cv2.VideoCapture(device)  # type: ignore
+                if capture.isOpened() and capture.read()[1] is not None:
+                    self._device_index = device
+                    return capture
+                capture.release()
+            except cv2.error as error:
+                print(f"Error opening camera {device}: {error}")
+        return None
+
+    def _grab_frames(self) -> None:
+        """Read frames into the buffer until the service is idle."""
+        capture = self._open()
+        if capture is None:
+            with self._condition:
+                self._error = "No camera device found!"
+                self._thread = None
+                self._condition.notify_all()
+            return
+
+        print(f"Camera {self._device_index} opened")
+        try:
+            skipped = 0
+            while True:
+                with self._condition:
+                    if monotonic() - self._last_request > self._idle_timeout:
+                        # Release while holding the lock, so that a new grabber
+                        # does not find the device busy.
+                        capture.release()
+                        capture = None
+                        print(f"Camera {self._device_index} released after being idle")
+                        self._thread = None
+                        self._frame = None
+                        break
+                ok, frame = capture.read()
+                if not ok or frame is None:
+                    # The camera might have been disconnected, so look for it again.
+                    capture.release()
+                    sleep(0.1)
+                    capture = self._open()
+                    if capture is None:
+                        with self._condition:
+                            self._error = "Camera disconnected!"
+                            self._thread = None
+                            self._frame = None
+                            self._condition.notify_all()
+                        return
+                    skipped = 0
+                    continue
+                if skipped < WARMUP_FRAMES:
+                    skipped += 1
+                    continue
+                with self._condition:
+                    self._frame = frame
+                    self._frame_time = monotonic()
+                    self._condition.notify_all()
+        finally:
+            if capture is not None:
+                capture.release()
+                print(f"Camera {self._device_index} released")
+
+    def latest_frame(self, max_age: Optional[float] = None, timeout: float = 5.0) -> Any:
+        """
+        Return the latest frame from the camera that is at most max_age
+        seconds old, waiting for one if needed. Raise RuntimeError if no
+        camera is available or no fresh frame arrives in time.
+        """
+        max_age = self._max_age if max_age is None else max_age
+        deadline = monotonic() + timeout
+        with self._condition:
+            self._last_request = monotonic()
+            if self._thread is None:
+                self._error = None
+                self._thread = threading.Thread(target=self._grab_frames, name="camera", daemon=True)
+                self._thread.start()
+            while self._frame is None or monotonic() - self._frame_time > max_age:
+                remaining = deadline - monotonic()
+                if self._error is not None and self._thread is None:
+                    raise RuntimeError(self._error)
+                if remaining <= 0:
+                    raise RuntimeError("Timed out waiting for a frame from the camera!")
+                self._condition.wait(remaining)
+            metrics.camera_frame_age_seconds.observe(monotonic() - self._frame_time)
+            return self._frame
+
+    def configure(self, max_age: float, idle_timeout: float, debug_image_path: Optional[str] = None) -> None:
+        """Change the freshness bound of frames, the idle timeout and the debug image path."""
+        with self._condition:
+            self._max_age = max_age
+            self._idle_timeout = idle_timeout
+            self.debug_image_path = debug_image_path
+
+
+class SizedJpegEncoder:
+    """
+    Encodes images as JPEG within a byte budget by lowering the quality and,
+    if that is not enough, the resolution. The settings that last fit each
+    budget are remembered and tried first, so that consecutive frames of a
+    similar scene are usually encoded only once. When a frame fits with room
+    to spare, the next one is tried with slightly better settings.
+    """
+    def __init__(self) -> None:
+        # Budget in bytes -> (scale, quality) that last fit it.
+        self._settings: Dict[int, Tuple[float, int]] = {}
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _candidates() -> List[Tuple[float, int]]:
+        """Return the (scale, quality) settings from the largest output to the smallest."""
+        candidates = []
+        scale = 1.0
+        while scale >= MIN_SCALE:
+            candidates.extend((scale, quality) for quality in JPEG_QUALITIES)
+            scale *= SCALE_STEP
+        return candidates
+
+    def encode(self, image: Any, max_bytes: int) -> bytes:
+        """
+        Return the image encoded as JPEG in at most max_bytes bytes. Raise
+        ValueError if the image does not fit even with the smallest settings.
+        """
+        import cv2  # pylint: disable=import-outside-toplevel
+
+        candidates = self._candidates()
+        with self._lock:
+            start = candidates.index(self._settings[max_bytes]) if max_bytes in self._settings else 0
+
+        resized = {1.0: image}
+        for index in range(start, len(candidates)):
+            scale, quality = candidates[index]
+            if scale not in resized:
+                resized[scale] = cv2.resize(image, None, fx=scale, fy=scale, interpolation=cv2.INTER_AREA)
+            ok, encoded = cv2.imencode(".jpg", resized[scale], [cv2.IMWRITE_JPEG_QUALITY, quality])
+            if ok and len(encoded) <= max_bytes:
+                if index == start and index > 0 and len(encoded) < max_bytes * 0.6:
+                    index -= 1
+                with self._lock:
+                    self._settings[max_bytes] = candidates[index]
+                return encoded.tobytes()
+        raise ValueError(f"Image does not fit in {max_bytes} bytes even at the lowest resolution and quality")
+
+
+_camera = CameraService()
+_encoder = SizedJpegEncoder()
+
+
+def get_camera() -> CameraService:
+    """Get the camera service used by the host functions."""
+    return _camera
+
+
+def get_encoder() -> SizedJpegEncoder:
+    """Get the encoder used for images of a fixed byte size."""
+    return _encoder
@@ -0,0 +1,266 @@
+"""
+Compression of files sent by the supervisor.
+
+Files are compressed with zstd if the optional `zstandard` package is
+installed and with gzip otherwise, and only when the other side accepts the
+encoding. Files whose media type is already compressed (e.g., JPEG images)
+and small files are sent as they are, as compressing them would cost time
+without making them much smaller.
+
+Supervisors advertise the encodings they accept in the `Accept-Encoding`
+header of their responses to function calls (RFC 7694), so the files of the
+following sub-calls to the same host can be compressed. Until a host has
+answered, its files are sent uncompressed, as a host that does not decompress
+them would take the compressed data for the file itself.
+"""
+
+from __future__ import annotations
+from collections import OrderedDict
+from dataclasses import dataclass
+import functools
+import gzip
+import os
+from pathlib import Path
+import shutil
+import tempfile
+import threading
+from typing import BinaryIO, Dict, Iterable, List, Optional, Tuple
+from urllib.parse import urlparse
+import zlib
+
+MIN_BYTES = 1024
+"""Default size (in bytes) below which files are not compressed"""
+
+MIN_SAVING = 0.1
+"""Fraction of the size that compressing a file must save for using it"""
+
+INCOMPRESSIBLE_TYPES = (
+    "image/jpeg", "image/jpg", "image/png", "image/gif", "image/webp",
+    "application/zip", "application/gzip", "application/zstd", "application/wasm",
+    "video/", "audio/",
+)
+"""Media types (or their prefixes) whose contents are compressed already"""
+
+CHUNK_SIZE = 1024 * 1024
+"""Size (in bytes) of the chunks in which files are compressed and decompressed"""
+
+DECLINED_ENTRIES = 1024
+"""Number of files remembered as not worth compressing"""
+
+_declined: OrderedDict[Tuple[Path, str], None] = OrderedDict()
+"""Recent files and encodings for which compressing was not worth it, oldest first"""
+_declined_lock = threading.Lock()
+
+
+class UnsupportedEncoding(ValueError):
+    """Raised when data is in a content encoding that can not be decompressed."""
+
+
+class DecompressedTooLarge(ValueError):
+    """Raised when decompressed data would exceed the allowed size."""
+
+
+@dataclass(frozen=True)
+class TransferPolicy:
+    """How the files sent in sub-calls to other supervisors are compressed."""
+    enabled: bool = True
+    """Whether to compress the files for hosts that accept it"""
+    min_bytes: int = MIN_BYTES
+    """Size (in bytes) below which files are sent uncompressed"""
+
+
+_policy = TransferPolicy()
+
+_peer_encodings: Dict[str, List[str]] = {}
+"""Encodings accepted by other hosts by their scheme and address"""
+_peer_lock = threading.Lock()
+
+
+def get_policy() -> TransferPolicy:
+    """Get the policy of compressing files sent in sub-calls."""
+    return _policy
+
+
+def configure(policy: TransferPolicy) -> TransferPolicy:
+    """Set the policy of compressing files sent in sub-calls. Return the policy."""
+    global _policy  # pylint: disable=global-statement
+    _policy = policy
+    return _policy
+
+
+@functools.cache
+def _zstandard():
+    """Return the zstandard module or None if it is not installed."""
+    try:
+        import zstandard  # pylint: disable=import-outside-toplevel
+    except ImportError:
+        return None
+    return zstandard
+
+
+def available_encodings() -> list[str]:
+    """Return the supported content encodings, preferred first."""
+    return (["zstd"] if _zstandard() is not None else []) + ["gzip"]
+
+
+def accept_encoding_header() -> str:
+    """Return the value of an `Accept-Encoding` header for advertising the supported encodings."""
+    return ", ".join(available_encodings())
+
+
+def _host_of(url: str) -> str:
+    """Return the scheme and address of the host of a URL."""
+    parsed = urlparse(url)
+    return f"{parsed.scheme}://{parsed.netloc}"
+
+
+def learn_accepted(url: str, header: Optional[str]) -> None:
+    """
+    Remember the encodings accepted by the host of a URL from the
+    `Accept-Encoding` header of its response. A response without the header
+    means that the host accepts no encodings.
+    """
+    accepted = [
+        value.split(";")[0].strip().lower()
+        for value in (header or "").split(",")
+        if value.strip() and not value.strip().endswith(";q=0")
+    ]
+    with _peer_lock:
+        _peer_encodings[_host_of(url)] = accepted
+
+
+def accepted_by(url: str) -> List[str]:
+    """Return the encodings known to be accepted by the host of a URL."""
+    with _peer_lock:
+        return list(_peer_encodings.get(_host_of(url), []))
+
+
+def is_compressible(media_type: Optional[str], size: int, min_bytes: int = MIN_BYTES) -> bool:
+    """Return True if a file of the media type and size is worth compressing."""
+    if size < min_bytes:
+        return False
+    media_type = (media_type or "").split(";")[0].strip().lower()
+    return not any(media_type.startswith(prefix) for prefix in INCOMPRESSIBLE_TYPES)
+
+
+def choose_encoding(
+    accepted: Iterable[str],
+    media_type: Optional[str],
+    size: int,
+    min_bytes: int = MIN_BYTES
+) -> Optional[str]:
+    """
+    Return the encoding to compress a file with given the encodings that the
+    other side accepts, or None for sending it as it is.
+    """
+    if not is_compressible(media_type, size, min_bytes):
+        return None
+    accepted = {encoding.strip().lower() for encoding in accepted}
+    return next((encoding for encoding in available_encodings() if encoding in accepted), None)
+
+
+def compressing_writer(file: BinaryIO, encoding: str) -> BinaryIO:
+    """
+    Return a file object that writes the data written to it compressed to
+    the file. Closing it does not close the file. Raise UnsupportedEncoding
+    if the encoding is not supported.
+    """
+    if encoding == "gzip":
+        return gzip.GzipFile(fileobj=file, mode="wb", compresslevel=6)
+    if encoding == "zstd" and (zstandard := _zstandard()) is not None:
+        return zstandard.ZstdCompressor().stream_writer(file, closefd=False)
+    raise UnsupportedEncoding(f"Unsupported content encoding {encoding!r}")
+
+
+def _is_declined(path: Path, encoding: str) -> bool:
+    """Return True if compressing the file was recently found not to be worth it."""
+    with _declined_lock:
+        if (path, encoding) not in _declined:
+            return False
+        _declined.move_to_end((path, encoding))
+        return True
+
+
+def _decline(path: Path, encoding: str) -> None:
+    """Remember that compressing the file is not worth it, forgetting the oldest such files."""
+    with _declined_lock:
+        _declined[(path, encoding)] = None
+        _declined.move_to_end((path, encoding))
+        while len(_declined) > DECLINED_ENTRIES:
+            _declined.popitem(last=False)
+
+
+def compressed_variant(path: Path, encoding: str) -> Optional[Path]:
+    """
+    Return the path of a compressed copy of the file, creating it on first
+    use next to the file. Return None if compressing does not make the file
+    small enough to be worth it.
+    """
+    variant = path.with_name(f".{path.name}.{encoding}")
+    if variant.exists():
+        return variant
+    if _is_declined(path, encoding):
+        return None
+    # The file is compressed in chunks into a temporary file, so that it does
+    # not need to fit in memory.
+    fd, temp_path = tempfile.mkstemp(dir=path.parent, prefix=".partial-")
+    try:
+        with os.fdopen(fd, "wb") as file:
+            with open(path, "rb") as source, compressing_writer(file, encoding) as writer:
+                shutil.copyfileobj(source, writer, CHUNK_SIZE)
+                size = source.tell()
+            compressed_size = file.tell()
+        if compressed_size > size * (1 - MIN_SAVING):
+            os.unlink(temp_path)
+            _decline(path, encoding)
+            return None
+        os.replace(temp_path, variant)
+    except BaseException:
+        if os.path.exists(temp_path):
+            os.unlink(temp_path)
+        raise
+    return variant
+
+
+def decompressing_reader(stream: BinaryIO, encoding: str) -> BinaryIO:
+    """
+    Return a file object that reads the decompressed contents of a stream.
+    Raise UnsupportedEncoding if the encoding is not supported.
+    """
+    encoding = encoding.strip().lower()
+    if encoding in ("", "identity"):
+        return stream
+    if encoding in ("gzip", "x-gzip"):
+        return gzip.GzipFile(fileobj=stream, mode="rb")
+    if encoding == "zstd" and (zstandard := _zstandard()) is not None:
+        return zstandard.ZstdDecompressor().stream_reader(stream)
+    raise UnsupportedEncoding(f"Unsupported content encoding {encoding!r}")
+
+
+def decompress_to(stream: BinaryIO, encoding: str, target: Path, max_bytes: Optional[int] = None) -> int:
+    """
+    Write the decompressed contents of a stream to a file in chunks and
+    return the number of bytes written. Raise UnsupportedEncoding if the
+    encoding is not supported, DecompressedTooLarge if the contents exceed
+    max_bytes and ValueError if the data is not valid for the encoding. The
+    file is removed if decompressing fails.
+    """
+    reader = decompressing_reader(stream, encoding)
+    zstandard = _zstandard()
+    errors = (EOFError, gzip.BadGzipFile, zlib.error) + ((zstandard.ZstdError,) if zstandard is not None else ())
+    written = 0
+    try:
+        with open(target, "wb") as file:
+            while chunk := reader.read(CHUNK_SIZE):
+                written += len(chunk)
+                # Small compressed data can expand to fill the disk.
+                if max_bytes is not None and written > max_bytes:
+                    raise DecompressedTooLarge(f"Decompressed data exceeds {max_bytes} bytes")
+                file.write(chunk)
+    except errors as error:
+        target.unlink(missing_ok=True)
+        raise ValueError(f"Decompressing {encoding} data failed: {error}") from error
+    except BaseException:
+        target.unlink(missing_ok=True)
+        raise
+    return written
@@ -72,8 +72,3 @@ def _check_open(path, obj):
         with path.open("x") as f:
             json.dump(obj, f)
     return path.open("r")
-
-remote_functions = get_remote_functions()
-print(remote_functions)
-
-modules = get_modules()
\ No newline at end of file
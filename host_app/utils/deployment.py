@@ -4,15 +4,23 @@ This module defines the Deployment and CallData classes.
 - CallData contains the data needed for then actually calling a remote function's endpoint.
 '''
 
+from contextlib import contextmanager
 from dataclasses import dataclass, field
+from enum import Enum
 from functools import reduce
 from itertools import chain
 import json
+import os
 from pathlib import Path
-from typing import Any, Dict, Tuple, Set
+import shutil
+import threading
+from time import monotonic
+from typing import Any, Callable, Dict, Generator, Iterable, Tuple, Set
 
+from host_app.wasm_utils import instance_manager
 from host_app.wasm_utils.wasm_api import ModuleConfig, WasmModule, WasmRuntime, WasmType
-from host_app.utils import FILE_TYPES
+from host_app.utils import FILE_TYPES, scratch
+from host_app.utils.isolation import IsolatedPool
 from host_app.utils.endpoint import EndpointResponse, Endpoint, Schema, SchemaType
 from host_app.utils.mount import MountStage, MountPathFile
 
@@ -107,6 +115,80 @@ MountStageMap = dict[MountStage, list[MountPathMap]]
 FunctionMountMap = dict[str, MountStageMap]
 ModuleMountMap = dict[str, FunctionMountMap]
 
+class DeploymentState(Enum):
+    '''
+    Defines the stage of setting up a deployment in the background.
+    '''
+    PENDING = 'pending'
+    FETCHING = 'fetching'
+    COMPILING = 'compiling'
+    INSTANTIATING = 'instantiating'
+    WARMING_UP = 'warming-up'
+    READY = 'ready'
+    FAILED = 'failed'
+
+@dataclass
+class DeploymentStatus:
+    '''
+    Progress of setting up a deployment. Readers can wait on the status until
+    the deployment is either ready or has failed.
+    '''
+    id: str # pylint: disable=invalid-name
+    state: DeploymentState = DeploymentState.PENDING
+    error: str | None = None
+    timestamps: dict[str, float] = field(default_factory=dict)
+    '''Monotonic time (in seconds) at which each state was entered'''
+    modules: list[str] = field(default_factory=list)
+    '''Names of the modules in the deployment's manifest'''
+    reused_modules: list[str] = field(default_factory=list)
+    '''Names of modules kept running unchanged from the previous version of the deployment'''
+    _settled: threading.Event = field(default_factory=threading.Event, repr=False)
+
+    def __post_init__(self):
+        self.timestamps[self.state.value] = monotonic()
+
+    def set_state(self, state: DeploymentState, error: str | None = None):
+        '''Move to the given state, releasing waiters if the deployment has settled.'''
+        self.state = state
+        self.error = error
+        self.timestamps[state.value] = monotonic()
+        if state in (DeploymentState.READY, DeploymentState.FAILED):
+            self._settled.set()
+
+    def wait(self, timeout: float | None = None) -> bool:
+        '''
+        Wait for the deployment to become ready or fail. Return True if it
+        settled within timeout seconds.
+        '''
+        return self._settled.wait(timeout)
+
+    def durations(self) -> dict[str, float]:
+        '''Return the time (in seconds) spent in each state that has been left.'''
+        states = list(self.timestamps.items())
+        return {
+            state: next_timestamp - timestamp
+            for (state, timestamp), (_, next_timestamp) in zip(states, states[1:])
+        }
+
+    def as_dict(self) -> dict[str, Any]:
+        '''Return the status in a JSON-serializable form.'''
+        return {
+            "deploymentId": self.id,
+            "state": self.state.value,
+            "error": self.error,
+            "reusedModules": self.reused_modules,
+            "durations": self.durations(),
+        }
+
+@dataclass
+class Workspace:
+    '''Instance of a module that runs an invocation and the directories of its files'''
+    module: WasmModule
+    directory: Path | None = None
+    '''Directory where the invocation's input and output files are, None for the module's mount directory'''
+    data_dirs: list[str] | None = None
+    '''Directories that the module can access, None for the ones of its runtime'''
+
 @dataclass
 class Deployment:
     '''
@@ -122,6 +204,13 @@ class Deployment:
     modules: dict[str, ModuleConfig] = field(init=False)
     instructions: ModuleLinkMap = field(init=False)
     mounts: ModuleMountMap = field(init=False)
+    _active: int = field(default=0, init=False, repr=False)
+    '''Number of invocations currently using the deployment'''
+    _on_idle: Callable[[], None] | None = field(default=None, init=False, repr=False)
+    _retired: bool = field(default=False, init=False, repr=False)
+    _lock: threading.Lock = field(default_factory=threading.Lock, init=False, repr=False)
+    _pools: dict[str, IsolatedPool] = field(default_factory=dict, init=False, repr=False)
+    '''Instances of the modules for invocations that handle files'''
 
     def __post_init__(self):
         # Map the modules by their names for easier access.
@@ -158,6 +247,83 @@ class Deployment:
                 self.instructions[module_name][function_name] = \
                     FunctionLink(from_=link["from"], to=link["to"])
 
+    def memory_usage(self) -> dict[str, dict[str, int | None]]:
+        """
+        Return the size of linear memory and the memory limit in bytes for
+        each of the deployment's modules. The sizes are the ones recorded at
+        the end of the latest calls, as the memory can not be read safely
+        while a call is running on another thread.
+        """
+        manager = instance_manager.get_manager()
+        usage = {}
+        for module_name, runtime in self.runtimes.items():
+            module = runtime.modules.get(module_name)
+            usage[module_name] = {
+                "memoryBytes": manager.memory_size(module) if module is not None else None,
+                "memoryLimit": runtime.limits.memory_bytes,
+            }
+        return usage
+
+    @contextmanager
+    def in_use(self) -> Generator['Deployment', None, None]:
+        '''
+        Mark the deployment as used by an invocation for the duration of the
+        context, so that it is not torn down in the middle of the invocation.
+        '''
+        with self._lock:
+            if self._retired:
+                raise RuntimeError(f'Deployment {self.id!r} has been removed')
+            self._active += 1
+        try:
+            yield self
+        finally:
+            with self._lock:
+                self._active -= 1
+                on_idle = self._on_idle if self._active == 0 else None
+                if on_idle is not None:
+                    self._on_idle = None
+            if on_idle is not None:
+                on_idle()
+
+    def retire(
+        self,
+        keep: Iterable[WasmRuntime] = (),
+        on_closed: Callable[[], None] | None = None
+    ) -> int:
+        '''
+        Release the runtimes of the deployment, except the ones to keep, once
+        the ongoing invocations have finished. Then call on_closed.
+
+        Return the size (in bytes) of the linear memory to be released.
+        '''
+        kept = {id(runtime) for runtime in keep}
+        runtimes = [runtime for runtime in self.runtimes.values() if id(runtime) not in kept]
+        # The sizes recorded by the instance manager are used, as reading
+        # them from the modules would touch stores that may be in use.
+        manager = instance_manager.get_manager()
+        memory_bytes = sum(
+            manager.memory_size(module) or 0
+            for runtime in runtimes for module in runtime.modules.values()
+        )
+
+        def close():
+            with self._lock:
+                pools, self._pools = list(self._pools.values()), {}
+            for pool in pools:
+                pool.close()
+            for runtime in runtimes:
+                runtime.close()
+            if on_closed is not None:
+                on_closed()
+
+        with self._lock:
+            self._retired = True
+            if self._active > 0:
+                self._on_idle = close
+                return memory_bytes
+        close()
+        return memory_bytes
+
     def _next_target(self, module_name, function_name) -> Endpoint | None:
         '''
         Return the target where the module's function's output is to be sent next.
@@ -167,11 +333,31 @@ class Deployment:
         # prevent unnecessary network requests.
         return self.instructions[module_name][function_name].to
 
+    def uses_files(self, module_name, function_name) -> bool:
+        '''
+        Return True if the function takes files from the request or outputs
+        files, so that its invocations need directories of their own.
+        '''
+        mounts = self.mounts.get(module_name, {}).get(function_name, {})
+        return bool(mounts.get(MountStage.EXECUTION) or mounts.get(MountStage.OUTPUT))
+
+    def output_media_type(self, module_name, function_name, name) -> str | None:
+        '''
+        Return the media type of an output file of the function as described
+        by its mount, or None if it is not described.
+        '''
+        mounts = self.mounts.get(module_name, {}).get(function_name, {})
+        return next(
+            (mount.media_type for mount in mounts.get(MountStage.OUTPUT, []) if mount.path == name),
+            None
+        )
+
     def _connect_request_files_to_mounts(
         self,
         module_name,
         function_name,
-        request_filepaths: dict[str, Path]
+        request_filepaths: dict[str, Path],
+        workdir: Path | None = None
     ) -> None:
         """
         Check the validity of file mounts received in request. Set _all_ mounts
@@ -180,6 +366,11 @@ class Deployment:
         The setup is needed, because received files in requests are saved into
         some arbitrary filesystem locations, where they need to be moved from
         for the Wasm module to access.
+
+        With a scratch directory of the invocation, the received files are
+        set up there, while the deployment files stay where they are (see
+        `isolated`). Otherwise the files are set up in the module's mount
+        directory.
         """
         mounts: MountStageMap = self.mounts[module_name][function_name]
         deployment_stage_mount_paths = mounts[MountStage.DEPLOYMENT]
@@ -233,6 +424,14 @@ class Deployment:
                 print(f'Module expects mount "{mount.path}", but it was not found in request or deployment.')
                 raise RuntimeError(f'Missing input file "{mount.path}"')
 
+            if workdir is not None:
+                if mount.stage == MountStage.DEPLOYMENT:
+                    continue
+                host_path = scratch.get_scratch().path_in(workdir, mount.path)
+                if host_path != Path(temp_source_path).resolve():
+                    shutil.move(temp_source_path, host_path)
+                continue
+
             # FIXME: Importing here to avoid circular imports.
             from host_app.flask_app.app import module_mount_path
             host_path = module_mount_path(module_name, mount.path)
@@ -248,7 +447,9 @@ class Deployment:
         module_name,
         function_name,
         args: dict,
-        request_filepaths: Dict[str, str]
+        request_filepaths: Dict[str, str],
+        on_stage: Callable[[str], None] | None = None,
+        workdir: Path | None = None
     ) -> Tuple[WasmModule, list[WasmType]]:
         '''
         Based on module's function's description, figure out what the
@@ -261,6 +462,10 @@ class Deployment:
 
         :param app_context_module_mount_path: Function for getting the path to
         module's mount path based on Flask app's config.
+        :param on_stage: Function called with the name of each stage of the
+        preparation ('mounts') when the stage starts.
+        :param workdir: Scratch directory of the invocation to set the files up
+        in instead of the module's mount directory.
         '''
         # Initialize the module.
         module_config = self.modules[module_name]
@@ -275,10 +480,44 @@ class Deployment:
 
         # Get the mounts described for this module for checking requirementes
         # and mapping to actual received files in this request.
-        self._connect_request_files_to_mounts(module.name, function_name, request_filepaths)
+        if on_stage is not None:
+            on_stage("mounts")
+        self._connect_request_files_to_mounts(module.name, function_name, request_filepaths, workdir)
 
         return module, primitive_args
 
+    @contextmanager
+    def isolated(self, module: WasmModule, workdir: Path | None) -> Generator[Workspace, None, None]:
+        '''
+        Give an invocation an instance of the module and the directories of
+        its files for the duration of the context.
+
+        Without a scratch directory, the module runs with its mount directory.
+        Modules whose directories are opened when they are instantiated (see
+        `WasmModule.needs_isolation`) borrow an instance with a directory of
+        its own, into which the files of the scratch directory are moved and
+        where the deployment files have been copied. Other modules access the
+        scratch directory through the invocation and read the deployment files
+        from their mount directory.
+        '''
+        if workdir is None:
+            yield Workspace(module)
+            return
+        runtime = self.runtimes[module.name]
+        if not module.needs_isolation:
+            yield Workspace(module, workdir, [str(workdir), *runtime.data_dirs])
+            return
+
+        with self._lock:
+            pool = self._pools.get(module.name)
+            if pool is None:
+                pool = self._pools[module.name] = IsolatedPool(runtime, self.modules[module.name])
+        with pool.acquire() as instance:
+            space = scratch.get_scratch()
+            for path in [path for path in workdir.rglob("*") if path.is_file()]:
+                os.replace(path, space.path_in(instance.directory, path.relative_to(workdir).as_posix()))
+            yield Workspace(instance.module, instance.directory, [str(instance.directory)])
+
     def interpret_call_from(
         self,
         module_name,
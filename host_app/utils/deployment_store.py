@@ -0,0 +1,118 @@
+"""
+Persistence of installed deployments, so that they can be restored when the
+supervisor restarts instead of waiting for the orchestrator to deploy them
+again.
+
+Each deployment is saved as a JSON file holding the deployment manifest as
+received from the orchestrator and the configurations of its fetched modules.
+The file is named after the SHA-256 hash of the deployment's id, so that any
+id maps to a file of its own inside the directory.
+"""
+
+from __future__ import annotations
+from dataclasses import dataclass
+import hashlib
+import json
+from pathlib import Path
+from typing import Any, List, Optional
+
+from host_app.utils.files import write_atomically
+from host_app.wasm_utils.wasm_api import ModuleConfig
+
+RECORD_SUFFIX = ".json"
+
+
+@dataclass
+class DeploymentRecord:
+    """A saved deployment."""
+    manifest: dict[str, Any]
+    """The deployment data as received in the deployment request"""
+    modules: List[ModuleConfig]
+
+    @property
+    def id(self) -> str:  # pylint: disable=invalid-name
+        """Get the id of the deployment."""
+        return self.manifest["deploymentId"]
+
+    def missing_files(self) -> List[Path]:
+        """Return the files of the modules that no longer exist on disk."""
+        paths = [Path(m.path) for m in self.modules]
+        paths.extend(path for m in self.modules for path in m.data_files.values())
+        return [path for path in paths if not path.is_file()]
+
+
+class DeploymentStore:
+    """
+    Directory of saved deployments. A store without a directory is disabled
+    and saves nothing.
+    """
+    def __init__(self, directory: Optional[Path] = None) -> None:
+        self._directory = Path(directory) if directory is not None else None
+        if self._directory is not None:
+            self._directory.mkdir(parents=True, exist_ok=True)
+
+    @property
+    def directory(self) -> Optional[Path]:
+        """Get the directory of the store or None if the store is disabled."""
+        return self._directory
+
+    def _path_for(self, deployment_id: str) -> Optional[Path]:
+        if self._directory is None:
+            return None
+        # The ids come from the orchestrator, so they are hashed to keep them
+        # from escaping the directory or colliding with each other.
+        digest = hashlib.sha256(deployment_id.encode("utf-8")).hexdigest()
+        return self._directory / (digest + RECORD_SUFFIX)
+
+    def save(self, record: DeploymentRecord) -> None:
+        """Save the deployment, replacing its possible earlier version."""
+        path = self._path_for(record.id)
+        if path is None:
+            return
+        data = {
+            "manifest": record.manifest,
+            "modules": [m.as_dict() for m in record.modules],
+        }
+        write_atomically(str(path), json.dumps(data).encode("utf-8"))
+
+    def remove(self, deployment_id: str) -> None:
+        """Forget the saved deployment."""
+        path = self._path_for(deployment_id)
+        if path is None:
+            return
+        try:
+            path.unlink()
+        except FileNotFoundError:
+            pass
+
+    def load_all(self) -> List[DeploymentRecord]:
+        """Return the saved deployments, skipping the ones that can not be read."""
+        if self._directory is None:
+            return []
+        records = []
+        for path in sorted(self._directory.glob("*" + RECORD_SUFFIX)):
+            try:
+                data = json.loads(path.read_text(encoding="utf-8"))
+                record = DeploymentRecord(
+                    manifest=data["manifest"],
+                    modules=[ModuleConfig.from_dict(m) for m in data["modules"]],
+                )
+                records.append(record)
+            except (OSError, ValueError, KeyError, TypeError) as error:
+                print(f"Could not read saved deployment {path.name}: {error}")
+        return records
+
+
+_store = DeploymentStore()
+
+
+def get_store() -> DeploymentStore:
+    """Get the store of saved deployments."""
+    return _store
+
+
+def configure(directory: Optional[Path]) -> DeploymentStore:
+    """Set up the store of saved deployments and return it."""
+    global _store  # pylint: disable=global-statement
+    _store = DeploymentStore(directory)
+    return _store
@@ -0,0 +1,23 @@
+"""
+Writing files that other threads or processes may be reading.
+"""
+
+import os
+import tempfile
+
+
+def write_atomically(path: str, data: bytes | bytearray) -> int:
+    """
+    Write data to a temporary file next to path and rename it to path. Return
+    the number of bytes written.
+    """
+    directory = os.path.dirname(path) or "."
+    fd, temp_path = tempfile.mkstemp(dir=directory, prefix=".partial-")
+    try:
+        with os.fdopen(fd, "wb") as file:
+            file.write(data)
+        os.replace(temp_path, path)
+    except BaseException:
+        os.unlink(temp_path)
+        raise
+    return len(data)
@@ -0,0 +1,190 @@
+"""
+Warm instances of modules for invocations that handle files.
+
+WASI opens a module's directories when its instance is created, so an
+instance whose directory is the module's mount directory can not be given
+the scratch directory of an invocation. Instead of instantiating the module
+for every such invocation, each module keeps a small pool of instances with
+a directory of their own. An invocation borrows an idle instance, its files
+are moved into the instance's directory and its outputs out of it, and the
+directory is then reset for the next invocation. The deployment files of the
+module are copied into the directory once, when the instance is created.
+
+The pooled instances are tracked by the instance manager like any other, so
+idle ones are unloaded under memory pressure and created again when needed.
+"""
+
+from __future__ import annotations
+from contextlib import contextmanager
+from dataclasses import dataclass, field
+import os
+from pathlib import Path
+import threading
+from typing import Dict, Generator, List, Tuple
+
+from host_app.utils import scratch
+from host_app.wasm_utils import instance_manager
+from host_app.wasm_utils.wasm_api import ModuleConfig, WasmModule, WasmRuntime
+
+POOL_SIZE = 2
+"""Default number of instances of each module for invocations that handle files"""
+
+_pool_size = POOL_SIZE
+
+
+def get_pool_size() -> int:
+    """Get the number of instances kept of each module."""
+    return _pool_size
+
+
+def configure(size: int) -> int:
+    """Set the number of instances kept of each module. Return the size."""
+    global _pool_size  # pylint: disable=global-statement
+    _pool_size = max(1, size)
+    return _pool_size
+
+
+@dataclass
+class IsolatedInstance:
+    """An instance of a module and the directory opened for it."""
+    module: WasmModule
+    directory: Path
+    data_files: Dict[str, Tuple[int, int]] = field(default_factory=dict)
+    """Size and modification time of the copied deployment files by their names"""
+
+    @property
+    def loaded(self) -> bool:
+        """Return True if the instance has not been unloaded to free memory."""
+        runtime = self.module.runtime
+        return runtime is not None and runtime.modules.get(self.module.name) is self.module
+
+
+class IsolatedPool:
+    """
+    Instances of a module for invocations that handle files, created on
+    demand up to the pool size. Invocations wait for an instance when all of
+    them are in use.
+    """
+    def __init__(self, runtime: WasmRuntime, config: ModuleConfig) -> None:
+        self._runtime = runtime
+        self._config = config
+        self._idle: List[IsolatedInstance] = []
+        self._count = 0
+        """Number of instances, idle or in use"""
+        self._closed = False
+        self._condition = threading.Condition()
+
+    def _copy_data_files(self, instance: IsolatedInstance) -> None:
+        """Copy the deployment files of the module that are missing from the instance's directory."""
+        space = scratch.get_scratch()
+        for name, source in self._config.data_files.items():
+            if name in instance.data_files:
+                continue
+            target = space.copy(Path(source), instance.directory, name)
+            stat_result = target.stat()
+            instance.data_files[name] = (stat_result.st_size, stat_result.st_mtime_ns)
+
+    def _create(self) -> IsolatedInstance:
+        """Create an instance with a new directory and register it with the instance manager."""
+        space = scratch.get_scratch()
+        directory = space.create(f"{self._config.name}-instance")
+        try:
+            # The module's own instance may have been unloaded since the last
+            # time, so it is loaded again if needed.
+            loaded = self._runtime.get_or_load_module(self._config)
+            module = loaded.new_isolated(self._config, [str(directory)]) if loaded is not None else None
+            if module is None or module.runtime is None:
+                raise RuntimeError(f"Module '{self._config.name}' can not be instantiated for invocations")
+            instance = IsolatedInstance(module, directory)
+            self._copy_data_files(instance)
+        except Exception:
+            space.remove(directory)
+            raise
+        instance_manager.get_manager().track(module.runtime, module)
+        return instance
+
+    def _destroy(self, instance: IsolatedInstance) -> None:
+        """Release the instance along with its runtime and directory."""
+        if instance.module.runtime is not None:
+            instance.module.runtime.close()
+        scratch.get_scratch().remove(instance.directory)
+
+    def _reset(self, instance: IsolatedInstance) -> None:
+        """
+        Remove the files left in the instance's directory by an invocation,
+        copying again the deployment files that were changed or removed.
+        """
+        for root, dirs, files in os.walk(instance.directory, topdown=False):
+            for name in files:
+                path = Path(root, name)
+                relative = path.relative_to(instance.directory).as_posix()
+                known = instance.data_files.get(relative)
+                stat_result = path.lstat()
+                if known is None or known != (stat_result.st_size, stat_result.st_mtime_ns):
+                    instance.data_files.pop(relative, None)
+                    path.unlink()
+            for name in dirs:
+                path = Path(root, name)
+                if path.is_symlink():
+                    path.unlink()
+                elif not any(path.iterdir()):
+                    path.rmdir()
+        self._copy_data_files(instance)
+
+    @contextmanager
+    def acquire(self) -> Generator[IsolatedInstance, None, None]:
+        """
+        Borrow an instance for the duration of the context. The instance is
+        protected from being unloaded while borrowed and its directory is
+        reset when it is returned.
+        """
+        with self._condition:
+            while not self._idle and self._count >= get_pool_size() and not self._closed:
+                self._condition.wait()
+            if self._closed:
+                raise RuntimeError(f"Instances of module '{self._config.name}' have been released")
+            instance = self._idle.pop() if self._idle else None
+            if instance is None:
+                self._count += 1
+
+        try:
+            if instance is not None and not instance.loaded:
+                self._destroy(instance)
+                instance = None
+            if instance is None:
+                instance = self._create()
+        except Exception:
+            with self._condition:
+                self._count -= 1
+                self._condition.notify()
+            raise
+
+        try:
+            with instance_manager.get_manager().using(instance.module):
+                yield instance
+        finally:
+            try:
+                self._reset(instance)
+                keep = True
+            except OSError as error:
+                print(f"Could not reset the directory of an instance of '{self._config.name}': {error}")
+                keep = False
+            with self._condition:
+                keep = keep and not self._closed
+                if keep:
+                    self._idle.append(instance)
+                else:
+                    self._count -= 1
+                self._condition.notify()
+            if not keep:
+                self._destroy(instance)
+
+    def close(self) -> None:
+        """Release the idle instances. Instances in use are released when returned."""
+        with self._condition:
+            self._closed = True
+            idle, self._idle = self._idle, []
+            self._count -= len(idle)
+            self._condition.notify_all()
+        for instance in idle:
+            self._destroy(instance)
@@ -41,6 +41,8 @@ class JsonFormatter(logging.Formatter):
             json_message['request_id'] = record.request.request_id
             json_message['deployment_id'] = record.request.deployment_id
             json_message['module_name'] = record.request.module_name
+            if getattr(record.request, 'durations', None):
+                json_message['stage_durations'] = record.request.durations
 
         return json.dumps(json_message)
 
@@ -0,0 +1,296 @@
+"""
+Low-overhead and thread-safe metrics for the supervisor's execution path.
+
+The metrics are collected into a registry and rendered in the Prometheus text
+exposition format (version 0.0.4) so that they can be scraped from the
+`/metrics` endpoint.
+"""
+
+from __future__ import annotations
+from bisect import bisect_left
+import threading
+from typing import Callable, Dict, Iterator, List, Optional, Tuple
+
+LabelValues = Tuple[str, ...]
+
+DEFAULT_BUCKETS: Tuple[float, ...] = (
+    0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0
+)
+"""Upper bounds (in seconds) of the histogram buckets used by default."""
+
+
+def _escape(value: str) -> str:
+    """Escape a label value for the text exposition format."""
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(names: Tuple[str, ...], values: LabelValues, extra: str = "") -> str:
+    """Return the labels formatted as `{name="value",...}` or empty string if none."""
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _format_value(value: float) -> str:
+    """Format a sample value."""
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value))
+
+
+class Metric:
+    """Superclass for metrics with a name, help text and label names."""
+    type_name = "untyped"
+
+    def __init__(self, name: str, documentation: str, labelnames: Tuple[str, ...] = ()) -> None:
+        self._name = name
+        self._documentation = documentation
+        self._labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+
+    @property
+    def name(self) -> str:
+        """Get the name of the metric."""
+        return self._name
+
+    def _label_values(self, labels: Dict[str, str]) -> LabelValues:
+        """Return the values of the given labels in the order of label names."""
+        if len(labels) != len(self._labelnames):
+            raise ValueError(f"Metric '{self._name}' expects labels {self._labelnames}, got {tuple(labels)}")
+        return tuple(str(labels[name]) for name in self._labelnames)
+
+    def samples(self) -> Iterator[Tuple[str, str, float]]:
+        """Return tuples of (sample name suffix, formatted labels, value)."""
+        raise NotImplementedError
+
+    def render(self) -> str:
+        """Render the metric in the text exposition format."""
+        lines = [
+            f"# HELP {self._name} {self._documentation}",
+            f"# TYPE {self._name} {self.type_name}",
+        ]
+        for suffix, labels, value in self.samples():
+            lines.append(f"{self._name}{suffix}{labels} {_format_value(value)}")
+        return "\n".join(lines)
+
+
+class Counter(Metric):
+    """Monotonically increasing value."""
+    type_name = "counter"
+
+    def __init__(self, name: str, documentation: str, labelnames: Tuple[str, ...] = ()) -> None:
+        super().__init__(name, documentation, labelnames)
+        self._values: Dict[LabelValues, float] = {}
+
+    def inc(self, amount: float = 1, **labels: str) -> None:
+        """Increase the counter of the given labels by amount."""
+        key = self._label_values(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def get(self, **labels: str) -> float:
+        """Get the current value of the counter with the given labels."""
+        with self._lock:
+            return self._values.get(self._label_values(labels), 0)
+
+    def samples(self) -> Iterator[Tuple[str, str, float]]:
+        with self._lock:
+            values = list(self._values.items())
+        for key, value in values:
+            yield "_total", _format_labels(self._labelnames, key), value
+
+
+class Gauge(Metric):
+    """Value that can go up and down or be read from a callback when rendered."""
+    type_name = "gauge"
+
+    def __init__(self, name: str, documentation: str, labelnames: Tuple[str, ...] = ()) -> None:
+        super().__init__(name, documentation, labelnames)
+        self._values: Dict[LabelValues, float] = {}
+        self._function: Optional[Callable[[], float]] = None
+
+    def set(self, value: float, **labels: str) -> None:
+        """Set the gauge of the given labels to value."""
+        key = self._label_values(labels)
+        with self._lock:
+            self._values[key] = value
+
+    def inc(self, amount: float = 1, **labels: str) -> None:
+        """Increase the gauge of the given labels by amount."""
+        key = self._label_values(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def dec(self, amount: float = 1, **labels: str) -> None:
+        """Decrease the gauge of the given labels by amount."""
+        self.inc(-amount, **labels)
+
+    def set_function(self, function: Callable[[], float]) -> None:
+        """Read the (unlabeled) value of the gauge from function when rendered."""
+        self._function = function
+
+    def samples(self) -> Iterator[Tuple[str, str, float]]:
+        if self._function is not None:
+            yield "", "", self._function()
+            return
+        with self._lock:
+            values = list(self._values.items())
+        for key, value in values:
+            yield "", _format_labels(self._labelnames, key), value
+
+
+class Histogram(Metric):
+    """Distribution of observed values counted into cumulative buckets."""
+    type_name = "histogram"
+
+    def __init__(
+        self,
+        name: str,
+        documentation: str,
+        labelnames: Tuple[str, ...] = (),
+        buckets: Tuple[float, ...] = DEFAULT_BUCKETS
+    ) -> None:
+        super().__init__(name, documentation, labelnames)
+        self._buckets = tuple(sorted(buckets))
+        # Per label values: counts of each bucket (plus +Inf), sum and count.
+        self._values: Dict[LabelValues, Tuple[List[int], List[float]]] = {}
+
+    def observe(self, value: float, **labels: str) -> None:
+        """Record an observed value for the given labels."""
+        key = self._label_values(labels)
+        index = bisect_left(self._buckets, value)
+        with self._lock:
+            if key not in self._values:
+                self._values[key] = ([0] * (len(self._buckets) + 1), [0.0, 0])
+            counts, total = self._values[key]
+            counts[index] += 1
+            total[0] += value
+            total[1] += 1
+
+    def samples(self) -> Iterator[Tuple[str, str, float]]:
+        with self._lock:
+            values = [(key, (list(counts), list(total))) for key, (counts, total) in self._values.items()]
+        for key, (counts, total) in values:
+            cumulative = 0
+            for bound, count in zip(self._buckets + (float("inf"),), counts):
+                cumulative += count
+                yield (
+                    "_bucket",
+                    _format_labels(self._labelnames, key, f'le="{_format_value(bound)}"'),
+                    cumulative
+                )
+            labels = _format_labels(self._labelnames, key)
+            yield "_sum", labels, total[0]
+            yield "_count", labels, total[1]
+
+
+class Registry:
+    """Collection of metrics rendered together."""
+    def __init__(self) -> None:
+        self._metrics: Dict[str, Metric] = {}
+        self._lock = threading.Lock()
+
+    def register(self, metric: Metric) -> Metric:
+        """Add a metric to the registry and return it."""
+        with self._lock:
+            if metric.name in self._metrics:
+                raise ValueError(f"Metric '{metric.name}' is already registered")
+            self._metrics[metric.name] = metric
+        return metric
+
+    def render(self) -> str:
+        """Render all the metrics in the text exposition format."""
+        with self._lock:
+            metrics = list(self._metrics.values())
+        return "\n".join(metric.render() for metric in metrics) + "\n"
+
+
+REGISTRY = Registry()
+"""Registry of the supervisor's metrics served at `/metrics`."""
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+"""Content type of the rendered metrics."""
+
+invocations = REGISTRY.register(Counter(
+    "wasmiot_invocations",
+    "Number of handled WebAssembly function invocations.",
+    ("deployment", "module", "function", "success"),
+))
+invocation_stage_seconds = REGISTRY.register(Histogram(
+    "wasmiot_invocation_stage_seconds",
+    "Time spent in each stage of handling WebAssembly function invocations.",
+    ("deployment", "module", "function", "stage"),
+))
+wasm_queue_depth = REGISTRY.register(Gauge(
+    "wasmiot_wasm_queue_depth",
+    "Number of invocations waiting in the queue for asynchronous execution.",
+))
+module_loads = REGISTRY.register(Counter(
+    "wasmiot_module_loads",
+    "Number of loaded Wasm modules by whether they were compiled or deserialized from cache.",
+    ("source",),
+))
+instantiation_seconds = REGISTRY.register(Histogram(
+    "wasmiot_module_instantiation_seconds",
+    "Time spent instantiating Wasm modules.",
+    ("runtime",),
+))
+memory_bytes = REGISTRY.register(Counter(
+    "wasmiot_memory_bytes",
+    "Number of bytes moved between the host and Wasm linear memory.",
+    ("direction",),
+))
+outbound_request_seconds = REGISTRY.register(Histogram(
+    "wasmiot_outbound_request_seconds",
+    "Latency of outbound HTTP requests made by the supervisor.",
+    ("kind",),
+))
+subcall_file_bytes = REGISTRY.register(Counter(
+    "wasmiot_subcall_file_bytes",
+    "Number of bytes of files sent to other supervisors in chained sub-calls by content encoding.",
+    ("encoding",),
+))
+rpc_calls_pending = REGISTRY.register(Gauge(
+    "wasmiot_rpc_calls_pending",
+    "Number of asynchronous RPC calls started by Wasm modules whose responses have not been read.",
+))
+deployment_stage_seconds = REGISTRY.register(Histogram(
+    "wasmiot_deployment_stage_seconds",
+    "Time spent in each stage of setting up deployments.",
+    ("stage",),
+))
+module_cache_requests = REGISTRY.register(Counter(
+    "wasmiot_module_cache_requests",
+    "Number of lookups of compiled Wasm modules from the cache by whether they were found.",
+    ("result",),
+))
+module_cache_evictions = REGISTRY.register(Counter(
+    "wasmiot_module_cache_evictions",
+    "Number of compiled Wasm modules evicted from the cache to keep it within its quota.",
+))
+module_cache_bytes = REGISTRY.register(Gauge(
+    "wasmiot_module_cache_bytes",
+    "Total size of the compiled Wasm modules in the cache.",
+))
+instances_loaded = REGISTRY.register(Gauge(
+    "wasmiot_instances_loaded",
+    "Number of Wasm module instances currently loaded.",
+))
+instance_footprint_bytes = REGISTRY.register(Gauge(
+    "wasmiot_instance_footprint_bytes",
+    "Total size of the linear memory and compiled code of the loaded Wasm module instances.",
+))
+instance_evictions = REGISTRY.register(Counter(
+    "wasmiot_instance_evictions",
+    "Number of idle Wasm module instances unloaded to free memory.",
+))
+tier_switches = REGISTRY.register(Counter(
+    "wasmiot_tier_switches",
+    "Number of times tiered Wasm modules were moved to the runtime of the given tier.",
+    ("tier",),
+))
+camera_frame_age_seconds = REGISTRY.register(Histogram(
+    "wasmiot_camera_frame_age_seconds",
+    "Age of the camera frames given to Wasm modules when they were requested.",
+))
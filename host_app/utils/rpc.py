@@ -0,0 +1,235 @@
+"""
+Outbound RPC calls made by modules through the `rpcCall` host functions.
+
+Calls are sent over a shared pool of HTTP connections by a small pool of
+worker threads. A module can either wait for the response (`rpcCall`) or
+start the call and get a handle to it (`rpcCallAsync`), so that it can keep
+working and poll or wait for the response later. A remote function can be
+served by several hosts, in which case the calls are spread over them in
+turns and a host that can not be connected to is skipped.
+"""
+
+from __future__ import annotations
+from concurrent.futures import Future, ThreadPoolExecutor, TimeoutError as FutureTimeoutError
+from dataclasses import dataclass
+import itertools
+import threading
+from time import perf_counter
+from typing import Any, Dict, List, Optional
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from host_app.utils import metrics
+from host_app.utils.configuration import CONFIG_DIR, get_remote_functions
+
+TIMEOUT = 120.0
+"""Default time (in seconds) to wait for a response to an RPC call"""
+
+WORKERS = 4
+"""Default number of threads sending asynchronous RPC calls"""
+
+MAX_PENDING = 64
+"""Default number of handles to asynchronous calls kept at the same time"""
+
+# Statuses of asynchronous calls given to modules
+PENDING = 0
+DONE = 1
+FAILED = 2
+UNKNOWN = -1
+
+
+@dataclass(frozen=True)
+class RpcResponse:
+    """Response of a remote function."""
+    host: str
+    status_code: int
+    content: bytes
+
+
+class RpcError(RuntimeError):
+    """Raised when a remote function can not be called."""
+
+
+class RpcDispatcher:
+    """
+    Sends RPC calls to the hosts of remote functions.
+
+    :param timeout: Time (in seconds) to wait for a response.
+    :param workers: Number of threads sending asynchronous calls, which is
+    also the number of connections kept open to each host.
+    :param max_pending: Maximum number of handles to asynchronous calls.
+    """
+    def __init__(self, timeout: float = TIMEOUT, workers: int = WORKERS, max_pending: int = MAX_PENDING) -> None:
+        self._timeout = timeout
+        self._workers = workers
+        self._max_pending = max_pending
+        self._session: Optional[requests.Session] = None
+        self._executor: Optional[ThreadPoolExecutor] = None
+        self._turns: Dict[str, int] = {}
+        """Index of the host to try first for each remote function"""
+        self._functions: Optional[Dict[str, Any]] = None
+        """Remote functions read from the configuration"""
+        self._functions_mtime: Optional[int] = None
+        """Modification time of the configuration file when it was read"""
+        self._handles: Dict[int, Future] = {}
+        self._next_handle = itertools.count(1)
+        self._lock = threading.Lock()
+        metrics.rpc_calls_pending.set_function(self.pending)
+
+    @property
+    def timeout(self) -> float:
+        """Get the default time (in seconds) to wait for a response."""
+        return self._timeout
+
+    def _get_session(self) -> requests.Session:
+        """Get the session whose connections are reused between calls."""
+        with self._lock:
+            if self._session is None:
+                session = requests.Session()
+                adapter = HTTPAdapter(pool_connections=self._workers, pool_maxsize=self._workers)
+                session.mount("http://", adapter)
+                session.mount("https://", adapter)
+                self._session = session
+            return self._session
+
+    def _get_executor(self) -> ThreadPoolExecutor:
+        """Get the threads sending asynchronous calls, starting them on first use."""
+        with self._lock:
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(self._workers, thread_name_prefix="rpc")
+            return self._executor
+
+    def _remote_functions(self) -> Dict[str, Any]:
+        """
+        Get the remote functions from the configuration, reading the file
+        again only if it has changed since it was last read.
+        """
+        try:
+            mtime: Optional[int] = (CONFIG_DIR / "remote_functions.json").stat().st_mtime_ns
+        except FileNotFoundError:
+            mtime = None
+        with self._lock:
+            if self._functions is not None and mtime == self._functions_mtime:
+                return self._functions
+        functions = get_remote_functions()
+        with self._lock:
+            self._functions, self._functions_mtime = functions, mtime
+        return functions
+
+    def hosts(self, function_name: str) -> List[str]:
+        """
+        Return the hosts of a remote function in the order they should be
+        tried for the next call. Raise RpcError if the function is unknown.
+        """
+        function = self._remote_functions().get(function_name)
+        if function is None:
+            raise RpcError(f"Unknown remote function {function_name!r}")
+        hosts = function.get("hosts") or function.get("host")
+        if isinstance(hosts, str):
+            hosts = [hosts]
+        if not hosts:
+            raise RpcError(f"No host given for remote function {function_name!r}")
+        with self._lock:
+            turn = self._turns.get(function_name, 0) % len(hosts)
+            self._turns[function_name] = turn + 1
+        return hosts[turn:] + hosts[:turn]
+
+    def call(self, function_name: str, data: bytes, timeout: Optional[float] = None) -> RpcResponse:
+        """
+        Send data to a remote function and wait for the response. Raise
+        RpcError if none of its hosts could be reached.
+        """
+        timeout = self._timeout if timeout is None else timeout
+        session = self._get_session()
+        error: Optional[Exception] = None
+        for host in self.hosts(function_name):
+            start = perf_counter()
+            try:
+                response = session.post(url=host, files=[("img", data)], timeout=timeout)
+            except requests.ConnectionError as connection_error:
+                # Try the next host, if any.
+                error = connection_error
+                continue
+            except requests.RequestException as request_error:
+                raise RpcError(f"Calling {host} failed: {request_error}") from request_error
+            finally:
+                metrics.outbound_request_seconds.observe(perf_counter() - start, kind="rpc")
+            return RpcResponse(host, response.status_code, response.content)
+        raise RpcError(f"No host of remote function {function_name!r} could be reached: {error}")
+
+    def submit(self, function_name: str, data: bytes, timeout: Optional[float] = None) -> int:
+        """
+        Start sending data to a remote function and return a handle to the
+        call. Raise RpcError if too many calls are already pending.
+        """
+        with self._lock:
+            if len(self._handles) >= self._max_pending:
+                # Forget the oldest finished call that was never collected.
+                finished = next((h for h, f in self._handles.items() if f.done()), None)
+                if finished is None:
+                    raise RpcError(f"Too many pending RPC calls ({self._max_pending})")
+                del self._handles[finished]
+        future = self._get_executor().submit(self.call, function_name, data, timeout)
+        with self._lock:
+            handle = next(self._next_handle)
+            self._handles[handle] = future
+        return handle
+
+    def wait(self, handle: int, timeout: Optional[float] = 0) -> Optional[Future]:
+        """
+        Wait for up to timeout seconds (None for no limit) for the call to
+        finish and return its future. Return None if the handle is unknown.
+        """
+        with self._lock:
+            future = self._handles.get(handle)
+        if future is not None and timeout != 0:
+            try:
+                future.exception(timeout)
+            except FutureTimeoutError:
+                pass
+        return future
+
+    def status(self, handle: int, timeout: Optional[float] = 0) -> int:
+        """
+        Return the status of a call (PENDING, DONE, FAILED or UNKNOWN for an
+        unknown handle) after waiting for up to timeout seconds for it.
+        """
+        future = self.wait(handle, timeout)
+        if future is None:
+            return UNKNOWN
+        if not future.done():
+            return PENDING
+        return FAILED if future.exception() is not None else DONE
+
+    def release(self, handle: int) -> None:
+        """Forget a call, e.g., after its response has been read."""
+        with self._lock:
+            self._handles.pop(handle, None)
+
+    def pending(self) -> int:
+        """Return the number of calls whose handles are kept."""
+        with self._lock:
+            return len(self._handles)
+
+    def configure(self, timeout: float, workers: int, max_pending: int) -> None:
+        """Change the default timeout, the number of workers and the maximum number of handles."""
+        with self._lock:
+            self._timeout = timeout
+            self._max_pending = max_pending
+            if workers != self._workers:
+                # New connections and threads are set up on the next call;
+                # calls in flight finish on the old ones.
+                self._workers = workers
+                self._session = None
+                if self._executor is not None:
+                    self._executor.shutdown(wait=False)
+                    self._executor = None
+
+
+_dispatcher = RpcDispatcher()
+
+
+def get_dispatcher() -> RpcDispatcher:
+    """Get the dispatcher used by the host functions."""
+    return _dispatcher
@@ -0,0 +1,225 @@
+"""
+Working directories of invocations and the output files they publish.
+
+An invocation that handles files gets a scratch directory of its own, so
+that concurrent invocations of the same module do not overwrite each other's
+inputs and outputs. The files received in the request are saved there
+directly. Instances of modules that run such invocations have directories
+here too (see `host_app.utils.isolation`), holding copies of the deployment
+files of the module.
+
+Once the invocation has finished, its output files are moved to a directory
+of their own under the results, where they stay until newer results push
+them out, and the scratch directory is removed. The scratch space can be put
+on a RAM-backed file system (e.g., /dev/shm), so that the files passed
+between requests are not written to storage at all. As such file systems are
+small and take memory from everything else, the results are bounded by their
+total size as well as by their number.
+"""
+
+from __future__ import annotations
+from collections import deque
+import os
+from pathlib import Path
+import hashlib
+import re
+import shutil
+import stat
+import tempfile
+import threading
+from typing import Deque, Dict, Optional, Tuple
+
+WORK_DIRECTORY = "work"
+RESULTS_DIRECTORY = "results"
+
+KEEP_RESULTS = 64
+"""Default number of invocations whose output files are kept"""
+
+RESULTS_SHARE = 0.25
+"""Default share of the scratch file system that the kept output files may take"""
+
+
+class ScratchSpace:
+    """
+    Directory of the scratch directories of ongoing invocations and of the
+    published output files. Without a directory, a directory under the
+    system's temporary directory is used.
+    """
+    def __init__(
+        self,
+        directory: Optional[Path] = None,
+        keep_results: int = KEEP_RESULTS,
+        max_result_bytes: Optional[int] = None
+    ) -> None:
+        self._directory = Path(directory) if directory is not None else \
+            Path(tempfile.gettempdir(), "wasmiot-scratch")
+        self._keep_results = keep_results
+        self._published: Deque[Path] = deque()
+        """Result directories, oldest first"""
+        self._result_bytes: Dict[Path, int] = {}
+        """Size of the output files in each result directory"""
+        self._latest: Dict[Tuple[str, str], Path] = {}
+        """Latest published output file of each module by its name"""
+        self._etags: Dict[Path, Tuple[float, int, str]] = {}
+        """Modification time, size and content hash of the files served"""
+        self._lock = threading.Lock()
+        # Files left by a previous run can not be referred to anymore.
+        for name in (WORK_DIRECTORY, RESULTS_DIRECTORY):
+            shutil.rmtree(self._directory / name, ignore_errors=True)
+            (self._directory / name).mkdir(parents=True, exist_ok=True)
+        self._max_result_bytes = max_result_bytes if max_result_bytes is not None else \
+            int(shutil.disk_usage(self._directory).total * RESULTS_SHARE)
+
+    @property
+    def directory(self) -> Path:
+        """Get the directory of the scratch space."""
+        return self._directory
+
+    @property
+    def max_result_bytes(self) -> int:
+        """Get the total size (in bytes) of the output files that are kept."""
+        return self._max_result_bytes
+
+    def free_bytes(self) -> int:
+        """Return the space (in bytes) left on the file system of the scratch space."""
+        return shutil.disk_usage(self._directory).free
+
+    def create(self, name: str) -> Path:
+        """Create a new scratch directory whose name starts with the given name."""
+        prefix = re.sub(r"[^A-Za-z0-9_.-]", "_", name)
+        return Path(tempfile.mkdtemp(prefix=f"{prefix}-", dir=self._directory / WORK_DIRECTORY))
+
+    @staticmethod
+    def resolve(directory: Path, name: str) -> Path:
+        """
+        Return the path of a file in a directory. Raise ValueError if the name
+        points outside of the directory.
+        """
+        path = (directory / name).resolve()
+        if not path.is_relative_to(directory.resolve()) or path == directory.resolve():
+            raise ValueError(f"Invalid file name {name!r}")
+        return path
+
+    def path_in(self, workdir: Path, name: str) -> Path:
+        """
+        Return the path of a file in a scratch directory, creating the
+        directories on the way. Raise ValueError if the name points outside
+        of the directory.
+        """
+        path = self.resolve(workdir, name)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        return path
+
+    def copy(self, source: Path, workdir: Path, name: str) -> Path:
+        """
+        Copy a file to a scratch directory under the given name. The copy is
+        made read-only, so that an invocation does not change it for the
+        following ones. The source file is not linked, as it would be changed
+        along with the copy.
+        """
+        target = self.path_in(workdir, name)
+        shutil.copy2(source, target)
+        mode = os.stat(target).st_mode
+        os.chmod(target, mode & ~(stat.S_IWUSR | stat.S_IWGRP | stat.S_IWOTH))
+        return target
+
+    def publish(self, workdir: Path, name: str, module_name: str, result_id: Optional[str] = None) -> Path:
+        """
+        Move an output file from a scratch directory to the results and return
+        its new path. The file is renamed in one step, so it can not be read
+        while incomplete. Raise FileNotFoundError if there is no such file.
+
+        :param result_id: Name of the directory of the results, by default the
+        name of the scratch directory.
+        """
+        source = self.resolve(workdir, name)
+        result_dir = self._directory / RESULTS_DIRECTORY / (result_id or workdir.name)
+        target = self.path_in(result_dir, name)
+        os.replace(source, target)
+        # The results do not change, so their hashes are computed only once.
+        self.etag(target)
+        size = target.stat().st_size
+        with self._lock:
+            if result_dir not in self._published:
+                self._published.append(result_dir)
+            self._result_bytes[result_dir] = self._result_bytes.get(result_dir, 0) + size
+            self._latest[(module_name, name)] = target
+            # The newest results are kept even if they alone exceed the size,
+            # as the invocation refers to them in its response.
+            evicted = []
+            while len(self._published) > 1 and (
+                len(self._published) > self._keep_results
+                or sum(self._result_bytes.values()) > self._max_result_bytes
+            ):
+                evicted.append(self._published.popleft())
+                del self._result_bytes[evicted[-1]]
+            for key in [key for key, path in self._latest.items() if set(path.parents) & set(evicted)]:
+                del self._latest[key]
+            for path in [path for path in self._etags if set(path.parents) & set(evicted)]:
+                del self._etags[path]
+        for directory in evicted:
+            shutil.rmtree(directory, ignore_errors=True)
+        return target
+
+    def etag(self, path: Path) -> str:
+        """
+        Return the SHA-256 hash of a file's contents for use as its entity tag.
+        The hash is computed again only if the file has changed.
+        """
+        stat_result = os.stat(path)
+        with self._lock:
+            known = self._etags.get(path)
+        if known is not None and known[:2] == (stat_result.st_mtime, stat_result.st_size):
+            return known[2]
+        sha256 = hashlib.sha256()
+        with open(path, "rb") as file:
+            while chunk := file.read(1024 * 1024):
+                sha256.update(chunk)
+        digest = sha256.hexdigest()
+        with self._lock:
+            self._etags[path] = (stat_result.st_mtime, stat_result.st_size, digest)
+        return digest
+
+    def result(self, result_id: str, name: str) -> Optional[Path]:
+        """Return the path of a published output file or None if it is not kept anymore."""
+        if Path(result_id).name != result_id or result_id in ("", ".", ".."):
+            return None
+        try:
+            path = self.resolve(self._directory / RESULTS_DIRECTORY / result_id, name)
+        except ValueError:
+            return None
+        return path if path.is_file() else None
+
+    def latest(self, module_name: str, name: str) -> Optional[Path]:
+        """Return the latest published output file of a module with the given name."""
+        with self._lock:
+            return self._latest.get((module_name, name))
+
+    def remove(self, workdir: Path) -> None:
+        """Remove a scratch directory along with the files left in it."""
+        shutil.rmtree(workdir, ignore_errors=True)
+
+
+_space: Optional[ScratchSpace] = None
+
+
+def get_scratch() -> ScratchSpace:
+    """Get the scratch space of the invocations."""
+    global _space  # pylint: disable=global-statement
+    if _space is None:
+        _space = ScratchSpace()
+    return _space
+
+
+def configure(
+    directory: Optional[Path],
+    keep_results: int = KEEP_RESULTS,
+    max_result_bytes: Optional[int] = None
+) -> ScratchSpace:
+    """
+    Set up the scratch space of the invocations and return it. Without a
+    size for the results, they may take a quarter of the file system.
+    """
+    global _space  # pylint: disable=global-statement
+    _space = ScratchSpace(directory, keep_results, max_result_bytes)
+    return _space
@@ -0,0 +1,226 @@
+"""
+Access to the DHT22 temperature and humidity sensor for the host functions.
+
+Reading a DHT sensor takes a while and often fails, and the sensor can only
+be read every couple of seconds. The sensor service therefore reads it on a
+background thread into a ring buffer, and the host functions answer from the
+latest sample that succeeded. A window of recent samples can be read at once.
+"""
+
+from __future__ import annotations
+from array import array
+import platform
+import threading
+from time import monotonic, sleep, time
+from typing import Any, Callable, List, Optional, Tuple
+
+SAMPLE_INTERVAL = 2.0
+"""Time (in seconds) between reads of the sensor; DHT22 can not be read more often"""
+
+SAMPLE_TTL = 10.0
+"""Maximum age (in seconds) of a sample given to modules"""
+
+BUFFER_CAPACITY = 512
+"""Number of samples kept in the ring buffer"""
+
+MAX_RETRY_DELAY = 300.0
+"""Maximum time (in seconds) between attempts to open a sensor that could not be opened"""
+
+Sample = Tuple[float, float, float]
+"""Epoch time (in seconds), temperature (in degrees Celsius) and relative humidity (in percent)"""
+
+
+class SampleBuffer:
+    """Fixed-size ring buffer of sensor samples stored in arrays of floats."""
+    def __init__(self, capacity: int = BUFFER_CAPACITY) -> None:
+        self._capacity = capacity
+        self._times = array("d", bytes(8 * capacity))
+        self._temperatures = array("d", bytes(8 * capacity))
+        self._humidities = array("d", bytes(8 * capacity))
+        self._next = 0
+        self._count = 0
+        self._lock = threading.Lock()
+
+    @property
+    def capacity(self) -> int:
+        """Get the maximum number of samples in the buffer."""
+        return self._capacity
+
+    def __len__(self) -> int:
+        with self._lock:
+            return self._count
+
+    def append(self, timestamp: float, temperature: float, humidity: float) -> None:
+        """Add a sample, overwriting the oldest one if the buffer is full."""
+        with self._lock:
+            self._times[self._next] = timestamp
+            self._temperatures[self._next] = temperature
+            self._humidities[self._next] = humidity
+            self._next = (self._next + 1) % self._capacity
+            self._count = min(self._count + 1, self._capacity)
+
+    def latest(self) -> Optional[Sample]:
+        """Return the newest sample or None if the buffer is empty."""
+        window = self.window(1)
+        return window[0] if window else None
+
+    def window(self, count: int) -> List[Sample]:
+        """Return up to count newest samples, oldest first."""
+        with self._lock:
+            count = max(0, min(count, self._count))
+            indices = [(self._next - count + i) % self._capacity for i in range(count)]
+            return [(self._times[i], self._temperatures[i], self._humidities[i]) for i in indices]
+
+
+class FakeSensor:
+    """
+    Stand-in for a DHT sensor on devices without one, e.g., for testing.
+    Returns the given readings, which can be changed at any time.
+    """
+    def __init__(self, temperature: float = 21.0, humidity: float = 40.0) -> None:
+        self.temperature: Optional[float] = temperature
+        self.humidity: Optional[float] = humidity
+
+    def exit(self) -> None:
+        """Release the sensor like `adafruit_dht.DHT22.exit`."""
+
+
+def dht22_sensor() -> Any:
+    """Return the DHT22 sensor connected to pin D4."""
+    import adafruit_dht  # pylint: disable=import-outside-toplevel
+    import board  # pylint: disable=import-outside-toplevel
+    return adafruit_dht.DHT22(board.D4)
+
+
+class SensorService:
+    """
+    Samples a DHT sensor on a background thread, which is started on the
+    first request for a reading.
+
+    :param sensor_factory: Function returning the sensor, called on the
+    sampling thread. None if there is no sensor.
+    :param interval: Time (in seconds) between samples.
+    :param ttl: Maximum age (in seconds) of a sample given to callers.
+    """
+    def __init__(
+        self,
+        sensor_factory: Optional[Callable[[], Any]] = None,
+        interval: float = SAMPLE_INTERVAL,
+        ttl: float = SAMPLE_TTL,
+        capacity: int = BUFFER_CAPACITY
+    ) -> None:
+        self._sensor_factory = sensor_factory
+        self._interval = interval
+        self._ttl = ttl
+        self._buffer = SampleBuffer(capacity)
+        self._latest_time = 0.0
+        """Monotonic time of the latest sample"""
+        self._unavailable = False
+        """True while the sensor can not be opened"""
+        self._thread: Optional[threading.Thread] = None
+        self._condition = threading.Condition()
+
+    @property
+    def buffer(self) -> SampleBuffer:
+        """Get the buffer of samples."""
+        return self._buffer
+
+    def _open(self) -> Any:
+        """
+        Open the sensor, trying again with increasing delays until it
+        succeeds. Readings are not waited for while the sensor is unavailable.
+        """
+        delay = self._interval
+        while True:
+            try:
+                sensor = self._sensor_factory()
+            except Exception as error:  # pylint: disable=broad-except
+                print(f"Could not open the sensor, trying again in {delay:.0f} s: {error}")
+                with self._condition:
+                    self._unavailable = True
+                    self._condition.notify_all()
+                sleep(delay)
+                delay = min(delay * 2, MAX_RETRY_DELAY)
+                continue
+            with self._condition:
+                self._unavailable = False
+            return sensor
+
+    def _sample(self) -> None:
+        """Read the sensor into the buffer at regular intervals."""
+        sensor = self._open()
+        while True:
+            started = monotonic()
+            try:
+                temperature, humidity = sensor.temperature, sensor.humidity
+                if temperature is not None and humidity is not None:
+                    self._buffer.append(time(), float(temperature), float(humidity))
+                    with self._condition:
+                        self._latest_time = monotonic()
+                        self._condition.notify_all()
+            except RuntimeError as error:
+                # Reading DHT sensors fails every now and then, so just try
+                # again on the next round.
+                print(f"Reading the sensor failed: {error}")
+            sleep(max(0.0, self._interval - (monotonic() - started)))
+
+    def _ensure_started(self) -> None:
+        """Start sampling if it has not been started yet."""
+        if self._sensor_factory is None:
+            return
+        with self._condition:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._sample, name="sensor", daemon=True)
+                self._thread.start()
+
+    def latest(self, timeout: Optional[float] = None) -> Optional[Sample]:
+        """
+        Return the latest sample if it is within the TTL, waiting for the
+        first sample for up to timeout seconds (by default the sampling
+        interval) unless the sensor could not be opened. Return None if there
+        is no recent sample.
+        """
+        self._ensure_started()
+        timeout = self._interval if timeout is None else timeout
+        with self._condition:
+            if self._sensor_factory is not None and not self._latest_time and not self._unavailable:
+                self._condition.wait_for(lambda: self._latest_time or self._unavailable, timeout)
+            if not self._latest_time or monotonic() - self._latest_time > self._ttl:
+                return None
+        return self._buffer.latest()
+
+    def temperature(self) -> float:
+        """Return the latest temperature or 0.0 if there is no recent sample."""
+        sample = self.latest()
+        return sample[1] if sample is not None else 0.0
+
+    def humidity(self) -> float:
+        """Return the latest humidity or 0.0 if there is no recent sample."""
+        sample = self.latest()
+        return sample[2] if sample is not None else 0.0
+
+    def window(self, count: int) -> List[Sample]:
+        """Return up to count latest samples, oldest first."""
+        self._ensure_started()
+        return self._buffer.window(count)
+
+
+_service = SensorService(None if platform.system() == "Windows" else dht22_sensor)
+
+
+def get_sensors() -> SensorService:
+    """Get the sensor service used by the host functions."""
+    return _service
+
+
+def configure(kind: str, interval: float = SAMPLE_INTERVAL, ttl: float = SAMPLE_TTL) -> SensorService:
+    """
+    Set up the sensor service for the given kind of sensor: 'dht22', 'fake'
+    or 'none'. Return the service.
+    """
+    global _service  # pylint: disable=global-statement
+    factories = {"dht22": dht22_sensor, "fake": FakeSensor, "none": None}
+    if kind not in factories:
+        raise ValueError(f"Unknown sensor {kind!r}, expected one of {', '.join(factories)}")
+    _service = SensorService(factories[kind], interval, ttl)
+    return _service
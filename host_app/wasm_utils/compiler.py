@@ -0,0 +1,69 @@
+"""
+Ahead-of-time compilation of Wasm modules for Wasmtime.
+
+This module only depends on Wasmtime so that compiling can be done in
+separate worker processes (e.g., with `concurrent.futures.ProcessPoolExecutor`)
+without them importing the rest of the supervisor. Wasmtime itself is imported
+only when an engine is configured, so that the compiled module cache can be
+used without loading Wasmtime when modules run with Wasm3.
+"""
+
+from __future__ import annotations
+import hashlib
+from importlib import metadata
+import json
+import platform
+from typing import TYPE_CHECKING, Any, Dict
+
+from host_app.utils.files import write_atomically
+
+if TYPE_CHECKING:
+    from wasmtime import Config
+
+
+ENGINE_SETTINGS: Dict[str, Any] = {}
+"""
+Attributes set on the `wasmtime.Config` of every engine, e.g.,
+`{"cranelift_opt_level": "speed"}`. Empty means Wasmtime's defaults.
+"""
+
+
+def engine_config() -> Config:
+    """
+    Return the configuration for Wasmtime engines. Modules compiled by one
+    engine can only be deserialized by an engine with the same configuration.
+    """
+    from wasmtime import Config  # pylint: disable=import-outside-toplevel,redefined-outer-name
+
+    config = Config()
+    for name, value in ENGINE_SETTINGS.items():
+        setattr(config, name, value)
+    return config
+
+
+def engine_fingerprint() -> str:
+    """
+    Return a digest of everything besides the module itself that a compiled
+    module depends on: the Wasmtime version, the engine settings and the
+    machine architecture.
+    """
+    description = json.dumps({
+        "wasmtime": metadata.version("wasmtime"),
+        "settings": ENGINE_SETTINGS,
+        "machine": platform.machine(),
+    }, sort_keys=True, default=str)
+    return hashlib.sha256(description.encode("utf-8")).hexdigest()
+
+
+def compile_to_file(module_path: str, serialized_path: str) -> int:
+    """
+    Compile the Wasm module at module_path and write the serialized result to
+    serialized_path. Return the size of the serialized module in bytes.
+
+    The serialized module is written atomically, so that a reader never sees
+    a partially written file.
+    """
+    from wasmtime import Engine, Module  # pylint: disable=import-outside-toplevel
+
+    module = Module.from_file(Engine(engine_config()), module_path)
+    return write_atomically(serialized_path, module.serialize())
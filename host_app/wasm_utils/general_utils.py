@@ -1,24 +1,22 @@
 """General utilities for Wasm."""
 
 import os
-import platform
 import struct
 from time import sleep, time
-from typing import Any, Callable
+from typing import Any, Callable, Optional, Tuple
 
-import cv2
-import requests
-
-from host_app.utils.configuration import remote_functions
+from host_app.utils import camera, rpc, sensors
+from host_app.wasm_utils import invocation, streams
 from host_app.wasm_utils.wasm_api import WasmRuntime
 
 import logging
 
 logger = logging.getLogger(__name__)
 
-if platform.system() != "Windows":
-    import adafruit_dht
-    import board
+# The camera and sensor libraries (cv2, adafruit_dht and board) are slow to
+# import and take a lot of memory, so they are imported only when a module
+# first calls a function that needs them (see host_app.utils.camera and
+# host_app.utils.sensors).
 
 
 class RemoteFunction:
@@ -58,56 +56,22 @@ def python_print_int(number: int) -> None:
 
 
 def python_get_temperature() -> float:
-    """Get the temperature from the DHT22 sensor."""
-    if platform.system() == "Windows":
-        return 0.0
-
-    try:
-        dht_device = adafruit_dht.DHT22(board.D4)
-        temperature = dht_device.temperature
-        if temperature is None:
-            return 0.0
-        return float(temperature)
-    except RuntimeError as error:
-        print(error.args[0])
-        return 0.0
+    """Get the latest temperature from the DHT22 sensor."""
+    return sensors.get_sensors().temperature()
 
 
 def python_get_humidity() -> float:
-    """Get the humidity from the DHT22 sensor."""
-    if platform.system() == "Windows":
-        return 0.0
-
-    try:
-        dht_device = adafruit_dht.DHT22(board.D4)  # ignore=reportUnboundVariable
-        humidity = dht_device.humidity
-        if humidity is None:
-            return 0.0
-        return float(humidity)
-    except RuntimeError as error:
-        print(error.args[0])
-        return 0.0
+    """Get the latest humidity from the DHT22 sensor."""
+    return sensors.get_sensors().humidity()
 
 
 def capture_image():
-    """Capture an image from the first available camera."""
-    print("Capturing image")
-
-    for device in range(10):
-        try:
-            logger.debug("Trying to open camera %d", device)
-            cam = cv2.VideoCapture(device)  # type: ignore
-            _, img = cam.read()
-            cam.release()
-            if img is None:
-                logger.debug("Camera %d returned None", device)
-                continue
-            return img
-        except cv2.error as error:
-            logger.warning("Error opening camera %d: %s", device, error)
-            continue
-    else:
-        raise RuntimeError("No camera device found!")
+    """
+    Return the latest frame from the camera. The camera is kept open by the
+    camera service, so this does not wait for the camera unless it has been
+    idle.
+    """
+    return camera.get_camera().latest_frame()
 
 
 class Print(RemoteFunction):
@@ -117,7 +81,7 @@ class Print(RemoteFunction):
         """Print the string decoded from the specified memory location at the given runtime."""
         def python_print(pointer: int, length: int) -> None:
             """Print the string decoded from the specified memory location at the given runtime."""
-            data, error = self.runtime.read_from_memory(pointer, length, self.runtime.current_module_name)
+            data, error = invocation.current().read_memory(pointer, length)
             message = data.decode() if error is None else error
             print(message, end="")
 
@@ -128,7 +92,7 @@ class TakeImageDynamicSize(RemoteFunction):
 
     def alloc(self, nbytes: int):
         """Allocate nbytes of memory in the runtime."""
-        return self.runtime.run_function("alloc", [nbytes], self.runtime.current_module_name)
+        return invocation.current().call("alloc", [nbytes])
 
     @property
     def function(self) -> Callable[[int, int], None]:
@@ -140,6 +104,9 @@ class TakeImageDynamicSize(RemoteFunction):
             out_size_ptr both in 32bits LSB.
             """
 
+            import cv2  # pylint: disable=import-outside-toplevel
+
+            context = invocation.current()
             img = capture_image()
 
             _, datatmp = cv2.imencode(".jpg", img)
@@ -151,14 +118,14 @@ class TakeImageDynamicSize(RemoteFunction):
                 raise MemoryError(f"Unable to allocate {data_len} bytes of memory!")
 
             # Write the image to memory.
-            self.runtime.write_to_memory(data_ptr, data, self.runtime.current_module_name)
+            context.write_memory(data_ptr, data)
 
             # Write pointers to image pointer and length to memory assuming they both
             # have 32 bits allocated.
             pointer_bytes = struct.pack("<I", data_ptr)
             length_bytes = struct.pack("<I", data_len)
-            self.runtime.write_to_memory(out_ptr_ptr, pointer_bytes, self.runtime.current_module_name)
-            self.runtime.write_to_memory(out_size_ptr, length_bytes, self.runtime.current_module_name)
+            context.write_memory(out_ptr_ptr, pointer_bytes)
+            context.write_memory(out_size_ptr, length_bytes)
 
         return python_take_image_dynamic_size
 
@@ -173,77 +140,283 @@ class TakeImageStaticSize(RemoteFunction):
     def function(self) -> Callable[[int, int], None]:
         def python_take_image_static_size(out_ptr: int, size_ptr: int):
             """
-            Take an image, scale it to given byte length and write it to memory
-            at the given runtime using the given module.
+            Take an image, encode it to fit the given byte length and write
+            it to memory at the given runtime using the given module.
 
             Read the size of the image from size_ptr (32bit LSB) and store the
-            image in out_ptr.
+            image in out_ptr. The resolution and quality of the image are
+            lowered as needed to fit the size, and the rest of the space after
+            the image is filled with zeros.
             """
-
-            img = capture_image()
-
-            try:
-                _, datatmp = cv2.imencode(".jpg", img)
-                data = datatmp.tobytes()
-            except cv2.error as error:
-                temp_path = './fakeWebcam.jpg'
-                print(f"Error reading image (assuming non-Linux system; using file from '{temp_path}' ): ", error)
-                with open(temp_path, "rb") as f:
-                    data = f.read()
-
-            # Write the image to disk for debugging.
-            try:
-                with open("camera.jpg", "wb") as f:
-                    f.write(data)
-            except IOError as error:
-                print("Error writing image to disk: ", error)
-
+            context = invocation.current()
             # Read the required size from memory.
-            out_len_bytes, fail = self.runtime.read_from_memory(size_ptr, 4, self.runtime.current_module_name)
+            out_len_bytes, fail = context.read_memory(size_ptr, 4)
             if fail:
                 print("Error reading image length: ", fail)
                 raise MemoryError(f"Unable to read 4 bytes at location {size_ptr} from memory!")
             out_len = struct.unpack("<I", out_len_bytes)[0]
 
-            # Fit the image data to expected size.
-            data = data[:out_len]
+            img = capture_image()
+            data = camera.get_encoder().encode(img, out_len)
+
+            # Write the image to disk for debugging.
+            if (debug_image_path := camera.get_camera().debug_image_path):
+                try:
+                    with open(debug_image_path, "wb") as f:
+                        f.write(data)
+                except IOError as error:
+                    print("Error writing image to disk: ", error)
 
             # Write the image to memory.
-            self.runtime.write_to_memory(out_ptr, data, self.runtime.current_module_name)
+            context.write_memory(
+                out_ptr, data + bytes(out_len - len(data)))
 
         return python_take_image_static_size
 
+class ReadSensorSamples(RemoteFunction):
+    """Remote function generator for reading a window of sensor samples."""
+    SAMPLE_FORMAT = "<qff"
+    """Epoch time in milliseconds (i64), temperature (f32) and humidity (f32) of a sample"""
+
+    @property
+    def function(self) -> Callable[[int, int], int]:
+        def python_read_sensor_samples(out_ptr: int, max_samples: int) -> int:
+            """
+            Write up to max_samples latest samples, oldest first, to memory at
+            out_ptr, each taking 16 bytes. Return the number of samples written.
+            """
+            samples = sensors.get_sensors().window(max_samples)
+            data = b"".join(
+                struct.pack(self.SAMPLE_FORMAT, int(timestamp * 1000), temperature, humidity)
+                for timestamp, temperature, humidity in samples
+            )
+            if data:
+                error = invocation.current().write_memory(out_ptr, data)
+                if error is not None:
+                    raise MemoryError(error)
+            return len(samples)
+
+        return python_read_sensor_samples
+
+
+def read_rpc_call(
+    context: invocation.InvocationContext,
+    func_name_ptr: int, func_name_size: int,
+    data_ptr: int, data_size: int
+) -> Optional[Tuple[str, bytes]]:
+    """
+    Read the name of the remote function and the data to send to it from
+    memory. Return None if reading fails.
+    """
+    func_name_bytes, error = context.read_memory(func_name_ptr, func_name_size)
+    if error is not None:
+        print(error)
+        return None
+    data, error = context.read_memory(data_ptr, data_size)
+    if error is not None:
+        print(error)
+        return None
+    return bytes(func_name_bytes).decode(), bytes(data)
+
+
 class RpcCall(RemoteFunction):
     """Remote function generator for RPC calls."""
     @property
     def function(self) -> Callable[[int, int, int, int], None]:
-        """Make a POST request with data.
+        """Make a POST request with data and wait for the response.
         Both the data and the target host is determined from the runtime memory."""
         def python_rpc_call(func_name_ptr: int, func_name_size: int,
                             data_ptr: int, data_size: int) -> None:
-            func_name_bytes, error = self.runtime.read_from_memory(func_name_ptr, func_name_size, self.runtime.current_module_name)
-            if error is not None:
-                print(error)
+            context = invocation.current()
+            call = read_rpc_call(context, func_name_ptr, func_name_size, data_ptr, data_size)
+            if call is None:
                 return
-            func_name = func_name_bytes.decode()
+            func_name, data = call
             print(func_name)
-            func = remote_functions[func_name]
-            data, error = self.runtime.read_from_memory(data_ptr, data_size, self.runtime.current_module_name)
-            if error is not None:
+
+            # Do not wait for the response past the deadline of the invocation.
+            dispatcher = rpc.get_dispatcher()
+            remaining = context.remaining()
+            try:
+                response = dispatcher.call(
+                    func_name, data,
+                    timeout=dispatcher.timeout if remaining is None else min(dispatcher.timeout, remaining)
+                )
+            except rpc.RpcError as error:
                 print(error)
                 return
-            files = [("img", data)]
-
-            response = requests.post(
-                url=func["host"],
-                files=files,
-                timeout=120
-            )
-            print(response.text)
+            print(response.content.decode(errors="replace"))
 
         return python_rpc_call
 
 
+class RpcCallAsync(RemoteFunction):
+    """Remote function generator for RPC calls that do not wait for the response."""
+    @property
+    def function(self) -> Callable[[int, int, int, int], int]:
+        """Start a POST request with data and return a handle to it or -1 on failure.
+        Both the data and the target host is determined from the runtime memory."""
+        def python_rpc_call_async(func_name_ptr: int, func_name_size: int,
+                                  data_ptr: int, data_size: int) -> int:
+            call = read_rpc_call(invocation.current(), func_name_ptr, func_name_size, data_ptr, data_size)
+            if call is None:
+                return -1
+            try:
+                return rpc.get_dispatcher().submit(*call)
+            except rpc.RpcError as error:
+                print(error)
+                return -1
+
+        return python_rpc_call_async
+
+
+def python_rpc_poll(handle: int) -> int:
+    """
+    Return the status of an asynchronous RPC call: 0 if it is pending, 1 if
+    it is done, 2 if it failed and -1 if the handle is unknown.
+    """
+    return rpc.get_dispatcher().status(handle)
+
+
+def python_rpc_wait(handle: int, timeout_ms: int) -> int:
+    """
+    Wait for up to timeout_ms milliseconds (no limit if negative) for an
+    asynchronous RPC call to finish and return its status like rpcPoll.
+    """
+    timeout = None if timeout_ms < 0 else timeout_ms / 1000.0
+    # Do not wait past the deadline of the invocation.
+    remaining = invocation.current().remaining()
+    if remaining is not None:
+        timeout = remaining if timeout is None else min(timeout, remaining)
+    return rpc.get_dispatcher().status(handle, timeout)
+
+
+class RpcResult(RemoteFunction):
+    """Remote function generator for reading the response of an asynchronous RPC call."""
+    @property
+    def function(self) -> Callable[[int, int, int], int]:
+        """Copy the response of a finished call to memory."""
+        def python_rpc_result(handle: int, out_ptr: int, out_size: int) -> int:
+            """
+            Write the response of a finished call at out_ptr, up to out_size
+            bytes, and return the full size of the response. The call is
+            forgotten once its whole response has been read, so a caller can
+            first ask for the size with out_size 0. Return -1 if the call is
+            unknown, pending or failed.
+            """
+            dispatcher = rpc.get_dispatcher()
+            future = dispatcher.wait(handle)
+            if future is None or not future.done():
+                return -1
+            if future.exception() is not None:
+                print(future.exception())
+                dispatcher.release(handle)
+                return -1
+            content = future.result().content
+            if out_size > 0:
+                error = invocation.current().write_memory(out_ptr, content[:out_size])
+                if error is not None:
+                    print(error)
+                    return -1
+            if out_size >= len(content):
+                dispatcher.release(handle)
+            return len(content)
+
+        return python_rpc_result
+
+
+class StreamOpen(RemoteFunction):
+    """Remote function generator for opening a file of the module as a stream."""
+    @property
+    def function(self) -> Callable[[int, int, int], int]:
+        def python_stream_open(path_ptr: int, path_size: int, mode: int) -> int:
+            """
+            Open the file whose path (relative to the module's mount
+            directory) is in memory for reading (mode 0), writing (1) or
+            appending (2). Return a handle to the stream or -1 on failure.
+            """
+            context = invocation.current()
+            path_bytes, error = context.read_memory(path_ptr, path_size)
+            if error is not None:
+                print(error)
+                return -1
+            try:
+                return context.streams.open(context.directories, bytes(path_bytes).decode(), mode)
+            except (streams.StreamError, UnicodeDecodeError) as stream_error:
+                print(stream_error)
+                return -1
+
+        return python_stream_open
+
+
+class StreamRead(RemoteFunction):
+    """Remote function generator for reading a chunk of a stream."""
+    @property
+    def function(self) -> Callable[[int, int, int], int]:
+        def python_stream_read(handle: int, out_ptr: int, out_size: int) -> int:
+            """
+            Read up to out_size bytes from a stream to memory at out_ptr.
+            Return the number of bytes read, 0 at the end of the stream or -1
+            on failure.
+            """
+            context = invocation.current()
+            try:
+                data = context.streams.get(handle).read(out_size)
+            except (streams.StreamError, OSError) as stream_error:
+                print(stream_error)
+                return -1
+            if data:
+                error = context.write_memory(out_ptr, data)
+                if error is not None:
+                    print(error)
+                    return -1
+            return len(data)
+
+        return python_stream_read
+
+
+class StreamWrite(RemoteFunction):
+    """Remote function generator for writing a chunk to a stream."""
+    @property
+    def function(self) -> Callable[[int, int, int], int]:
+        def python_stream_write(handle: int, data_ptr: int, data_size: int) -> int:
+            """
+            Write data_size bytes from memory at data_ptr to a stream. Return
+            the number of bytes written or -1 on failure.
+            """
+            context = invocation.current()
+            data, error = context.read_memory(data_ptr, data_size)
+            if error is not None:
+                print(error)
+                return -1
+            try:
+                return context.streams.get(handle).write(data)
+            except (streams.StreamError, OSError) as stream_error:
+                print(stream_error)
+                return -1
+
+        return python_stream_write
+
+
+def python_stream_size(handle: int) -> int:
+    """Return the size of the file of a stream in bytes or -1 on failure."""
+    try:
+        return os.fstat(invocation.current().streams.get(handle).fileno()).st_size
+    except (streams.StreamError, OSError) as error:
+        print(error)
+        return -1
+
+
+def python_stream_close(handle: int) -> int:
+    """Close a stream. Return 0 on success or -1 if the handle is unknown."""
+    try:
+        invocation.current().streams.close(handle)
+    except (streams.StreamError, OSError) as error:
+        print(error)
+        return -1
+    return 0
+
+
 class RandomGet(RemoteFunction):
     """Remote function generator for writing random bytes to runtime memory."""
     @property
@@ -256,7 +429,7 @@ class RandomGet(RemoteFunction):
 
         def random_get(buf_ptr: int, size: int) -> int:
             """Generate random bytes and write them to the specified memory location."""
-            self.runtime.write_to_memory(buf_ptr, os.urandom(size), self.runtime.current_module_name)
+            invocation.current().write_memory(buf_ptr, os.urandom(size))
             return WasiErrno.SUCCESS
 
         return random_get
\ No newline at end of file
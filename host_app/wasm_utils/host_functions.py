@@ -0,0 +1,148 @@
+"""
+Registry of the host functions that Wasm modules can import.
+
+Each host function is declared once with its import namespace and name, its
+signature and a factory that creates the callable for a runtime. The runtimes
+link only the host functions that a module actually imports, when the module
+is loaded.
+"""
+
+from __future__ import annotations
+from dataclasses import dataclass
+from typing import Any, Callable, Dict, FrozenSet, Iterable, List, Optional, Tuple
+
+from host_app.wasm_utils.general_utils import (
+    python_clock_ms, python_delay, python_print_int, python_println, python_get_temperature,
+    python_get_humidity, python_rpc_poll, python_rpc_wait, python_stream_close, python_stream_size,
+    Print, TakeImageDynamicSize, TakeImageStaticSize, ReadSensorSamples, RpcCall, RpcCallAsync,
+    RpcResult, RandomGet, StreamOpen, StreamRead, StreamWrite
+)
+from host_app.wasm_utils.wasm_api import WasmRuntime
+
+ValueKind = str
+"""
+Type of a parameter or a result: 'i32', 'i64', 'f32', 'f64' or 'ptr' for an
+i32 address in the module's memory.
+"""
+
+WASM3_SIGNATURE_CHARS = {"i32": "i", "i64": "I", "f32": "f", "f64": "F", "ptr": "*"}
+
+ALL_RUNTIMES: FrozenSet[str] = frozenset({"wasmtime", "wasm3"})
+
+HostFunctionFactory = Callable[[WasmRuntime], Callable[..., Any]]
+
+
+@dataclass(frozen=True)
+class HostFunction:
+    """A function of the host that Wasm modules can import."""
+    namespace: str
+    name: str
+    params: Tuple[ValueKind, ...]
+    results: Tuple[ValueKind, ...]
+    factory: HostFunctionFactory
+    """Create the function for the given runtime"""
+    runtimes: FrozenSet[str] = ALL_RUNTIMES
+    """Names of the runtimes that need the function from the host"""
+
+    @property
+    def wasm3_signature(self) -> str:
+        """Get the signature in the format of Wasm3, e.g., 'i(*i)'."""
+        result = WASM3_SIGNATURE_CHARS[self.results[0]] if self.results else "v"
+        params = "".join(WASM3_SIGNATURE_CHARS[param] for param in self.params)
+        return f"{result}({params})"
+
+
+def plain(function: Callable[..., Any]) -> HostFunctionFactory:
+    """Return a factory for a host function that does not use the runtime."""
+    return lambda _runtime: function
+
+
+HOST_FUNCTIONS: Dict[Tuple[str, str], HostFunction] = {
+    (function.namespace, function.name): function for function in [
+        # system functions
+        HostFunction("sys", "millis", (), ("i32",), plain(python_clock_ms)),
+        HostFunction("sys", "delay", ("i32",), (), plain(python_delay)),
+        HostFunction("sys", "print", ("ptr", "i32"), (), lambda runtime: Print(runtime).function),
+        HostFunction("sys", "println", ("ptr",), (), plain(python_println)),
+        HostFunction("sys", "printInt", ("i32",), (), plain(python_print_int)),
+        # communication
+        HostFunction(
+            "communication", "rpcCall", ("ptr", "i32", "ptr", "i32"), (),
+            lambda runtime: RpcCall(runtime).function
+        ),
+        HostFunction(
+            "communication", "rpcCallAsync", ("ptr", "i32", "ptr", "i32"), ("i32",),
+            lambda runtime: RpcCallAsync(runtime).function
+        ),
+        HostFunction("communication", "rpcPoll", ("i32",), ("i32",), plain(python_rpc_poll)),
+        HostFunction("communication", "rpcWait", ("i32", "i32"), ("i32",), plain(python_rpc_wait)),
+        HostFunction(
+            "communication", "rpcResult", ("i32", "ptr", "i32"), ("i32",),
+            lambda runtime: RpcResult(runtime).function
+        ),
+        # streaming files in chunks
+        HostFunction(
+            "stream", "streamOpen", ("ptr", "i32", "i32"), ("i32",),
+            lambda runtime: StreamOpen(runtime).function
+        ),
+        HostFunction(
+            "stream", "streamRead", ("i32", "ptr", "i32"), ("i32",),
+            lambda runtime: StreamRead(runtime).function
+        ),
+        HostFunction(
+            "stream", "streamWrite", ("i32", "ptr", "i32"), ("i32",),
+            lambda runtime: StreamWrite(runtime).function
+        ),
+        HostFunction("stream", "streamSize", ("i32",), ("i64",), plain(python_stream_size)),
+        HostFunction("stream", "streamClose", ("i32",), ("i32",), plain(python_stream_close)),
+        # peripherals
+        HostFunction(
+            "camera", "takeImage", ("ptr", "ptr"), (),
+            lambda runtime: TakeImageDynamicSize(runtime).function
+        ),
+        HostFunction(
+            "camera", "takeImageDynamicSize", ("ptr", "ptr"), (),
+            lambda runtime: TakeImageDynamicSize(runtime).function
+        ),
+        HostFunction(
+            "camera", "takeImageStaticSize", ("ptr", "ptr"), (),
+            lambda runtime: TakeImageStaticSize(runtime).function
+        ),
+        HostFunction("dht", "getTemperature", (), ("f32",), plain(python_get_temperature)),
+        HostFunction("dht", "getHumidity", (), ("f32",), plain(python_get_humidity)),
+        HostFunction(
+            "dht", "readSamples", ("ptr", "i32"), ("i32",),
+            lambda runtime: ReadSensorSamples(runtime).function
+        ),
+        # WASI functions missing from runtimes without WASI support
+        HostFunction(
+            "wasi_snapshot_preview1", "random_get", ("ptr", "i32"), ("i32",),
+            lambda runtime: RandomGet(runtime).function,
+            runtimes=frozenset({"wasm3"}),
+        ),
+    ]
+}
+"""Host functions by their import namespace and name"""
+
+
+def find(namespace: str, name: str, runtime: str) -> Optional[HostFunction]:
+    """Return the host function that satisfies an import on the given runtime."""
+    function = HOST_FUNCTIONS.get((namespace, name))
+    if function is None or runtime not in function.runtimes:
+        return None
+    return function
+
+
+def resolve(imports: Iterable[Tuple[str, str]], runtime: str) -> Tuple[List[HostFunction], List[Tuple[str, str]]]:
+    """
+    Split function imports given as (namespace, name) into the host functions
+    satisfying them and the imports that the registry does not have.
+    """
+    found, missing = [], []
+    for namespace, name in imports:
+        function = find(namespace, name, runtime)
+        if function is None:
+            missing.append((namespace, name))
+        else:
+            found.append(function)
+    return found, missing
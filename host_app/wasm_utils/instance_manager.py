@@ -0,0 +1,198 @@
+"""
+Bookkeeping of instantiated Wasm modules for bounding their memory use.
+
+The manager tracks when each loaded module was last used and how much memory
+its instance (linear memory) and compiled code take. The size of the linear
+memory is recorded when the module is loaded and at the end of each call, on
+the thread that used the instance, as Wasmtime stores must not be accessed
+from other threads while a call is running. Reports read the recorded sizes. When the memory use of
+the device crosses a watermark or the instances exceed a configured budget,
+the least recently used idle instances are unloaded from their runtimes. An
+unloaded module is loaded again transparently on its next use with
+`WasmRuntime.get_or_load_module`, which is cheap as the compiled module is
+found in the module cache.
+"""
+
+from __future__ import annotations
+from collections import OrderedDict
+from contextlib import contextmanager
+from dataclasses import dataclass
+import threading
+from time import monotonic
+from typing import TYPE_CHECKING, Generator, List, Optional
+
+import psutil
+
+from host_app.utils import metrics
+
+if TYPE_CHECKING:
+    from host_app.wasm_utils.wasm_api import WasmModule, WasmRuntime
+
+
+@dataclass
+class InstanceEntry:
+    """A loaded module and its usage."""
+    runtime: WasmRuntime
+    module: WasmModule
+    last_used: float
+    active: int = 0
+    """Number of ongoing calls to the module's functions"""
+    memory_size: Optional[int] = None
+    """Size of the linear memory in bytes when last recorded"""
+    code_size: int = 0
+    """Size of the compiled code in bytes"""
+
+    def footprint(self) -> int:
+        """Return the memory taken by the instance and its code in bytes."""
+        return (self.memory_size or 0) + self.code_size
+
+
+class InstanceManager:
+    """Tracks loaded modules and unloads idle ones under memory pressure."""
+    def __init__(
+        self,
+        memory_budget: Optional[int] = None,
+        high_watermark: Optional[float] = None,
+        min_idle: float = 5.0
+    ) -> None:
+        """
+        :param memory_budget: Maximum total footprint (in bytes) of the
+        instances, None for no limit.
+        :param high_watermark: Fraction of the device's memory in use above
+        which idle instances are unloaded, None for not monitoring it.
+        :param min_idle: Time (in seconds) that an instance must have been
+        unused before it can be unloaded.
+        """
+        self._entries: OrderedDict[int, InstanceEntry] = OrderedDict()
+        self._lock = threading.Lock()
+        self.set_limits(memory_budget, high_watermark, min_idle)
+
+    def set_limits(
+        self,
+        memory_budget: Optional[int] = None,
+        high_watermark: Optional[float] = None,
+        min_idle: float = 5.0
+    ) -> None:
+        """Change the limits of the manager."""
+        self._memory_budget = memory_budget
+        self._high_watermark = high_watermark
+        self._min_idle = min_idle
+
+    def track(self, runtime: WasmRuntime, module: WasmModule) -> None:
+        """Start tracking a newly loaded module and make room for it if needed."""
+        # The new module is marked active while making room so that it is not
+        # unloaded itself.
+        entry = InstanceEntry(
+            runtime, module, monotonic(), active=1, memory_size=module.memory_size, code_size=module.code_size
+        )
+        with self._lock:
+            self._entries[id(module)] = entry
+        try:
+            self.enforce()
+        finally:
+            with self._lock:
+                entry.active -= 1
+
+    def touch(self, module: WasmModule) -> None:
+        """Mark the module as recently used."""
+        with self._lock:
+            entry = self._entries.get(id(module))
+            if entry is not None:
+                entry.last_used = monotonic()
+                self._entries.move_to_end(id(module))
+
+    def memory_size(self, module: WasmModule) -> Optional[int]:
+        """
+        Return the size of the module's linear memory in bytes when last
+        recorded or None if the module is not tracked.
+        """
+        with self._lock:
+            entry = self._entries.get(id(module))
+            return entry.memory_size if entry is not None else None
+
+    def forget(self, module: WasmModule) -> None:
+        """Stop tracking a module that has been unloaded."""
+        with self._lock:
+            self._entries.pop(id(module), None)
+
+    @contextmanager
+    def using(self, module: WasmModule) -> Generator[WasmModule, None, None]:
+        """
+        Protect the module from being unloaded for the duration of the context
+        and enforce the limits afterwards, as the call may have grown the
+        module's memory. The size of the memory is recorded before that on
+        the thread that made the call.
+        """
+        with self._lock:
+            entry = self._entries.get(id(module))
+            if entry is not None:
+                entry.active += 1
+        try:
+            yield module
+        finally:
+            if entry is not None:
+                memory_size = module.memory_size
+                with self._lock:
+                    entry.memory_size = memory_size
+                    entry.active -= 1
+                self.touch(module)
+            self.enforce()
+
+    def footprint(self) -> int:
+        """Return the total footprint of the tracked instances in bytes."""
+        with self._lock:
+            entries = list(self._entries.values())
+        return sum(entry.footprint() for entry in entries)
+
+    def _over_limits(self) -> bool:
+        """Return True if memory should be freed."""
+        if self._memory_budget is not None and self.footprint() > self._memory_budget:
+            return True
+        if self._high_watermark is not None:
+            return psutil.virtual_memory().percent / 100 > self._high_watermark
+        return False
+
+    def _idle_entries(self) -> List[InstanceEntry]:
+        """Return the entries that can be unloaded, least recently used first."""
+        now = monotonic()
+        with self._lock:
+            return [
+                entry for entry in self._entries.values()
+                if entry.active == 0 and now - entry.last_used >= self._min_idle
+            ]
+
+    def enforce(self) -> int:
+        """
+        Unload idle instances, least recently used first, until the limits
+        are no longer exceeded. Return the number of unloaded instances.
+        """
+        if not self._over_limits():
+            return 0
+        evicted = 0
+        for entry in self._idle_entries():
+            with self._lock:
+                # Skip entries that have been used since they were listed.
+                if self._entries.get(id(entry.module)) is not entry or entry.active > 0:
+                    continue
+                del self._entries[id(entry.module)]
+            print(f"Unloading idle module '{entry.module.name}' to free memory")
+            entry.runtime.unload_module(entry.module.name)
+            metrics.instance_evictions.inc()
+            evicted += 1
+            if not self._over_limits():
+                break
+        return evicted
+
+    def __len__(self) -> int:
+        with self._lock:
+            return len(self._entries)
+
+
+_manager = InstanceManager()
+metrics.instances_loaded.set_function(_manager.__len__)
+metrics.instance_footprint_bytes.set_function(_manager.footprint)
+
+
+def get_manager() -> InstanceManager:
+    """Get the manager of the loaded modules."""
+    return _manager
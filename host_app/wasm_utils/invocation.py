@@ -0,0 +1,115 @@
+"""
+Context of the ongoing Wasm function invocation for the host functions.
+
+Host functions are called by the runtime from within a guest function and
+need to know which module called them, e.g., for accessing its memory. The
+invocation context is kept in a context variable, so that each thread (and
+each asyncio task) sees only its own invocation.
+"""
+
+from __future__ import annotations
+from contextlib import contextmanager
+from contextvars import ContextVar
+from dataclasses import dataclass, field
+from time import monotonic
+from typing import TYPE_CHECKING, Any, Generator, Iterable, List, Optional, Tuple
+
+from host_app.wasm_utils.streams import StreamTable
+
+if TYPE_CHECKING:
+    from host_app.wasm_utils.wasm_api import ByteType, WasmModule, WasmRuntime
+
+
+@dataclass(frozen=True)
+class InvocationContext:
+    """The module whose function is being run and details of the request."""
+    module: WasmModule
+    request_id: Optional[str] = None
+    """Id of the request that caused the invocation, if any"""
+    deadline: Optional[float] = None
+    """Monotonic time by which the invocation should finish, None for no limit"""
+    data_dirs: Optional[Tuple[str, ...]] = None
+    """Directories of the invocation's files, the runtime's data directories if None"""
+    streams: StreamTable = field(default_factory=StreamTable)
+    """Streams opened by the module during the invocation"""
+
+    @property
+    def runtime(self) -> WasmRuntime:
+        """Get the runtime of the module."""
+        runtime = self.module.runtime
+        if runtime is None:
+            raise RuntimeError(f"Module '{self.module.name}' has no runtime")
+        return runtime
+
+    @property
+    def directories(self) -> List[str]:
+        """Get the directories whose files the module can access in this invocation."""
+        return list(self.data_dirs) if self.data_dirs is not None else self.runtime.data_dirs
+
+    def remaining(self) -> Optional[float]:
+        """Return the seconds left until the deadline, None if there is no deadline."""
+        if self.deadline is None:
+            return None
+        return max(0.0, self.deadline - monotonic())
+
+    def read_memory(self, address: int, length: int) -> Tuple[bytes, Optional[str]]:
+        """
+        Read from the module's memory. Return the bytes and None on success or
+        empty bytes and an error message on failure.
+        """
+        return self.runtime.read_from_memory(address, length, self.module.name)
+
+    def write_memory(self, address: int, data: ByteType) -> Optional[str]:
+        """Write to the module's memory. Return None on success or an error message."""
+        return self.runtime.write_to_memory(address, data, self.module.name)
+
+    def call(self, function_name: str, params: List[Any]) -> Any:
+        """Run another function of the module, e.g., for allocating memory."""
+        return self.module.run_function(function_name, params)
+
+
+_current: ContextVar[Optional[InvocationContext]] = ContextVar("wasm_invocation", default=None)
+
+
+def current() -> InvocationContext:
+    """Get the context of the ongoing invocation. Raise RuntimeError if there is none."""
+    context = _current.get()
+    if context is None:
+        raise RuntimeError("No Wasm function is being run")
+    return context
+
+
+@contextmanager
+def invocation(
+    module: WasmModule,
+    request_id: Optional[str] = None,
+    deadline: Optional[float] = None,
+    data_dirs: Optional[Iterable[str]] = None
+) -> Generator[InvocationContext, None, None]:
+    """
+    Set the context for running a function of the module. The request id,
+    the deadline, the data directories and the open streams are inherited
+    from an enclosing invocation of the same module unless given, e.g., when
+    a host function calls back into the module or a tiered module runs the
+    function with its active instance. Streams left open are closed when the
+    outermost invocation ends.
+    """
+    outer = _current.get()
+    dirs = tuple(data_dirs) if data_dirs is not None else None
+    if outer is not None and (outer.module is module or outer.module.path == module.path):
+        context = InvocationContext(
+            module,
+            request_id if request_id is not None else outer.request_id,
+            deadline if deadline is not None else outer.deadline,
+            dirs if dirs is not None else outer.data_dirs,
+            outer.streams,
+        )
+    else:
+        context = InvocationContext(module, request_id, deadline, dirs)
+    token = _current.set(context)
+    try:
+        yield context
+    finally:
+        _current.reset(token)
+        if outer is None or outer.streams is not context.streams:
+            context.streams.close_all()
@@ -0,0 +1,176 @@
+"""
+Disk cache of Wasm modules compiled by Wasmtime.
+
+The compiled artifacts are keyed by the contents of the module and the
+fingerprint of the engine that compiled them, so that a module compiled by a
+different Wasmtime version or engine configuration is never deserialized.
+The total size of the cache is bounded by evicting the least recently used
+artifacts.
+"""
+
+from __future__ import annotations
+import hashlib
+import os
+from pathlib import Path
+import threading
+from typing import Dict, Optional, Tuple
+
+from host_app.utils import metrics
+from host_app.utils.files import write_atomically
+from host_app.wasm_utils.compiler import engine_fingerprint
+
+ARTIFACT_SUFFIX = ".cwasm"
+
+
+class ModuleCache:
+    """
+    Directory of compiled modules with a disk quota. A cache without a
+    directory is disabled and never finds anything.
+    """
+    def __init__(self, directory: Optional[Path] = None, max_bytes: Optional[int] = None) -> None:
+        self._directory = Path(directory) if directory is not None else None
+        self._max_bytes = max_bytes
+        self._fingerprint: Optional[str] = None
+        # Module path -> (mtime, size, digest) so that unchanged modules are
+        # not hashed again.
+        self._digests: Dict[str, Tuple[float, int, str]] = {}
+        self._lock = threading.Lock()
+        if self._directory is not None:
+            self._directory.mkdir(parents=True, exist_ok=True)
+            metrics.module_cache_bytes.set_function(self.size)
+
+    @property
+    def directory(self) -> Optional[Path]:
+        """Get the directory of the cache or None if the cache is disabled."""
+        return self._directory
+
+    @property
+    def fingerprint(self) -> str:
+        """
+        Get the fingerprint of the engine that compiles the modules. It is
+        computed on first use, so that creating a cache costs nothing when
+        modules are not run with Wasmtime.
+        """
+        if self._fingerprint is None:
+            self._fingerprint = engine_fingerprint()
+        return self._fingerprint
+
+    def _digest(self, module_path: str) -> str:
+        """Return the SHA-256 digest of the module's contents."""
+        stat = os.stat(module_path)
+        with self._lock:
+            known = self._digests.get(module_path)
+        if known is not None and known[:2] == (stat.st_mtime, stat.st_size):
+            return known[2]
+        sha256 = hashlib.sha256()
+        with open(module_path, "rb") as module_file:
+            while chunk := module_file.read(1024 * 1024):
+                sha256.update(chunk)
+        digest = sha256.hexdigest()
+        with self._lock:
+            self._digests[module_path] = (stat.st_mtime, stat.st_size, digest)
+        return digest
+
+    def path_for(self, module_path: str) -> Optional[Path]:
+        """
+        Return the path of the compiled artifact of the module, whether it
+        exists or not, or None if the cache is disabled.
+        """
+        if self._directory is None:
+            return None
+        key = hashlib.sha256(
+            (self._digest(module_path) + self.fingerprint).encode("utf-8")
+        ).hexdigest()
+        return self._directory / (key + ARTIFACT_SUFFIX)
+
+    def contains(self, module_path: str) -> bool:
+        """Return True if a compiled artifact of the module exists."""
+        path = self.path_for(module_path)
+        return path is not None and path.exists()
+
+    def lookup(self, module_path: str) -> Optional[Path]:
+        """
+        Return the path of the compiled artifact of the module if it exists
+        and mark it as recently used.
+        """
+        path = self.path_for(module_path)
+        if path is None:
+            return None
+        try:
+            # The modification time is used for finding the least recently
+            # used artifacts to evict.
+            os.utime(path)
+        except FileNotFoundError:
+            metrics.module_cache_requests.inc(result="miss")
+            return None
+        metrics.module_cache_requests.inc(result="hit")
+        return path
+
+    def store(self, module_path: str, byte_module: bytes | bytearray) -> Optional[Path]:
+        """Save the compiled module into the cache and return its path."""
+        path = self.path_for(module_path)
+        if path is None:
+            return None
+        write_atomically(str(path), byte_module)
+        self.evict()
+        return path
+
+    def discard(self, path: Path) -> None:
+        """Remove an artifact, e.g., after it failed to deserialize."""
+        try:
+            path.unlink()
+        except FileNotFoundError:
+            pass
+
+    def _artifacts(self) -> list[Tuple[Path, os.stat_result]]:
+        """Return the paths and stats of the artifacts in the cache."""
+        if self._directory is None:
+            return []
+        artifacts = []
+        for entry in os.scandir(self._directory):
+            if entry.name.endswith(ARTIFACT_SUFFIX) and not entry.name.startswith("."):
+                try:
+                    artifacts.append((Path(entry.path), entry.stat()))
+                except FileNotFoundError:
+                    continue
+        return artifacts
+
+    def size(self) -> int:
+        """Return the total size of the artifacts in bytes."""
+        return sum(stat.st_size for _, stat in self._artifacts())
+
+    def evict(self) -> int:
+        """
+        Remove the least recently used artifacts until the cache fits in its
+        quota. Return the number of bytes removed.
+        """
+        if self._max_bytes is None:
+            return 0
+        with self._lock:
+            artifacts = sorted(self._artifacts(), key=lambda item: item[1].st_mtime)
+            total = sum(stat.st_size for _, stat in artifacts)
+            removed = 0
+            for path, stat in artifacts:
+                if total - removed <= self._max_bytes:
+                    break
+                print(f"Evicting compiled module {path.name} from cache")
+                self.discard(path)
+                removed += stat.st_size
+                metrics.module_cache_evictions.inc()
+        return removed
+
+
+_cache = ModuleCache()
+
+
+def get_cache() -> ModuleCache:
+    """Get the cache used for compiled modules."""
+    return _cache
+
+
+def configure(directory: Optional[Path], max_bytes: Optional[int] = None) -> ModuleCache:
+    """Set up the cache used for compiled modules and return it."""
+    global _cache  # pylint: disable=global-statement
+    _cache = ModuleCache(directory, max_bytes)
+    _cache.evict()
+    return _cache
@@ -0,0 +1,98 @@
+"""
+Files opened by modules as streams through the `stream` host functions.
+
+WASI gives a module its whole input file at once, and Wasm3 does not support
+WASI at all, so a large input or output would have to fit in the module's
+linear memory. With streams, a module opens a file of its mount directory
+(e.g., a file received in the request) and reads or writes it in chunks of
+the size it chooses, so the memory it needs does not grow with the file.
+
+Streams are opened for a single invocation and closed when it ends.
+"""
+
+from __future__ import annotations
+from pathlib import Path
+import threading
+from typing import BinaryIO, Dict, Iterable
+
+MAX_OPEN = 16
+"""Number of streams an invocation can have open at the same time"""
+
+# Modes of opening a stream given by modules
+READ = 0
+WRITE = 1
+APPEND = 2
+
+FILE_MODES = {READ: "rb", WRITE: "wb", APPEND: "ab"}
+
+
+class StreamError(RuntimeError):
+    """Raised when a stream can not be opened or used."""
+
+
+def resolve_path(data_dirs: Iterable[str], name: str, mode: int) -> Path:
+    """
+    Return the path of a file in the data directories. Files are read from
+    the first directory that has them and created in the first directory.
+    Raise StreamError if the name points outside of the directories.
+    """
+    dirs = [Path(data_dir).resolve() for data_dir in data_dirs]
+    if not dirs:
+        raise StreamError("No directories are available to the module")
+    for data_dir in dirs:
+        path = (data_dir / name).resolve()
+        if not path.is_relative_to(data_dir):
+            raise StreamError(f"Path {name!r} is outside of the module's directories")
+        if mode != READ or path.is_file():
+            return path
+    raise StreamError(f"File {name!r} not found")
+
+
+class StreamTable:
+    """The streams opened during an invocation by their handles."""
+    def __init__(self) -> None:
+        self._files: Dict[int, BinaryIO] = {}
+        self._next_handle = 1
+        self._lock = threading.Lock()
+
+    def open(self, data_dirs: Iterable[str], name: str, mode: int) -> int:
+        """Open a file of the data directories and return a handle to it."""
+        file_mode = FILE_MODES.get(mode)
+        if file_mode is None:
+            raise StreamError(f"Unknown mode {mode}")
+        path = resolve_path(data_dirs, name, mode)
+        with self._lock:
+            if len(self._files) >= MAX_OPEN:
+                raise StreamError(f"Too many open streams ({MAX_OPEN})")
+            try:
+                file = open(path, file_mode)  # pylint: disable=consider-using-with
+            except OSError as error:
+                raise StreamError(f"Opening {name!r} failed: {error}") from error
+            handle = self._next_handle
+            self._next_handle += 1
+            self._files[handle] = file
+        return handle
+
+    def get(self, handle: int) -> BinaryIO:
+        """Return the file of a handle. Raise StreamError if the handle is unknown."""
+        file = self._files.get(handle)
+        if file is None:
+            raise StreamError(f"Unknown stream {handle}")
+        return file
+
+    def close(self, handle: int) -> None:
+        """Close a stream. Raise StreamError if the handle is unknown."""
+        with self._lock:
+            file = self._files.pop(handle, None)
+        if file is None:
+            raise StreamError(f"Unknown stream {handle}")
+        file.close()
+
+    def close_all(self) -> int:
+        """Close the streams that the module left open and return their number."""
+        with self._lock:
+            files = list(self._files.values())
+            self._files.clear()
+        for file in files:
+            file.close()
+        return len(files)
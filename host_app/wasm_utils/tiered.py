@@ -0,0 +1,358 @@
+"""
+Tiered execution of Wasm modules with Wasm3 and Wasmtime.
+
+Compiling a module with Wasmtime takes long, which dominates for modules
+that are called rarely, while interpreting a module with Wasm3 is several
+times slower, which dominates for modules that are called often. A tiered
+module starts on Wasm3 for a fast first response and is compiled with
+Wasmtime in the background. Once it is called often enough, or has spent
+enough time in the interpreter, it is promoted to the compiled version. A
+promoted module that has been idle for long is demoted back to Wasm3, which
+frees the memory of its Wasmtime instance.
+
+Switching runtimes replaces the module's instance, so the state in its
+linear memory is not carried over, like when the instance manager unloads
+an idle instance. Switching only happens between calls.
+"""
+
+from __future__ import annotations
+from collections import deque
+from dataclasses import dataclass
+import threading
+from time import monotonic, perf_counter, sleep
+from typing import Any, Deque, Dict, List, Optional, Tuple
+import weakref
+
+from host_app.utils import metrics
+from host_app.wasm_utils import host_functions, module_cache
+from host_app.wasm_utils.wasm_api import (
+    FunctionSignature, IncompatibleWasmModule, ModuleConfig, ResourceLimits, WasmModule, WasmResourceLimitExceeded,
+    WasmRuntime
+)
+from host_app.wasm_utils.wasm_binary import read_imports
+
+
+@dataclass(frozen=True)
+class TieringPolicy:
+    """When tiered modules are promoted to Wasmtime and demoted back to Wasm3."""
+    promote_calls: int = 10
+    """Number of calls within the window after which a module is promoted"""
+    promote_seconds: float = 1.0
+    """Time (in seconds) spent in the interpreter within the window after which a module is promoted"""
+    window: float = 60.0
+    """Time (in seconds) over which the calls are counted"""
+    demote_after: Optional[float] = 600.0
+    """Time (in seconds) without calls after which a promoted module is demoted, None for never"""
+
+
+_policy = TieringPolicy()
+
+
+def get_policy() -> TieringPolicy:
+    """Get the policy of tiered modules."""
+    return _policy
+
+
+def configure(policy: TieringPolicy) -> TieringPolicy:
+    """Set the policy of tiered modules. Return the policy."""
+    global _policy  # pylint: disable=global-statement
+    _policy = policy
+    return _policy
+
+
+class TieredRuntime(WasmRuntime):
+    """
+    Runtime whose modules move between a Wasm3 and a Wasmtime runtime. The
+    Wasmtime runtime is created when the first module is promoted.
+
+    :param data_dirs: Directories opened for the modules, with WASI only when
+    they run with Wasmtime.
+    :param limits: Resource limits of the modules in both runtimes.
+    :param wasm3_stack_size: Size (in bytes) of the stack of each module
+    running with Wasm3.
+    """
+    name = "tiered"
+
+    def __init__(
+        self,
+        data_dirs=(),
+        limits: Optional[ResourceLimits] = None,
+        wasm3_stack_size: Optional[int] = None
+    ) -> None:
+        super().__init__(limits, data_dirs)
+        self._wasm3_stack_size = wasm3_stack_size
+        self._backends: dict[str, WasmRuntime] = {}
+
+    def backend(self, name: str) -> WasmRuntime:
+        """Get the runtime of the given type ('wasm3' or 'wasmtime'), creating it on first use."""
+        # pylint: disable=import-outside-toplevel
+        from host_app.wasm_utils import wasm
+        with self._lock:
+            if name not in self._backends:
+                self._backends[name] = wasm.new_runtime(
+                    name, self._data_dirs, self.limits, wasm3_stack_size=self._wasm3_stack_size
+                )
+            return self._backends[name]
+
+    def load_module(self, module: ModuleConfig) -> Optional[WasmModule]:
+        """Load a module into the Wasm runtime."""
+        if module.name in self.modules:
+            print(f"Module {module.name} already loaded!")
+            return self.modules[module.name]
+
+        wasm_module = TieredModule(module, self)
+        self._add_module(wasm_module)
+        return wasm_module
+
+    def close(self) -> None:
+        """Release the modules and the runtimes of both tiers."""
+        super().close()
+        with self._lock:
+            for backend in self._backends.values():
+                backend.close()
+            self._backends.clear()
+
+    def _active_module(self, module_name: Optional[str]) -> WasmModule:
+        """Return the instance currently serving the named or only module."""
+        if module_name is None and len(self.modules) == 1:
+            module_name = next(iter(self.modules))
+        module = self.modules.get(module_name) if module_name is not None else None
+        if not isinstance(module, TieredModule):
+            raise IncompatibleWasmModule(f"Module {module_name!r} is not a loaded tiered module")
+        return module.active
+
+    def read_from_memory(self, address: int, length: int, module_name: Optional[str] = None
+    ) -> Tuple[bytes, Optional[str]]:
+        """Read from the memory of the instance currently serving the module."""
+        active = self._active_module(module_name)
+        return active.runtime.read_from_memory(address, length, active.name)
+
+    def write_to_memory(self, address: int, bytes_data: bytes, module_name: Optional[str] = None
+    ) -> Optional[str]:
+        """Write to the memory of the instance currently serving the module."""
+        active = self._active_module(module_name)
+        return active.runtime.write_to_memory(address, bytes_data, active.name)
+
+
+class TieredModule(WasmModule):
+    """
+    Stable handle to a module that runs with Wasm3 or Wasmtime, whichever
+    tier it currently is in. Modules that import functions that only Wasmtime
+    provides (e.g., WASI) run with Wasmtime from the start.
+    """
+    def __init__(self, config: ModuleConfig, runtime: TieredRuntime) -> None:
+        assert isinstance(runtime, TieredRuntime)
+        super().__init__(config, runtime)
+        self._config = config
+        self._tiered_runtime = runtime
+        self._calls: Deque[Tuple[float, float]] = deque()
+        """Start time and duration of the recent calls in the interpreter"""
+        self._last_call = monotonic()
+        self._active_calls = 0
+        self._lock = threading.Lock()
+        self._compiled = threading.Event()
+        self._wasmtime_only = self._needs_wasmtime()
+
+        if self._wasmtime_only:
+            self._active = self._load("wasmtime")
+        else:
+            self._active = self._load("wasm3")
+            threading.Thread(target=self._compile, name=f"compile-{self.name}", daemon=True).start()
+        _modules.add(self)
+        _start_demoter()
+
+    @property
+    def active(self) -> WasmModule:
+        """Get the instance currently serving the module."""
+        return self._active
+
+    @property
+    def tier(self) -> str:
+        """Get the name of the runtime currently serving the module."""
+        assert self._active.runtime is not None
+        return self._active.runtime.name
+
+    def _needs_wasmtime(self) -> bool:
+        """Return True if the module imports functions that Wasm3 does not provide."""
+        with open(self.path, mode="rb") as module_file:
+            imports = read_imports(module_file.read())
+        _, missing = host_functions.resolve(
+            [(item.module, item.name) for item in imports if item.kind == "func"], "wasm3"
+        )
+        return bool(missing)
+
+    def _load(self, tier: str) -> WasmModule:
+        """Load the module into the runtime of the given tier."""
+        module = self._tiered_runtime.backend(tier).load_module(self._config)
+        if module is None:
+            raise RuntimeError(f"Module '{self.name}' could not be loaded with {tier}")
+        return module
+
+    def _unload(self, module: WasmModule) -> None:
+        """Unload an instance that no longer serves the module."""
+        if module.runtime is not None:
+            module.runtime.unload_module(module.name)
+
+    def _compile(self) -> None:
+        """Compile the module into the module cache for promoting it later."""
+        # pylint: disable=import-outside-toplevel
+        from host_app.wasm_utils.compiler import compile_to_file
+        cached_path = module_cache.get_cache().path_for(self.path)
+        try:
+            # Without the cache, the module is compiled when it is promoted.
+            if cached_path is not None and not cached_path.exists():
+                compile_to_file(self.path, str(cached_path))
+        except Exception as error:  # pylint: disable=broad-except
+            print(f"Compiling module '{self.name}' in the background failed: {error}")
+            return
+        self._compiled.set()
+
+    def _should_promote(self, now: float) -> bool:
+        """
+        Return True if the calls in the window cross the thresholds of the
+        policy. Called with the lock held.
+        """
+        policy = get_policy()
+        while self._calls and self._calls[0][0] < now - policy.window:
+            self._calls.popleft()
+        return (
+            len(self._calls) >= policy.promote_calls
+            or sum(duration for _, duration in self._calls) >= policy.promote_seconds
+        )
+
+    def _replace(self, tier: str) -> Optional[WasmModule]:
+        """
+        Load the module into the runtime of the given tier to serve it if no
+        calls are ongoing. Return the instance that served it before, to be
+        unloaded with `_switched`, or None if the module was not moved.
+        Called with the lock held.
+        """
+        if self._active_calls or self.tier == tier:
+            return None
+        previous = self._active
+        self._active = self._load(tier)
+        self._calls.clear()
+        return previous
+
+    def _switched(self, previous: WasmModule, tier: str) -> None:
+        """Unload the instance that served the module before it was moved to the tier."""
+        self._unload(previous)
+        metrics.tier_switches.inc(tier=tier)
+        print(f"Module '{self.name}' moved to {tier}")
+
+    def _switch(self, tier: str) -> bool:
+        """
+        Move the module to the runtime of the given tier if no calls are
+        ongoing. Return True if the module was moved.
+        """
+        with self._lock:
+            previous = self._replace(tier)
+        if previous is None:
+            return False
+        self._switched(previous, tier)
+        return True
+
+    def demote_if_idle(self) -> bool:
+        """Move a promoted module back to Wasm3 if it has been idle for long enough."""
+        demote_after = get_policy().demote_after
+        if demote_after is None or self._wasmtime_only or self.tier == "wasm3":
+            return False
+        if monotonic() - self._last_call < demote_after:
+            return False
+        return self._switch("wasm3")
+
+    @property
+    def memory_size(self) -> Optional[int]:
+        """Get the current size of the active instance's linear memory in bytes."""
+        return self._active.memory_size
+
+    @property
+    def code_size(self) -> int:
+        """Get the size of the active instance's code in bytes."""
+        return self._active.code_size
+
+    def close(self) -> None:
+        """Release the active instance."""
+        super().close()
+        _modules.discard(self)
+        self._unload(self._active)
+
+    @property
+    def needs_isolation(self) -> bool:
+        """Return True if the active instance needs a new instance for other directories."""
+        return self._active.needs_isolation
+
+    def new_isolated(self, config: ModuleConfig, data_dirs: List[str]) -> Optional[WasmModule]:
+        """Create a new instance of the module in the runtime of its current tier if it needs one."""
+        return self._active.new_isolated(config, data_dirs)
+
+    def _get_function(self, function_name: str) -> Optional[WasmModule.FunctionType]:
+        """Get a function from the active instance."""
+        return self._active._get_function(function_name)  # pylint: disable=protected-access
+
+    def _get_signatures(self) -> Dict[str, FunctionSignature]:
+        """Get the exported functions of the Wasm module and their signatures."""
+        return self._active.signatures
+
+    def run_function(self, function_name: str, params: List[Any]) -> Any:
+        """
+        Run a function with the active instance and return the result. The
+        module is promoted before the call if the calls so far have crossed
+        the thresholds and it has been compiled.
+        """
+        now = monotonic()
+        # Checking the calls, promoting and counting this call happen under
+        # the same lock, so concurrent calls neither lose counts nor promote
+        # the module twice.
+        promoted = None
+        with self._lock:
+            if self.tier == "wasm3" and self._compiled.is_set() and self._should_promote(now):
+                promoted = self._replace("wasmtime")
+            self._active_calls += 1
+            active = self._active
+        if promoted is not None:
+            self._switched(promoted, "wasmtime")
+        start = perf_counter()
+        try:
+            return active.run_function(function_name, params)
+        except WasmResourceLimitExceeded:
+            # The runtime unloads an instance that grew over the memory limit,
+            # so load a fresh one for the next call.
+            with self._lock:
+                if active is self._active and active.runtime is not None \
+                        and active.name not in active.runtime.modules:
+                    self._active = self._load(self.tier)
+            raise
+        finally:
+            duration = perf_counter() - start
+            with self._lock:
+                self._active_calls -= 1
+                self._last_call = monotonic()
+                if active is self._active and self.tier == "wasm3":
+                    self._calls.append((now, duration))
+
+
+_modules: "weakref.WeakSet[TieredModule]" = weakref.WeakSet()
+_demoter: Optional[threading.Thread] = None
+_demoter_lock = threading.Lock()
+
+
+def _demote_idle() -> None:
+    """Demote idle promoted modules periodically."""
+    while True:
+        demote_after = get_policy().demote_after
+        sleep(min(demote_after / 2, 30.0) if demote_after else 30.0)
+        for module in list(_modules):
+            try:
+                module.demote_if_idle()
+            except Exception as error:  # pylint: disable=broad-except
+                print(f"Demoting module '{module.name}' failed: {error}")
+
+
+def _start_demoter() -> None:
+    """Start demoting idle modules in the background if not started yet."""
+    global _demoter  # pylint: disable=global-statement
+    with _demoter_lock:
+        if _demoter is None:
+            _demoter = threading.Thread(target=_demote_idle, name="tier-demoter", daemon=True)
+            _demoter.start()
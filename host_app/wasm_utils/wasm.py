@@ -1,17 +1,47 @@
 """General settings and variables for Wasm."""
 
 from os import environ
-from typing import Dict
+from typing import Iterable, Optional
 
-from host_app.wasm_utils.wasm_api import ModuleConfig, WasmRuntime
-from host_app.wasm_utils.wasmtime import WasmtimeRuntime
-from host_app.wasm_utils.wasm3 import Wasm3Runtime
+from host_app.wasm_utils.wasm_api import ResourceLimits, WasmRuntime
 
 
-environ.setdefault("WASM_RUNTIME", "wasmtime")
+RUNTIMES = ("wasmtime", "wasm3", "tiered")
+"""
+Names of the supported runtimes. Wasmtime compiles modules to native code,
+while Wasm3 interprets them, starting instantly and using less memory.
+Tiered starts modules with Wasm3 and moves the busy ones to Wasmtime (see
+`host_app.wasm_utils.tiered`).
+"""
 
-WasmRuntimeType = Wasm3Runtime if environ["WASM_RUNTIME"] == "wasm3" else WasmtimeRuntime
-print(f"Using {WasmRuntimeType.__name__} as WASM runtime.")
+DEFAULT_RUNTIME = environ.get("WASM_RUNTIME", "wasmtime")
+"""Runtime used for modules unless a deployment selects another one"""
 
-wasm_runtime: WasmRuntime = WasmRuntimeType()
-wasm_modules: Dict[str, ModuleConfig] = {}
+
+def new_runtime(
+    name: str,
+    data_dirs: Iterable[str] = (),
+    limits: Optional[ResourceLimits] = None,
+    wasm3_stack_size: Optional[int] = None
+) -> WasmRuntime:
+    """
+    Create a runtime of the given type. Raise ValueError if the name is not
+    one of RUNTIMES.
+
+    The runtimes are imported only when first needed, as both of them are
+    slow to import.
+    """
+    # pylint: disable=import-outside-toplevel
+    if name == "wasmtime":
+        from host_app.wasm_utils.wasmtime import WasmtimeRuntime
+        return WasmtimeRuntime(list(data_dirs), limits=limits)
+    if name == "wasm3":
+        from host_app.wasm_utils.wasm3 import STACK_SIZE, Wasm3Runtime
+        return Wasm3Runtime(
+            list(data_dirs), limits=limits,
+            stack_size=wasm3_stack_size if wasm3_stack_size is not None else STACK_SIZE
+        )
+    if name == "tiered":
+        from host_app.wasm_utils.tiered import TieredRuntime
+        return TieredRuntime(list(data_dirs), limits=limits, wasm3_stack_size=wasm3_stack_size)
+    raise ValueError(f"Unknown Wasm runtime {name!r}, expected one of {', '.join(RUNTIMES)}")
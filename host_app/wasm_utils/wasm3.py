@@ -1,27 +1,59 @@
 """Wasm3 Python bindings."""
 
 from __future__ import annotations
-from typing import Any, List, Optional, Tuple
+from time import perf_counter
+from typing import Any, Dict, List, Optional, Tuple
 
 import wasm3
 
-from host_app.wasm_utils.general_utils import (
-    python_clock_ms, python_delay, python_print_int, python_println, python_get_temperature,
-    python_get_humidity, Print, TakeImageDynamicSize, RpcCall, RandomGet
-)
+from host_app.utils import metrics
+from host_app.wasm_utils import host_functions, invocation
 from host_app.wasm_utils.wasm_api import (
-    WasmRuntime, WasmModule, ModuleConfig, WasmRuntimeNotSetError
+    WasmRuntime, WasmModule, ModuleConfig, FunctionSignature, IncompatibleWasmModule, ResourceLimits,
+    UnresolvedWasmImports, WasmResourceLimitExceeded, WasmRuntimeNotSetError
+)
+from host_app.wasm_utils.wasm_binary import (
+    FunctionType, WasmImport, read_export_signatures, read_imports
 )
 
-RUNTIME_INIT_MEMORY = 15000
+STACK_SIZE = 15000
+"""Default size (in bytes) of the stack of each Wasm3 module instance"""
+
+WASI_NAMESPACES = ("wasi_snapshot_preview1", "wasi_unstable")
+"""
+Namespaces of WASI, which Wasm3 does not provide. Modules built for WASI
+import many of its functions without necessarily calling them, so these
+imports are allowed to stay unresolved and fail only if they are called.
+"""
 
 
 class Wasm3Runtime(WasmRuntime):
-    """Wasm3 runtime class."""
-    def __init__(self) -> None:
-        super().__init__()
+    """
+    Wasm3 runtime class. Each module is loaded into a Wasm3 runtime of its
+    own, so that modules do not share their memory or function names, and
+    unloading a module frees its memory.
+
+    Wasm3 does not support WASI, so the data directories are available to
+    the modules only as streams (see `host_app.wasm_utils.streams`). It can
+    not limit the growth of linear memory either, so
+    the memory limit is checked after each call instead (see
+    `Wasm3Module.run_function`).
+
+    :param data_dirs: Directories whose files the modules can open as streams.
+    :param limits: Resource limits of the modules.
+    :param stack_size: Size (in bytes) of the stack of each module.
+    """
+    name = "wasm3"
+
+    def __init__(
+        self,
+        data_dirs=(),
+        limits: Optional[ResourceLimits] = None,
+        stack_size: int = STACK_SIZE
+    ) -> None:
+        super().__init__(limits, data_dirs)
         self._env = wasm3.Environment()
-        self._runtime = self._env.new_runtime(RUNTIME_INIT_MEMORY)
+        self._stack_size = stack_size
 
     @property
     def env(self) -> wasm3.Environment:
@@ -29,38 +61,49 @@ class Wasm3Runtime(WasmRuntime):
         return self._env
 
     @property
-    def runtime(self) -> wasm3.Runtime:
-        """Get the Wasm3 runtime."""
-        return self._runtime
+    def stack_size(self) -> int:
+        """Get the size of the stack of each module in bytes."""
+        return self._stack_size
 
     def load_module(self, module: ModuleConfig) -> Optional[WasmModule]:
         """Load a module into the Wasm runtime."""
-        try:
-            if module.name in self.modules:
-                print(f"Module {module.name} already loaded!")
-                return self.modules[module.name]
-
-            wasm_module = Wasm3Module(module, self)
-            self._modules[module.name] = wasm_module
-            return wasm_module
-        except AttributeError as error:
-            print(error)
-            return None
+        if module.name in self.modules:
+            print(f"Module {module.name} already loaded!")
+            return self.modules[module.name]
+
+        wasm_module = Wasm3Module(module, self)
+        self._add_module(wasm_module)
+        return wasm_module
+
+    def _memory_of(self, module_name: Optional[str]) -> Tuple[Optional[memoryview], str]:
+        """
+        Return the memory of the named module, or of the only loaded module if
+        no name is given, and an error message if there is none.
+        """
+        if module_name is None and len(self.modules) == 1:
+            module_name = next(iter(self.modules))
+        module = self.modules.get(module_name) if module_name is not None else None
+        if module is None:
+            return None, f"Module {module_name!r} is not loaded"
+        if not isinstance(module, Wasm3Module):
+            raise IncompatibleWasmModule
+        memory = module.get_memory()
+        if memory is None:
+            return None, f"Module {module.name} has no memory!"
+        return memory, ""
 
     def read_from_memory(self, address: int, length: int, module_name: Optional[str] = None
     ) -> Tuple[bytes, Optional[str]]:
-        """Read from the runtime memory and return the result.
+        """Read from the memory of a module and return the result.
 
         :return Tuple where the first item is the bytes inside in the requested
         block of WebAssembly runtime's memory and the second item is None if the
         read was successful and an error if not.
         """
-        try:
-            wasm_memory = self._runtime.get_memory(0)
-            block = wasm_memory[address:address + length]
-            print(f"Read {len(block)} bytes from memory at address {address}")
-            return block, None
-        except RuntimeError as error:
+        memory, error = self._memory_of(module_name)
+        if memory is not None and (address < 0 or length < 0 or address + length > len(memory)):
+            memory, error = None, f"out of bounds of memory of {len(memory)} bytes"
+        if memory is None:
             return (
                 bytes(),
                 (
@@ -68,20 +111,26 @@ class Wasm3Runtime(WasmRuntime):
                     f"with length {length} failed: {error}"
                 )
             )
+        block = bytes(memory[address:address + length])
+        print(f"Read {len(block)} bytes from memory at address {address}")
+        metrics.memory_bytes.inc(len(block), direction="read")
+        return block, None
 
     def write_to_memory(self, address: int, bytes_data: bytes, module_name: Optional[str] = None
     ) -> Optional[str]:
-        """Write to the runtime memory.
+        """Write to the memory of a module.
         Return None on success or an error message on failure."""
-        try:
-            wasm_memory = self.runtime.get_memory(0)
-            wasm_memory[address:address + len(bytes_data)] = bytes_data
-            return None
-        except RuntimeError as error:
+        memory, error = self._memory_of(module_name)
+        if memory is not None and (address < 0 or address + len(bytes_data) > len(memory)):
+            memory, error = None, f"out of bounds of memory of {len(memory)} bytes"
+        if memory is None:
             return (
                 f"Could not insert data (length {len(bytes_data)}) into to " +
                 f"WebAssembly memory at address ({address}): {error}"
             )
+        memory[address:address + len(bytes_data)] = bytes_data
+        metrics.memory_bytes.inc(len(bytes_data), direction="write")
+        return None
 
 
 class Wasm3Module(WasmModule):
@@ -89,118 +138,144 @@ class Wasm3Module(WasmModule):
     def __init__(self, config: ModuleConfig, runtime: Wasm3Runtime) -> None:
         assert isinstance(runtime, Wasm3Runtime)
         super().__init__(config, runtime)
+        self._instance: Optional[wasm3.Module] = None
+        self._m3_runtime: Optional[wasm3.Runtime] = None
+        self._imports: List[WasmImport] = []
+        self._export_signatures: Dict[str, FunctionType] = {}
+        # Looking up functions by name is slow with Wasm3, so the found ones
+        # are kept.
+        self._function_cache: Dict[str, wasm3.Function] = {}
         # Linking is performed via a module instance, so loading needs to be
         # done first.
         self._load_module()
         self._link_remote_functions()
 
+    def get_memory(self) -> Optional[memoryview]:
+        """Get the linear memory of the module or None if it has none."""
+        if self._m3_runtime is None:
+            return None
+        try:
+            return self._m3_runtime.get_memory(0)
+        except RuntimeError:
+            return None
+
+    @property
+    def memory_size(self) -> Optional[int]:
+        """Get the current size of the module's linear memory in bytes."""
+        memory = self.get_memory()
+        return len(memory) if memory is not None else None
+
+    def close(self) -> None:
+        """Release the module and its Wasm3 runtime along with its memory."""
+        super().close()
+        self._function_cache.clear()
+        self._instance = None
+        self._m3_runtime = None
+
     def _get_function(self, function_name: str) -> Optional[wasm3.Function]:
         """Get a function from the Wasm module. If the function is not found, return None."""
-        if self.runtime is None:
-            print("Runtime not set!")
-            return None
-        if not isinstance(self.runtime, Wasm3Runtime):
+        func = self._function_cache.get(function_name)
+        if func is not None:
+            return func
+        if self._m3_runtime is None:
+            print("Instance not set!")
             return None
 
         try:
-            func = self.runtime.runtime.find_function(function_name)
-            # print(f"Found function '{function_name}' in module '{self.name}'")
-            return func
+            func = self._m3_runtime.find_function(function_name)
         except RuntimeError:
             print(f"Function '{function_name}' not found!")
             return None
+        self._function_cache[function_name] = func
+        return func
 
-    def _get_all_functions(self) -> List[str]:
-        """Get the names of the all known functions in the Wasm module."""
-        # Is there a way to get all the functions in the module with wasm3?
-        if self._functions:
-            return self._functions
-        return []
-
-    def get_arg_types(self, function_name: str) -> List[type]:
-        """Get the argument types of a function from the Wasm module."""
-        if not isinstance(self.runtime, Wasm3Runtime):
-            return []
-
-        func = self.runtime.runtime.find_function(function_name)
-        if func is None:
-            return []
-        return [
-            arg_types[x]
-            for x in func.arg_types
-        ]
+    def _get_signatures(self) -> Dict[str, FunctionSignature]:
+        """Get the exported functions of the Wasm module and their signatures."""
+        return {
+            name: FunctionSignature(params, results)
+            for name, (params, results) in self._export_signatures.items()
+        }
 
     def run_function(self, function_name: str, params: List[Any]) -> Any:
-        """Run a function from the Wasm module and return the result."""
+        """
+        Run a function from the Wasm module and return the result. Raise
+        WasmResourceLimitExceeded if the linear memory grew beyond the limit,
+        in which case the module is unloaded to free the memory.
+        """
         if not isinstance(self.runtime, Wasm3Runtime):
             return None
 
-        # TODO: this approach is used in order to allocate required memory to the correct module
-        # in external functions like take_image. It is not thread safe and can cause problems.
-        self.runtime.current_module_name = self.name
-
         func = self._get_function(function_name)
         if func is None:
             return None
 
         print(f"({self.name}) Running function '{function_name}' with params: {params}")
-        if not params:
-            return func()
-        return func(*params)
+        with invocation.invocation(self):
+            result = func(*params) if params else func()
+
+        memory_limit = self.runtime.limits.memory_bytes
+        memory_size = self.memory_size
+        if memory_limit is not None and memory_size is not None and memory_size > memory_limit:
+            self.runtime.unload_module(self.name)
+            raise WasmResourceLimitExceeded(
+                f"Module '{self.name}' exceeded its memory limit of "
+                f"{memory_limit} bytes in function '{function_name}'"
+            )
+        return result
 
     def _load_module(self) -> None:
-        """Load the Wasm module into the Wasm runtime."""
+        """
+        Load the Wasm module into a Wasm3 runtime of its own. Raise
+        RuntimeError if Wasm3 can not load it.
+        """
         if not isinstance(self.runtime, Wasm3Runtime):
             return
 
-        try:
-            with open(self.path, mode="rb") as module_file:
-                self._instance = self.runtime.env.parse_module(module_file.read())
-            self.runtime.runtime.load(self._instance)
-        except RuntimeError as error:
-            print(error)
+        start = perf_counter()
+        with open(self.path, mode="rb") as module_file:
+            binary = module_file.read()
+        self._imports = read_imports(binary)
+        self._export_signatures = read_export_signatures(binary)
+        m3_runtime = self.runtime.env.new_runtime(self.runtime.stack_size)
+        self._instance = self.runtime.env.parse_module(binary)
+        m3_runtime.load(self._instance)
+        self._m3_runtime = m3_runtime
+        metrics.instantiation_seconds.observe(perf_counter() - start, runtime="wasm3")
+
+        memory_limit = self.runtime.limits.memory_bytes
+        memory_size = self.memory_size
+        if memory_limit is not None and memory_size is not None and memory_size > memory_limit:
+            self.close()
+            raise WasmResourceLimitExceeded(
+                f"Module '{self.name}' can not be instantiated within limits "
+                f"{self.runtime.limits}: initial memory is {memory_size} bytes"
+            )
 
     def _link_remote_functions(self) -> None:
-        """Link some remote functions to the Wasm3 module."""
+        """
+        Link the host functions imported by the module. Raise
+        UnresolvedWasmImports if the module imports functions that are not
+        available, as Wasm3 would only notice when they are called.
+        """
         if self.runtime is None:
             raise WasmRuntimeNotSetError()
+        if self._instance is None:
+            return
+
+        function_imports = [(item.module, item.name) for item in self._imports if item.kind == "func"]
+        found, missing = host_functions.resolve(function_imports, self.runtime.name)
+        for function in found:
+            self._instance.link_function(
+                function.namespace, function.name, function.wasm3_signature, function.factory(self.runtime)
+            )
+
+        unresolved = [
+            f"{namespace}.{name}" for namespace, name in missing
+            if namespace not in WASI_NAMESPACES
+        ]
+        if unresolved:
+            raise UnresolvedWasmImports(
+                f"Module '{self.name}' can not be linked: "
+                f"Imports not provided by the host: {', '.join(unresolved)}"
+            )
 
-        sys = "sys"
-        communication = "communication"
-        dht = "dht"
-        camera = "camera"
-        wasi = "wasi_snapshot_preview1"
-
-        # system functions
-        self._instance.link_function(sys, "millis", "i()", python_clock_ms)
-        self._instance.link_function(sys, "delay", "v(i)", python_delay)
-        self._instance.link_function(sys, "print", "v(*i)", Print(self.runtime).function)
-        self._instance.link_function(sys, "println", "v(*)", python_println)
-        self._instance.link_function(sys, "printInt", "v(i)", python_print_int)
-
-        # communication
-        rpc_call = RpcCall(self.runtime).function
-        self._instance.link_function(communication, "rpcCall", "v(*iii)", rpc_call)
-
-        # peripheral
-        self._instance.link_function(camera, "takeImage", "v(*i)", TakeImageDynamicSize(self.runtime).function)
-        self._instance.link_function(dht, "getTemperature", "f()", python_get_temperature)
-        self._instance.link_function(dht, "getHumidity", "f()", python_get_humidity)
-
-        # WASI functions
-        random_get = RandomGet(self.runtime).function
-        self._instance.link_function(wasi, random_get.__name__, random_get)
-
-
-# wasm3 maps wasm function argument types as follows:
-# i32 : 1
-# i64 : 2
-# f32 : 3
-# f64 : 4
-# Here mapped to python types for parsing from http-requests
-arg_types = {
-    1: int,
-    2: int,
-    3: float,
-    4: float
-}
@@ -1,9 +1,14 @@
 """General interface for Wasm utilities."""
 
 from __future__ import annotations
+import dataclasses
 from dataclasses import dataclass
+import os
 from pathlib import Path
-from typing import Any, Callable, Dict, List, Optional, Tuple, TypeAlias
+import threading
+from typing import Any, Callable, Dict, Iterable, List, Optional, Tuple, TypeAlias
+
+from host_app.wasm_utils import instance_manager
 
 
 ByteType: TypeAlias = bytes | bytearray
@@ -20,12 +25,58 @@ class IncompatibleWasmModule(RuntimeError):
     """Error raised when trying to mix incompatible Wasm modules."""
 
 
+class UnresolvedWasmImports(RuntimeError):
+    """Error raised when a Wasm module imports something that the host does
+       not provide."""
+
+
+class WasmResourceLimitExceeded(RuntimeError):
+    """Error raised when a Wasm instance tries to use more resources (e.g.,
+       linear memory) than its runtime has been limited to."""
+
+
+@dataclass
+class ResourceLimits:
+    """
+    Limits for the resources that the instances of a single Wasm runtime can
+    use together. None means no limit.
+    """
+    memory_bytes: Optional[int] = None
+    """Maximum size of linear memory in bytes"""
+    table_elements: Optional[int] = None
+    """Maximum number of elements in a table"""
+
+
+@dataclass(frozen=True)
+class FunctionSignature:
+    """Types of the parameters and the results of a Wasm function, e.g., 'i32'."""
+    params: Tuple[str, ...]
+    results: Tuple[str, ...] = ()
+
+    @property
+    def arg_types(self) -> List[type]:
+        """Get the Python types of the parameters for parsing them from requests."""
+        return [PYTHON_TYPES.get(param, int) for param in self.params]
+
+
+PYTHON_TYPES: Dict[str, type] = {"i32": int, "i64": int, "f32": float, "f64": float}
+"""Python types of the Wasm number types"""
+
+
 class WasmRuntime:
     """Superclass for Wasm runtimes."""
-    def __init__(self) -> None:
+    name: str = ""
+    """Name of the type of the runtime, one of `host_app.wasm_utils.wasm.RUNTIMES`"""
+
+    def __init__(self, limits: Optional[ResourceLimits] = None, data_dirs: Iterable[str] = ()) -> None:
         self._modules: Dict[str, WasmModule] = {}
-        self._functions: Optional[Dict[str, WasmModule]] = None
-        self._current_module_name: Optional[str] = None
+        self._exports: Dict[str, Tuple[WasmModule, FunctionSignature]] = {}
+        """Index of the exported functions of the modules by their names"""
+        self._limits: ResourceLimits = limits or ResourceLimits()
+        self._data_dirs: List[str] = list(data_dirs)
+        # Guards loading and unloading modules, which may happen concurrently
+        # from invocations and the instance manager.
+        self._lock = threading.RLock()
 
     @property
     def modules(self) -> Dict[str, WasmModule]:
@@ -35,23 +86,40 @@ class WasmRuntime:
     @property
     def functions(self) -> Dict[str, WasmModule]:
         """Get the functions loaded in the Wasm runtime and their corresponding modules."""
-        if self._functions is None:
-            self._functions = {}
-            for _, module in self._modules.items():
-                for function_name in module.functions:
-                    self._functions[function_name] = module
+        return {name: module for name, (module, _) in self._exports.items()}
 
-        return self._functions
+    def find_function(self, function_name: str) -> Optional[Tuple[WasmModule, FunctionSignature]]:
+        """
+        Return the module exporting the function and the function's signature
+        or None if no loaded module exports it. If several modules export the
+        same name, the one loaded first is returned.
+        """
+        return self._exports.get(function_name)
+
+    def _add_module(self, module: WasmModule) -> None:
+        """Add a loaded module to the runtime and index its exported functions."""
+        with self._lock:
+            self._modules[module.name] = module
+            for function_name, signature in module.signatures.items():
+                self._exports.setdefault(function_name, (module, signature))
+
+    def _reindex(self) -> None:
+        """Rebuild the index of exported functions, e.g., after unloading a module."""
+        with self._lock:
+            self._exports = {}
+            for module in self._modules.values():
+                for function_name, signature in module.signatures.items():
+                    self._exports.setdefault(function_name, (module, signature))
 
     @property
-    def current_module_name(self) -> Optional[str]:
-        """Get the name of the current module."""
-        return self._current_module_name
+    def limits(self) -> ResourceLimits:
+        """Get the resource limits of the Wasm runtime."""
+        return self._limits
 
-    @current_module_name.setter
-    def current_module_name(self, module_name: Optional[str]) -> None:
-        """Set the name of the current module."""
-        self._current_module_name = module_name
+    @property
+    def data_dirs(self) -> List[str]:
+        """Get the directories of files that the modules can access."""
+        return self._data_dirs
 
     def load_module(self, module: ModuleConfig) -> Optional[WasmModule]:
         """Load a module into the Wasm runtime."""
@@ -61,11 +129,39 @@ class WasmRuntime:
         """Get a module from the Wasm runtime, or load it if it is not found."""
         if module is None:
             return None
-        wasm_module = self.modules.get(module.name)
-        if wasm_module is None:
+        with self._lock:
+            wasm_module = self.modules.get(module.name)
+            if wasm_module is not None:
+                instance_manager.get_manager().touch(wasm_module)
+                return wasm_module
             wasm_module = self.load_module(module)
+        if wasm_module is not None:
+            instance_manager.get_manager().track(self, wasm_module)
         return wasm_module
 
+    def unload_module(self, module_name: str) -> None:
+        """
+        Release the instance of a loaded module. The module is loaded again on
+        its next use with `get_or_load_module`.
+        """
+        with self._lock:
+            module = self._modules.pop(module_name, None)
+            if module is None:
+                return
+            instance_manager.get_manager().forget(module)
+            module.close()
+            self._reindex()
+
+    def close(self) -> None:
+        """Release the instances of the loaded modules. The runtime can not be
+        used afterwards."""
+        with self._lock:
+            for module in self._modules.values():
+                instance_manager.get_manager().forget(module)
+                module.close()
+            self._modules.clear()
+            self._exports = {}
+
     def read_from_memory(self, address: int, length: int, module_name: Optional[str] = None
     ) -> Tuple[bytes, Optional[str]]:
         """Read from the runtime memory and return the result.
@@ -93,12 +189,10 @@ class WasmRuntime:
                 return None
             return module.run_function(function_name, params)
 
-        for _, module in self.modules.items():
-            func = module._get_function(function_name)  # pylint: disable=protected-access
-            if func is not None:
-                # print(f"Found function {function_name} in module {module.name}")
-                return module.run_function(function_name, params)
-        return None
+        found = self.find_function(function_name)
+        if found is None:
+            return None
+        return found[0].run_function(function_name, params)
 
 
 class WasmModule:
@@ -110,7 +204,7 @@ class WasmModule:
         self._name = config.name
         self._path = config.path
         self._runtime: WasmRuntime = runtime
-        self._functions: Optional[List[str]] = None
+        self._signatures: Optional[Dict[str, FunctionSignature]] = None
 
     @property
     def id(self) -> str:  # pylint: disable=invalid-name
@@ -137,27 +231,69 @@ class WasmModule:
         """Set the runtime of the Wasm module."""
         self._runtime = runtime
 
+    @property
+    def memory_size(self) -> Optional[int]:
+        """
+        Get the current size of the Wasm module's linear memory in bytes or
+        None if the module has not been instantiated.
+        """
+        raise NotImplementedError
+
+    @property
+    def code_size(self) -> int:
+        """Get the size of the Wasm module's code in bytes."""
+        try:
+            return os.path.getsize(self.path)
+        except OSError:
+            return 0
+
+    @property
+    def signatures(self) -> Dict[str, FunctionSignature]:
+        """Get the exported functions of the Wasm module and their signatures."""
+        if self._signatures is None:
+            self._signatures = {} if self.runtime is None else self._get_signatures()
+        return self._signatures
+
     @property
     def functions(self) -> List[str]:
-        """Get the names of the known functions of the Wasm module."""
-        if self._functions is None:
-            if self.runtime is None:
-                self._functions = []
-            else:
-                self._functions = self._get_all_functions()
-        return self._functions
+        """Get the names of the exported functions of the Wasm module."""
+        return list(self.signatures)
+
+    def close(self) -> None:
+        """Release the instance of the Wasm module."""
+
+    @property
+    def needs_isolation(self) -> bool:
+        """
+        Return True if the module can access other directories than the ones
+        of its runtime only with a new instance (see `new_isolated`), and
+        False if it can through the invocation context.
+        """
+        return False
+
+    def new_isolated(self, config: ModuleConfig, data_dirs: List[str]) -> Optional[WasmModule]:
+        """
+        Create a new instance of the module in a runtime of its own that gives
+        it the given data directories instead of the runtime's ones. Return
+        None if the module can use other directories without a new instance,
+        i.e., through the invocation context.
+
+        The caller closes the runtime of the new instance once done with it.
+        """
+        return None
 
     def _get_function(self, function_name: str) -> Optional[FunctionType]:
         """Get a function from the Wasm module. If the function is not found, return None."""
         raise NotImplementedError
 
-    def _get_all_functions(self) -> List[str]:
-        """Get the names of the all known functions in the Wasm module."""
+    def _get_signatures(self) -> Dict[str, FunctionSignature]:
+        """Get the exported functions of the Wasm module and their signatures."""
         raise NotImplementedError
 
     def get_arg_types(self, function_name: str) -> List[type]:
         """Get the argument types of a function from the Wasm module."""
-        raise NotImplementedError
+        signature = self.signatures.get(function_name)
+        return signature.arg_types if signature is not None else []
 
     def run_function(self, function_name: str, params: List[Any]) -> Any:
         """Run a function from the Wasm module and return the result."""
@@ -260,7 +396,7 @@ class WasmModule:
         raise NotImplementedError
 
     def _link_remote_functions(self) -> None:
-        """Link the remote functions to the Wasm module."""
+        """Link the host functions imported by the Wasm module."""
         raise NotImplementedError
 
 ModuleDescription = dict[str, Any]
@@ -282,12 +418,39 @@ class ModuleConfig:
     data_files: dict[str, Path]
     ml_model: Optional[MLModel] = None
     data_ptr_function_name: str = "get_img_ptr"
+    digest: Optional[str] = None
+    """SHA-256 of the module's binary and data files used for detecting changes"""
 
     def set_model_from_data_files(self, key: str = "model.pb") -> None:
         """Sets the model using the indicated data file."""
         if key in self.data_files:
             self.ml_model = MLModel(str(self.data_files[key]))
 
+    def as_dict(self) -> dict[str, Any]:
+        """Return the configuration in a JSON-serializable form."""
+        return {
+            "id": self.id,
+            "name": self.name,
+            "path": self.path,
+            "data_files": {key: str(path) for key, path in self.data_files.items()},
+            "ml_model": dataclasses.asdict(self.ml_model) if self.ml_model is not None else None,
+            "data_ptr_function_name": self.data_ptr_function_name,
+            "digest": self.digest,
+        }
+
+    @classmethod
+    def from_dict(cls, data: dict[str, Any]) -> ModuleConfig:
+        """Create a configuration from the form returned by `as_dict`."""
+        return cls(
+            id=data["id"],
+            name=data["name"],
+            path=data["path"],
+            data_files={key: Path(path) for key, path in data["data_files"].items()},
+            ml_model=MLModel(**data["ml_model"]) if data.get("ml_model") else None,
+            data_ptr_function_name=data.get("data_ptr_function_name", "get_img_ptr"),
+            digest=data.get("digest"),
+        )
+
 
 
 @dataclass
@@ -0,0 +1,203 @@
+"""
+Reading the sections of Wasm binaries that runtimes do not expose, such as
+the imports and exports of a module parsed by Wasm3.
+"""
+
+from __future__ import annotations
+from dataclasses import dataclass
+from typing import Dict, List, Optional, Tuple
+
+WASM_MAGIC = b"\0asm"
+TYPE_SECTION_ID = 1
+IMPORT_SECTION_ID = 2
+FUNCTION_SECTION_ID = 3
+EXPORT_SECTION_ID = 7
+
+FUNCTION_TYPE_FORM = 0x60
+
+EXTERNAL_KINDS = {0: "func", 1: "table", 2: "memory", 3: "global", 4: "tag"}
+
+VALUE_TYPES = {
+    0x7F: "i32", 0x7E: "i64", 0x7D: "f32", 0x7C: "f64", 0x7B: "v128", 0x70: "funcref", 0x6F: "externref"
+}
+
+FunctionType = Tuple[Tuple[str, ...], Tuple[str, ...]]
+"""Types of the parameters and the results of a function, e.g., (('i32', 'i32'), ('i32',))"""
+
+
+@dataclass(frozen=True)
+class WasmImport:
+    """An import of a Wasm module."""
+    module: str
+    name: str
+    kind: str
+    """One of 'func', 'table', 'memory', 'global' or 'tag'"""
+    type_index: Optional[int] = None
+    """Index of the type of an imported function"""
+
+
+@dataclass(frozen=True)
+class WasmExport:
+    """An export of a Wasm module."""
+    name: str
+    kind: str
+    """One of 'func', 'table', 'memory', 'global' or 'tag'"""
+    index: int
+    """Index of the exported item in its index space"""
+
+
+class _Reader:
+    """Cursor over the bytes of a Wasm binary."""
+    def __init__(self, data: bytes) -> None:
+        self.data = data
+        self.offset = 0
+
+    def byte(self) -> int:
+        """Read a single byte."""
+        if self.offset >= len(self.data):
+            raise ValueError("Unexpected end of Wasm binary")
+        value = self.data[self.offset]
+        self.offset += 1
+        return value
+
+    def u32(self) -> int:
+        """Read an unsigned LEB128 integer."""
+        result, shift = 0, 0
+        while True:
+            byte = self.byte()
+            result |= (byte & 0x7F) << shift
+            if not byte & 0x80:
+                return result
+            shift += 7
+
+    def name(self) -> str:
+        """Read a length-prefixed UTF-8 string."""
+        length = self.u32()
+        value = self.data[self.offset:self.offset + length]
+        if len(value) != length:
+            raise ValueError("Unexpected end of Wasm binary")
+        self.offset += length
+        return value.decode("utf-8")
+
+    def value_type(self) -> str:
+        """Read a value type."""
+        value_type = self.byte()
+        if value_type not in VALUE_TYPES:
+            raise ValueError(f"Unknown value type {value_type:#x}")
+        return VALUE_TYPES[value_type]
+
+    def limits(self) -> None:
+        """Skip the limits of a table or memory."""
+        flags = self.byte()
+        self.u32()
+        if flags & 0x01:
+            self.u32()
+
+
+def _sections(data: bytes) -> List[Tuple[int, bytes]]:
+    """Return the ids and contents of the sections of a Wasm binary."""
+    if data[:4] != WASM_MAGIC:
+        raise ValueError("Not a Wasm binary")
+    reader = _Reader(data)
+    reader.offset = 8
+    sections = []
+    while reader.offset < len(data):
+        section_id = reader.byte()
+        size = reader.u32()
+        sections.append((section_id, data[reader.offset:reader.offset + size]))
+        reader.offset += size
+    return sections
+
+
+def _read_types(content: bytes) -> List[FunctionType]:
+    """Return the function types of a type section."""
+    reader = _Reader(content)
+    types = []
+    for _ in range(reader.u32()):
+        form = reader.byte()
+        if form != FUNCTION_TYPE_FORM:
+            raise ValueError(f"Unsupported type form {form:#x}")
+        params = tuple(reader.value_type() for _ in range(reader.u32()))
+        results = tuple(reader.value_type() for _ in range(reader.u32()))
+        types.append((params, results))
+    return types
+
+
+def _read_import_entries(content: bytes) -> List[WasmImport]:
+    """Return the imports of an import section."""
+    reader = _Reader(content)
+    imports = []
+    for _ in range(reader.u32()):
+        module, name = reader.name(), reader.name()
+        kind = reader.byte()
+        type_index = None
+        if kind == 0:
+            type_index = reader.u32()
+        elif kind == 1:
+            reader.byte()
+            reader.limits()
+        elif kind == 2:
+            reader.limits()
+        elif kind == 3:
+            reader.byte()
+            reader.byte()
+        elif kind == 4:
+            reader.byte()
+            reader.u32()
+        else:
+            raise ValueError(f"Unknown import kind {kind}")
+        imports.append(WasmImport(module, name, EXTERNAL_KINDS[kind], type_index))
+    return imports
+
+
+def _read_export_entries(content: bytes) -> List[WasmExport]:
+    """Return the exports of an export section."""
+    reader = _Reader(content)
+    exports = []
+    for _ in range(reader.u32()):
+        name = reader.name()
+        kind = reader.byte()
+        if kind not in EXTERNAL_KINDS:
+            raise ValueError(f"Unknown export kind {kind}")
+        exports.append(WasmExport(name, EXTERNAL_KINDS[kind], reader.u32()))
+    return exports
+
+
+def read_imports(data: bytes) -> List[WasmImport]:
+    """Return the imports of a Wasm binary. Raise ValueError if it is malformed."""
+    imports = []
+    for section_id, content in _sections(data):
+        if section_id == IMPORT_SECTION_ID:
+            imports.extend(_read_import_entries(content))
+    return imports
+
+
+def read_export_signatures(data: bytes) -> Dict[str, FunctionType]:
+    """
+    Return the types of the exported functions of a Wasm binary by their
+    export names. Raise ValueError if it is malformed.
+    """
+    types: List[FunctionType] = []
+    function_types: List[int] = []
+    """Type index of each function in the function index space"""
+    exports: List[WasmExport] = []
+    for section_id, content in _sections(data):
+        if section_id == TYPE_SECTION_ID:
+            types = _read_types(content)
+        elif section_id == IMPORT_SECTION_ID:
+            function_types.extend(
+                item.type_index for item in _read_import_entries(content)
+                if item.type_index is not None
+            )
+        elif section_id == FUNCTION_SECTION_ID:
+            reader = _Reader(content)
+            function_types.extend(reader.u32() for _ in range(reader.u32()))
+        elif section_id == EXPORT_SECTION_ID:
+            exports = _read_export_entries(content)
+    try:
+        return {
+            item.name: types[function_types[item.index]]
+            for item in exports if item.kind == "func"
+        }
+    except IndexError as error:
+        raise ValueError("Exported function or its type not found in Wasm binary") from error
@@ -1,44 +1,83 @@
 """Wasmtime Python bindings."""
 
 from __future__ import annotations
-import os
-from typing import Any, List, Optional, Tuple
+from time import perf_counter
+from typing import Any, Dict, Iterable, List, Optional, Set, Tuple
 
 from wasmtime import (
-    Config, Engine, Func, FuncType, Instance, Linker, Memory, Module,
-    Store, ValType, WasiConfig, WasmtimeError
+    Engine, Func, FuncType, ImportType, Instance, Linker, Memory, Module,
+    Store, Trap, ValType, WasiConfig, WasmtimeError
 )
 
-from host_app.wasm_utils.general_utils import (
-    python_clock_ms, python_delay, python_print_int, python_println, python_get_temperature,
-    python_get_humidity, Print, TakeImageDynamicSize, TakeImageStaticSize, RpcCall
-)
+from host_app.utils import metrics
+from host_app.wasm_utils.compiler import engine_config
+from host_app.wasm_utils import module_cache
+from host_app.wasm_utils import host_functions, invocation
 from host_app.wasm_utils.wasm_api import (
-    WasmRuntime, WasmModule, ModuleConfig, IncompatibleWasmModule
+    WasmRuntime, WasmModule, ModuleConfig, FunctionSignature, IncompatibleWasmModule, ResourceLimits,
+    UnresolvedWasmImports, WasmResourceLimitExceeded
 )
 
-SERIALIZED_MODULE_POSTFIX = ".SERIALIZED.wasm"
+WASM_PAGE_SIZE = 64 * 1024
+"""Size of a WebAssembly linear memory page in bytes."""
+
+VAL_TYPES = {
+    "i32": ValType.i32(),
+    "i64": ValType.i64(),
+    "f32": ValType.f32(),
+    "f64": ValType.f64(),
+    "ptr": ValType.i32(),
+}
+"""Wasmtime types of the parameters and results of host functions"""
+
+_engine: Optional[Engine] = None
+
+
+def get_engine() -> Engine:
+    """
+    Get the Wasmtime engine shared by all the runtimes, so that compiled
+    code and compiler state are not duplicated for each of them.
+    """
+    global _engine  # pylint: disable=global-statement
+    if _engine is None:
+        _engine = Engine(engine_config())
+    return _engine
 
 
 class WasmtimeRuntime(WasmRuntime):
     """Wasmtime runtime class."""
-    def __init__(self, data_dirs=[]) -> None:
-        super().__init__()
-        self._engine = Engine(Config())
-        self._store = Store(self._engine)
+    name = "wasmtime"
+
+    def __init__(self, data_dirs=[], limits: Optional[ResourceLimits] = None) -> None:
+        super().__init__(limits, data_dirs)
+        self._engine = get_engine()
+        self._store = self._new_store()
         self._linker = Linker(self._engine)
         self._linker.define_wasi()
-        self._wasi = WasiConfig()
-        self._wasi.inherit_stdout()
-        self._wasi.inherit_env()
+        # Host functions are defined in the linker once a module imports them.
+        self._linked: Set[Tuple[str, str]] = set()
+
+    def _new_store(self) -> Store:
+        """Create a store with the resource limits and WASI context of the runtime."""
+        store = Store(self._engine)
+        # Limit the resources that instances in the store can grow to. With
+        # Wasmtime, -1 stands for "no limit".
+        store.set_limits(
+            memory_size=self.limits.memory_bytes if self.limits.memory_bytes is not None else -1,
+            table_elements=self.limits.table_elements if self.limits.table_elements is not None else -1,
+        )
+        # The store takes ownership of the WASI configuration, so a new one is
+        # needed for each store.
+        wasi = WasiConfig()
+        wasi.inherit_stdout()
+        wasi.inherit_env()
         # Open directories for the module to access at its root.
-        for data_dir in data_dirs:
+        for data_dir in self._data_dirs:
             guest_dir = "."
             print(f"Mounting {data_dir} to {guest_dir}")
-            self._wasi.preopen_dir(data_dir, guest_dir)
-        self._store.set_wasi(self._wasi)
-
-        self._link_remote_functions()
+            wasi.preopen_dir(data_dir, guest_dir)
+        store.set_wasi(wasi)
+        return store
 
     @property
     def engine(self) -> Engine:
@@ -65,9 +104,26 @@ class WasmtimeRuntime(WasmRuntime):
             return wasm_module
 
         wasm_module = WasmtimeModule(module, self)
-        self._modules[module.name] = wasm_module
+        self._add_module(wasm_module)
         return wasm_module
 
+    def unload_module(self, module_name: str) -> None:
+        """
+        Release the instance of a loaded module. Wasmtime frees the memory of
+        instances only with their store, so the store is replaced once no
+        modules are left in it.
+        """
+        with self._lock:
+            super().unload_module(module_name)
+            if not self._modules:
+                self._store.close()
+                self._store = self._new_store()
+
+    def close(self) -> None:
+        """Release the instances and the store along with its WASI context."""
+        super().close()
+        self._store.close()
+
     def read_from_memory(self, address: int, length: int, module_name: Optional[str] = None
     ) -> Tuple[bytes | bytearray, Optional[str]]:
         """Read from the runtime memory and return the result.
@@ -84,6 +140,7 @@ class WasmtimeRuntime(WasmRuntime):
                 raise RuntimeError(f"Module {module.name} has no memory!")
             block = module_memory.read(self.store, address, address + length)
             print(f"Read {len(block)} bytes from memory at address {address}")
+            metrics.memory_bytes.inc(len(block), direction="read")
             return block, None
 
         # TODO: check if there is a way to read from the memory without going through the modules
@@ -122,6 +179,7 @@ class WasmtimeRuntime(WasmRuntime):
             if module_memory is None:
                 raise MemoryError
             module_memory.write(self.store, bytes_data, start=address)
+            metrics.memory_bytes.inc(len(bytes_data), direction="write")
             return None
 
         # TODO: check if there is a way to write to the memory without going through the modules
@@ -146,55 +204,131 @@ class WasmtimeRuntime(WasmRuntime):
             f"WebAssembly memory at address ({address}): {error_str}"
         )
 
-    def _link_remote_functions(self) -> None:
-        sys = "sys"
-        communication = "communication"
-        dht = "dht"
-        camera = "camera"
-
-        i32: ValType = ValType.i32()
-        f32: ValType = ValType.f32()
-
-        # system functions
-        self.linker.define_func(sys, "millis", FuncType([], [i32]), python_clock_ms)
-        self.linker.define_func(sys, "delay", FuncType([i32], []), python_delay)
-        self.linker.define_func(sys, "print", FuncType([i32, i32], []), Print(self).function)
-        self.linker.define_func(sys, "println", FuncType([i32], []), python_println)
-        self.linker.define_func(sys, "printInt", FuncType([i32], []), python_print_int)
-
-        # communication
-        rpc_call = RpcCall(self).function
-        self.linker.define_func(communication, "rpcCall", FuncType([i32, i32, i32, i32], []), rpc_call)
-
-        # peripheral
-        take_image_dynamic_size = TakeImageDynamicSize(self).function
-        take_image_static_size = TakeImageStaticSize(self).function
-        self.linker.define_func(camera, "takeImageDynamicSize", FuncType([i32, i32], []), take_image_dynamic_size)
-        self.linker.define_func(camera, "takeImageStaticSize", FuncType([i32, i32], []), take_image_static_size)
-        self.linker.define_func(dht, "getTemperature", FuncType([], [f32]), python_get_temperature)
-        self.linker.define_func(dht, "getHumidity", FuncType([], [f32]), python_get_humidity)
+    def link_imports(self, imports: Iterable[ImportType]) -> None:
+        """
+        Define the host functions that satisfy the imports in the linker.
+        Raise UnresolvedWasmImports if some of the imports are not available.
+        """
+        function_imports = [
+            (item.module, item.name) for item in imports
+            if isinstance(item.type, FuncType) and (item.module, item.name) not in self._linked
+        ]
+        found, _ = host_functions.resolve(function_imports, self.name)
+        for function in found:
+            self.linker.define_func(
+                function.namespace,
+                function.name,
+                FuncType([VAL_TYPES[x] for x in function.params], [VAL_TYPES[x] for x in function.results]),
+                function.factory(self),
+            )
+            self._linked.add((function.namespace, function.name))
+
+        # The rest of the imports need to be found in the linker, e.g., WASI.
+        unresolved = []
+        for item in imports:
+            if (item.module, item.name) in self._linked:
+                continue
+            try:
+                self.linker.get(self.store, item.module, item.name or "")
+            except WasmtimeError:
+                unresolved.append(f"{item.module}.{item.name}")
+        if unresolved:
+            raise UnresolvedWasmImports(f"Imports not provided by the host: {', '.join(unresolved)}")
 
 
 class WasmtimeModule(WasmModule):
-    """Wasmtime module class."""
-    def __init__(self, config: ModuleConfig, runtime: WasmtimeRuntime) -> None:
+    """
+    Wasmtime module class.
+
+    :param compiled: Compiled module shared with another instance of the
+    module, so that it is not loaded again.
+    """
+    def __init__(self, config: ModuleConfig, runtime: WasmtimeRuntime, compiled: Optional[Module] = None) -> None:
         self._module: Optional[Module] = None
+        self._shared_module = compiled is not None
         self._instance: Optional[Instance] = None
+        # Getting the exports of an instance goes through all of them, so the
+        # functions are looked up once.
+        self._function_cache: Dict[str, Func] = {}
         super().__init__(config, runtime)
-        self._link_remote_functions()
-        self._load_module()
+        self._load_module(compiled)
 
     def get_memory(self) -> Optional[Memory]:
         """Get the Wasmtime memory."""
         if self._instance is None or not isinstance(self.runtime, WasmtimeRuntime):
             return None
-        memory = self._instance.exports(self.runtime.store)["memory"]
+        memory = self._instance.exports(self.runtime.store).get("memory")
         if isinstance(memory, Memory):
             return memory
         return None
 
+    @property
+    def memory_size(self) -> Optional[int]:
+        """Get the current size of the module's linear memory in bytes."""
+        if not isinstance(self.runtime, WasmtimeRuntime):
+            return None
+        memory = self.get_memory()
+        if memory is None:
+            return None
+        return memory.data_len(self.runtime.store)
+
+    @property
+    def code_size(self) -> int:
+        """Get the size of the module's compiled code in bytes."""
+        cached_path = module_cache.get_cache().path_for(self.path)
+        try:
+            if cached_path is not None:
+                return cached_path.stat().st_size
+        except OSError:
+            pass
+        return super().code_size
+
+    def close(self) -> None:
+        """Release the instance and the compiled module."""
+        super().close()
+        self._function_cache.clear()
+        self._instance = None
+        if self._module is not None and not self._shared_module:
+            self._module.close()
+        self._module = None
+
+    @property
+    def needs_isolation(self) -> bool:
+        """Return True, as WASI opens the module's directories when it is instantiated."""
+        return True
+
+    def new_isolated(self, config: ModuleConfig, data_dirs: List[str]) -> Optional[WasmModule]:
+        """
+        Create a new instance of the module in a runtime that opens the given
+        data directories. WASI opens the directories when an instance is
+        created, so a running instance can not be given others. The compiled
+        module is shared, so this only costs instantiating it.
+        """
+        if self._module is None or not isinstance(self.runtime, WasmtimeRuntime):
+            return None
+        runtime = WasmtimeRuntime(data_dirs, limits=self.runtime.limits)
+        module = WasmtimeModule(config, runtime, compiled=self._module)
+        # The compiled module is released with this instance, which may
+        # happen first, so the signatures are not read from it later.
+        module._signatures = self.signatures  # pylint: disable=protected-access
+        runtime._add_module(module)  # pylint: disable=protected-access
+        return module
+
+    def _memory_limit_reached(self) -> bool:
+        """Return True if the linear memory can not grow even by a single page."""
+        if self.runtime is None or self.runtime.limits.memory_bytes is None:
+            return False
+        memory_size = self.memory_size
+        return (
+            memory_size is not None and
+            memory_size + WASM_PAGE_SIZE > self.runtime.limits.memory_bytes
+        )
+
     def _get_function(self, function_name: str) -> Optional[Func]:
         """Get a function from the Wasm module. If the function is not found, return None."""
+        func = self._function_cache.get(function_name)
+        if func is not None:
+            return func
         if self.runtime is None:
             print("Runtime not set!")
             return None
@@ -208,57 +342,55 @@ class WasmtimeModule(WasmModule):
         try:
             func = self._instance.exports(self.runtime.store)[function_name]
             if isinstance(func, Func):
+                self._function_cache[function_name] = func
                 return func
             print(f"'{function_name}' is not a function!")
             return None
-        except RuntimeError:
+        except (KeyError, RuntimeError):
             print(f"Function '{function_name}' not found!")
             return None
 
-    def _get_all_functions(self) -> List[str]:
-        """Get the names of the all known functions in the Wasm module."""
+    def _get_signatures(self) -> Dict[str, FunctionSignature]:
+        """Get the exported functions of the Wasm module and their signatures."""
         if self._module is None:
-            return []
-        return [
-            item.name
-            for item in self._module.imports
-            if isinstance(item, Func) and item.name is not None
-        ]
-
-    def get_arg_types(self, function_name: str) -> List[type]:
-        """Get the argument types of a function from the Wasm module."""
-        if not isinstance(self.runtime, WasmtimeRuntime):
-            return []
-
-        func = self._get_function(function_name)
-        if func is None:
-            return []
-        return [
-            arg_types[str(x)]
-            for x in func.type(self.runtime.store).params
-        ]
+            return {}
+        return {
+            item.name: FunctionSignature(
+                tuple(str(x) for x in item.type.params),
+                tuple(str(x) for x in item.type.results),
+            )
+            for item in self._module.exports
+            if isinstance(item.type, FuncType)
+        }
 
     def run_function(self, function_name: str, params: List[Any]) -> Any:
         """Run a function from the Wasm module and return the result."""
         if not isinstance(self.runtime, WasmtimeRuntime):
             return None
 
-        # TODO: this approach is used in order to allocate required memory to the correct module
-        # in external functions like take_image. It is not thread safe and can cause problems.
-        self.runtime.current_module_name = self.name
-
         func = self._get_function(function_name)
         if func is None:
             print(f"Function '{function_name}' not found!")
             return None
 
         print(f"({self.name}) Running function '{function_name}' with params: {params}")
-        if not params:
-            return func(self.runtime.store)
-        return func(self.runtime.store, *params)
-
-    def _load_module(self) -> None:
-        """Load the Wasm module into the Wasm runtime."""
+        try:
+            with invocation.invocation(self):
+                if not params:
+                    return func(self.runtime.store)
+                return func(self.runtime.store, *params)
+        except Trap as error:
+            # Guests usually trap when memory allocation fails, so report a
+            # breach of the memory limit distinctly from other traps.
+            if self._memory_limit_reached():
+                raise WasmResourceLimitExceeded(
+                    f"Module '{self.name}' exceeded its memory limit of "
+                    f"{self.runtime.limits.memory_bytes} bytes in function '{function_name}'"
+                ) from error
+            raise
+
+    def _load_module(self, compiled: Optional[Module] = None) -> None:
+        """Load the Wasm module into the Wasm runtime, compiling it if not given."""
         if self.runtime is None:
             print("Runtime not set!")
             return
@@ -268,42 +400,55 @@ class WasmtimeModule(WasmModule):
             print("Linker not set!")
             return
 
-        path_serial = self.path + SERIALIZED_MODULE_POSTFIX
-        try:
-            if os.path.getmtime(self.path) > os.path.getmtime(path_serial):
-                raise WasmtimeError("Serialized module is older than the original")
+        cache = module_cache.get_cache()
+        module = compiled
+        if module is None and (cached_path := cache.lookup(self.path)) is not None:
+            try:
+                module = Module.deserialize_file(self.runtime.engine, str(cached_path))
+                metrics.module_loads.inc(source="deserialize")
+            except WasmtimeError as error:
+                print(f"Could not load compiled module from cache: {error}")
+                cache.discard(cached_path)
 
-            # try to load the module from the serialized version
-            module = Module.deserialize_file(self.runtime.engine, path_serial)
-        except (IOError, WasmtimeError):
-            print("Could not load serialized module, compiling from source")
+        if module is None:
             # compile the module which can be a slow process
             module = Module.from_file(self.runtime.engine, self.path)
-            # write a serialized version of the module to disk for later use
-            byte_module: bytearray = Module.serialize(module)
+            metrics.module_loads.inc(source="compile")
+            # save the compiled module to disk for later use
             try:
-                with open(path_serial, "wb") as serialized_module:
-                    serialized_module.write(byte_module)
+                cache.store(self.path, module.serialize())
             except IOError as error:
                 print(error)
 
         self._module = module
-        self._instance = self.runtime.linker.instantiate(self.runtime.store, module)
+        self._link_remote_functions()
+        try:
+            start = perf_counter()
+            self._instance = self.runtime.linker.instantiate(self.runtime.store, module)
+            metrics.instantiation_seconds.observe(perf_counter() - start, runtime="wasmtime")
+        except WasmtimeError as error:
+            if "exceeds memory limits" in str(error) or "exceeds table limits" in str(error):
+                raise WasmResourceLimitExceeded(
+                    f"Module '{self.name}' can not be instantiated within limits "
+                    f"{self.runtime.limits}: {error}"
+                ) from error
+            raise
 
     def _link_remote_functions(self) -> None:
-        """Link some remote functions to the Wasmtime module.
-
-        Note: with Wasmtime the standalone functions that do not require
-        allocating WebAssembly memory have been linked to the runtime, not the module, in advance.
-
-        Since there can be only function with the same name in the runtime, the memory allocation
-        functions are handled using current_module_name variable from the runtime.
         """
+        Link the host functions imported by the module to the runtime's
+        linker. Raise UnresolvedWasmImports if the module imports something
+        that is not available, so that the module is rejected before it is
+        instantiated.
+
+        Since there can be only one function with the same name in the
+        runtime, the host functions that access memory find the calling
+        module from the invocation context.
+        """
+        if self._module is None or not isinstance(self.runtime, WasmtimeRuntime):
+            return
+        try:
+            self.runtime.link_imports(self._module.imports)
+        except UnresolvedWasmImports as error:
+            raise UnresolvedWasmImports(f"Module '{self.name}' can not be linked: {error}") from error
 
-
-arg_types = {
-    str(ValType.i32()): int,
-    str(ValType.i64()): int,
-    str(ValType.f32()): float,
-    str(ValType.f64()): float
-}